@@ -1,18 +1,21 @@
 from json import JSONDecodeError
-from video.library import DBLibrary
+from video.library import DBLibrary, WatchList
 from starlette.applications import Starlette
 from starlette.routing import Route
 from starlette.requests import Request
-from starlette.responses import JSONResponse, Response
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
 from typing import Tuple
 from errors.http_error import not_found_404, bad_request_400, internal_server_500, service_unavailable_503
 from video.downloader import DownloadManager, MangaDownloader
 from scraper import Animepahe, MyAL, MangaKatana, Proxy
+from scraper.parser import shutdown_executor
 from video.streamer import Stream
 from config import ServerConfig, FileConfig
 from starlette.middleware import Middleware
 from starlette.middleware.cors import CORSMiddleware
 from utils.headers import get_headers
+from utils.http_client import HttpClient
 from utils.master_m3u8 import build_master_manifest
 from middleware import ErrorHandlerMiddleware, RequestValidator
 import uvicorn
@@ -20,10 +23,12 @@ from starlette.routing import Mount
 from urllib.parse import parse_qsl
 from utils.init_db import DB
 from utils import remove_file, CustomStaticFiles
-from sqlite3 import IntegrityError
 from sys import modules
 from glob import glob
+from contextlib import asynccontextmanager
+import asyncio
 import logging
+from aiohttp import ClientResponseError
 
 
 async def LiSA(request: Request):
@@ -136,14 +141,24 @@ async def get_ep_details(request: Request):
 
     scraper = Animepahe()
 
-    if anime_id:
-        redirected_url = (await scraper.get(f"{Animepahe.site_url}/a/{anime_id}")).url
-        anime_session = str(redirected_url).replace(f"{Animepahe.site_url}/anime/", "")
+    try:
+        if anime_id:
+            anime_session = await scraper.get_anime_session(anime_id)
+    except ValueError:
+        return await bad_request_400(request, msg="invalid anime-id: should be of type int")
 
     page = request.query_params.get("page", "1")
 
     try:
-        return JSONResponse(await scraper.get_episode_details(anime_session=anime_session, page_no=page))
+        try:
+            return JSONResponse(await scraper.get_episode_details(anime_session=anime_session, page_no=page))
+        except (TypeError, JSONDecodeError, ClientResponseError) as err:
+            if not anime_id or (isinstance(err, ClientResponseError) and not 400 <= err.status < 500):
+                raise
+            # saved session may have expired upstream, it is dropped first so a failed refresh doesn't leave it behind
+            scraper.forget_anime_session(int(anime_id))
+            anime_session = await scraper.get_anime_session(anime_id, refresh=True)
+            return JSONResponse(await scraper.get_episode_details(anime_session=anime_session, page_no=page))
     except TypeError:
         return await not_found_404(request, msg="Anime, Not yet Aired...")
     except JSONDecodeError:
@@ -242,25 +257,42 @@ async def download(request: Request):
         # if anime session or manga_session exists start batch download
 
         typ = "video" if (jb.get("anime_session", None) or jb.get("manifest_url", None)) else "image"
+        priority = int(jb["priority"]) if jb.get("priority", None) is not None else None  # higher downloads first
 
         match typ:
             case "video":
                 site = "animepahe"
 
                 if jb.get("anime_session", None):
-                    await DownloadManager.schedule(typ, jb["anime_session"], site, page=jb.get("page_no", 1))
+                    filters = {"aud": jb.get("audio", "jpn"), "quality": int(jb["quality"]) if jb.get("quality", None) else None}
+                    if jb.get("episodes", None):  # [first, last] episode numbers, both included
+                        episodes = jb["episodes"]
+                        try:
+                            if not isinstance(episodes, list) or len(episodes) != 2:
+                                raise ValueError
+                            first, last = float(episodes[0]), float(episodes[1])
+                        except (TypeError, ValueError):
+                            return await bad_request_400(request, msg="episodes must be [first, last] episode numbers")
+                        if first > last:
+                            return await bad_request_400(request, msg="first episode is after the last one")
+                        filters["ep_range"] = (first, last)
+                    # all_pages schedules the whole series instead of a single release page
+                    page = None if jb.get("all_pages", False) else jb.get("page_no", 1)
+                    await DownloadManager.schedule(typ, jb["anime_session"], site, page=page, priority=priority, **filters)
 
                 elif jb.get("manifest_url", None):
-                    await DownloadManager.schedule(typ, manifest_url=parse_qsl(jb["manifest_url"])[0][1], site=site)
+                    await DownloadManager.schedule(typ, manifest_url=parse_qsl(jb["manifest_url"])[0][1], site=site,
+                                                   priority=priority)
 
             case "image":
                 site = "mangakatana"
 
                 if jb.get("manga_session", None):
-                    await DownloadManager.schedule(typ, jb["manga_session"], site=site, page=jb.get("page_no", 1))
+                    await DownloadManager.schedule(typ, jb["manga_session"], site=site, page=jb.get("page_no", 1),
+                                                   priority=priority)
 
                 elif jb.get("chp_session", None):
-                    await DownloadManager.schedule(typ, manifest_url=jb["chp_session"], site=site)
+                    await DownloadManager.schedule(typ, manifest_url=jb["chp_session"], site=site, priority=priority)
 
                 else:
                     return await bad_request_400(request, msg="Malformed body: pass manifest url or anime session")
@@ -312,6 +344,46 @@ async def cancel_download(request: Request):
         return await bad_request_400(request, msg="One or more ids are invalid")
 
 
+async def prioritize_download(request: Request):
+    """set the priority of tasks (higher downloads first), queued tasks keep their place in the queue"""
+    try:
+        task_ids = request.state.body.get("id", None)
+        if not task_ids:
+            return await bad_request_400(request, msg="download id not present")
+        DownloadManager.set_priority(task_ids, int(request.state.body.get("priority", 0)))
+        return JSONResponse({"msg": "priority of all tasks is successfully updated"})
+    except KeyError:
+        return await bad_request_400(request, msg="One or more ids are invalid")
+    except ValueError:
+        return await bad_request_400(request, msg="priority must be an integer")
+
+
+async def limit_bandwidth(request: Request):
+    """limit all downloads to `limit` bytes/s at runtime, null or 0 for no cap. {"profiles": true} goes back to the
+    configured limit and day profiles"""
+    try:
+        limit = request.state.body.get("limit", None)
+        limit = None if limit is None else int(limit)
+        profiles = bool(request.state.body.get("profiles", False))
+        return JSONResponse({"limit": DownloadManager.set_bandwidth(limit, profiles)})
+    except (TypeError, ValueError):
+        return await bad_request_400(request, msg="limit must be an integer or null")
+    except AttributeError as err_msg:
+        return await bad_request_400(request, msg=str(err_msg))
+
+
+async def reorder_download(request: Request):
+    """download tasks before the other tasks of their priority, in the given order"""
+    try:
+        task_ids = request.state.body.get("id", None)
+        if not task_ids:
+            return await bad_request_400(request, msg="download id not present")
+        DownloadManager.move_to_front(task_ids)
+        return JSONResponse({"msg": "all tasks are successfully moved"})
+    except KeyError:
+        return await bad_request_400(request, msg="One or more ids are invalid")
+
+
 async def library(request: Request):
     """
 
@@ -433,11 +505,22 @@ async def proxy(request: Request):
     """
     actual_url = request.query_params.get("url", None)
     if not actual_url:
-        await bad_request_400(request, msg="url not present")
+        return await bad_request_400(request, msg="url not present")
 
-    content, headers = await Proxy.get(actual_url, headers=get_headers(
-        extra={"origin": "https://kwik.cx", "referer": "https://kwik.cx/", "accept": "*/*"}))
-    return Response(content, headers=headers)
+    DownloadManager.streaming()  # downloads give way to playback
+
+    try:
+        resp = await Proxy.get(actual_url, headers=get_headers(
+            extra={"origin": "https://kwik.cx", "referer": "https://kwik.cx/", "accept": "*/*"}))
+    except ClientResponseError as error:
+        if error.status != 403:
+            raise
+        Animepahe.invalidate_manifest(actual_url)  # signed url expired, next /manifest call resolves it again
+        return Response(status_code=403)
+    # segments are forwarded chunk by chunk, so memory per request stays flat whatever the segment size is.
+    # A client leaving mid-stream stops the chunks before they are exhausted, the upstream response is released then.
+    return StreamingResponse(resp.iter_chunked(), status_code=resp.status, headers=resp.proxy_headers(),
+                             background=BackgroundTask(resp.release))
 
 
 async def get_recommendation(request: Request):
@@ -481,28 +564,25 @@ async def watchlist(request: Request):
         elif request.method == "POST":
             jb = request.state.body
 
-            anime_id = jb["anime_id"]
+            try:
+                anime_id = int(jb["anime_id"])  # the watchlist is indexed by int id
+            except (TypeError, ValueError):
+                return await bad_request_400(request, msg="anime_id must be a number")
             ep_details = f"{ServerConfig.API_SERVER_ADDRESS}/ep_details?anime_id={anime_id}"
 
-            cur = DB.connection.cursor()
-
-            cur.execute(
-                "INSERT INTO watchlist (anime_id, jp_name, no_of_episodes, type, status, season, year, score, poster, ep_details)"
-                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
-                (anime_id, jb["jp_name"], jb["no_of_episodes"], jb["type"], jb["status"], jb["season"],
-                 jb["year"], jb["score"], jb["poster"], ep_details))
-
-            DB.connection.commit()
+            WatchList.create({"anime_id": anime_id, "jp_name": jb["jp_name"], "no_of_episodes": jb["no_of_episodes"],
+                              "type": jb["type"], "status": jb["status"], "season": jb["season"], "year": jb["year"],
+                              "score": jb["score"], "poster": jb["poster"], "ep_details": ep_details})
             return JSONResponse(content="Anime successfully added in watch later", status_code=201)
 
-        cur = DB.connection.cursor()
+        anime_id = request.query_params["anime_id"]
         # id validation is bypassed by choice
-        cur.execute("DELETE FROM watchlist where anime_id=?", (request.query_params["anime_id"],))
-        DB.connection.commit()
+        if anime_id.isdigit() and int(anime_id) in WatchList.data:
+            WatchList.delete(int(anime_id))
         return Response(status_code=204)
     except KeyError as _msg:
         return await bad_request_400(request, msg=f"Invalid request: {_msg} not present")
-    except IntegrityError as err:
+    except ValueError as err:
         print(err)
         return await bad_request_400(request, msg=f"Record already exists")
 
@@ -521,6 +601,9 @@ routes = [
     Route("/download/pause", endpoint=pause_download, methods=["POST"]),
     Route("/download/resume", endpoint=resume_download, methods=["POST"]),
     Route("/download/cancel", endpoint=cancel_download, methods=["POST"]),
+    Route("/download/priority", endpoint=prioritize_download, methods=["POST"]),
+    Route("/download/reorder", endpoint=reorder_download, methods=["POST"]),
+    Route("/download/bandwidth", endpoint=limit_bandwidth, methods=["POST"]),
     Route("/library", endpoint=library, methods=["GET", "DELETE"]),
     Route("/master_manifest", endpoint=get_master_manifest, methods=["GET"]),
     Route("/manifest", endpoint=get_manifest, methods=["GET"]),
@@ -542,11 +625,23 @@ middleware = [
     Middleware(ErrorHandlerMiddleware)
 ]
 
+
+@asynccontextmanager
+async def lifespan(_app: Starlette):
+    HttpClient.get_session()  # open the pooled session on the server loop before the first request
+    prewarm = asyncio.ensure_future(MyAL.prewarm())
+    yield
+    prewarm.cancel()
+    await HttpClient.close()
+    shutdown_executor()
+
+
 app = Starlette(
     debug=True,
     routes=routes,
     exception_handlers=exception_handlers,
     middleware=middleware,
+    lifespan=lifespan,
 )
 
 
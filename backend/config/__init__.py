@@ -3,7 +3,7 @@ import json
 from pathlib import Path
 import logging as logger
 from platform import system
-from typing import Dict
+from typing import Dict, ClassVar, Tuple
 from dataclasses import dataclass
 
 "----------------------------------------------------------------------------------------------------------------------------------"
@@ -48,6 +48,127 @@ class DBConfig:
 
     DB_PATH: str = str(Path(__file__).parent.parent.joinpath("lisa"))  # database path
 
+    CACHE_DB_PATH: str = str(Path(__file__).parent.parent.joinpath("lisa_cache"))  # http response cache path
+
+
+"----------------------------------------------------------------------------------------------------------------------------------"
+
+"----------------------------------------------------------------------------------------------------------------------------------"
+# HTTP client Configuration
+
+
+@dataclass
+class HttpConfig:
+
+    CONNECTION_LIMIT: int = 100  # total simultaneous connections per session
+
+    CONNECTION_LIMIT_PER_HOST: int = 16  # simultaneous connections per (host, port, ssl) pair
+
+    KEEPALIVE_TIMEOUT: float = 60  # seconds an idle connection is kept in the pool
+
+    DNS_CACHE_TTL: int = 600  # seconds a resolved host is kept in the dns cache
+
+    CACHE_MAX_SIZE: int = 128 * 1024 * 1024  # bytes of response bodies kept on disk, least recently used are evicted
+    CACHE_ACCESS_FLUSH_INTERVAL: float = 60  # seconds cache hits are batched before their access time is written
+
+
+"----------------------------------------------------------------------------------------------------------------------------------"
+
+"----------------------------------------------------------------------------------------------------------------------------------"
+# Rate limit Configuration
+
+
+@dataclass
+class RateLimitConfig:
+
+    # requests per second and burst size per upstream host, sub-domains share the bucket of their parent.
+    # The rate is shared by the api, the download manager and every download process.
+    HOST_LIMITS: ClassVar[Dict[str, Tuple[float, int]]] = {
+        "animepahe.ru": (4, 8),
+        "kwik.cx": (4, 8),
+        "myanimelist.net": (2, 4),
+        "mangakatana.com": (4, 8),
+    }
+
+    DEFAULT_LIMIT: Tuple[float, int] = (20, 40)  # every other host (cdn serving video segments / manga pages)
+
+    SHARED_HOSTS: int = 64  # hosts whose tokens are shared across processes, later ones are limited per loop
+
+
+"----------------------------------------------------------------------------------------------------------------------------------"
+
+"----------------------------------------------------------------------------------------------------------------------------------"
+# HTML parser Configuration
+
+
+@dataclass
+class ParserConfig:
+
+    BACKEND: str = "auto"  # "lxml", "html.parser" or "auto" (lxml when installed, html.parser otherwise)
+
+    EXECUTOR: str = "thread"  # pool parsing runs in, "thread" or "process" (keeps the event loop free of the GIL too)
+
+    WORKERS: int = 2
+
+
+"----------------------------------------------------------------------------------------------------------------------------------"
+
+"----------------------------------------------------------------------------------------------------------------------------------"
+# Download Configuration
+
+
+@dataclass
+class DownloadConfig:
+
+    RESOLVE_CONCURRENCY: int = 4  # episodes / chapters of a batch resolved at the same time while scheduling
+    RESOLVE_ATTEMPTS: int = 3  # a file of a batch that still can't be resolved after these is skipped
+    RESOLVE_RETRY_DELAY: float = 5  # seconds before the first re-attempt, doubled after each one
+
+    RING_SLOTS: int = 8  # segments of a download waiting in shared memory for the decrypt process
+    RING_SLOT_SIZE: int = 4 * 1024 * 1024  # bigger segments are decrypted by the download process itself
+    DECRYPT_WORKERS: int = 0  # threads of the decrypt service shared by all downloads, 0 for one per cpu
+    DECRYPT_DOWNLOADS: int = 32  # downloads the decrypt service serves at once, the next ones decrypt themselves
+    STATS_INTERVAL: float = 10  # seconds between two throughput reports of the decrypt service
+
+    # "append": segments are appended in order to a single .ts (resumable) which is remuxed to mp4 at the end
+    # "pipe": segments are piped in order to ffmpeg, no intermediate file but a stopped download restarts from scratch
+    # "concat": every segment is kept as a file and ffmpeg concatenates them at the end
+    OUTPUT_MODE: str = "append"
+    REORDER_BUFFER_SIZE: int = 64 * 1024 * 1024  # segments downloaded ahead of their turn, spilled to disk past it
+
+    # "process": every download runs in a process of its own
+    # "async": downloads run as tasks of the download manager's loop, sharing its connection pool
+    ENGINE: str = "process"
+    ASYNC_DOWNLOADS: int = 16  # downloads running at once with the async engine
+
+    # segment requests a download keeps in flight adapt between 1 and MAX_SEGMENT_WORKERS, growing while throughput
+    # improves and halving on timeouts / throttling. Running downloads split CONNECTION_BUDGET of them equally.
+    # (a process never opens more than HttpConfig.CONNECTION_LIMIT_PER_HOST connections to a host anyway)
+    MAX_SEGMENT_WORKERS: int = 16
+    CONNECTION_BUDGET: int = 32
+    ADAPT_INTERVAL: float = 2  # seconds of throughput compared between two adjustments
+
+    BANDWIDTH_LIMIT: int = 0  # bytes/s shared by all the downloads, 0 is unlimited
+    # (start "HH:MM", end "HH:MM", bytes/s) ranges of the day overriding BANDWIDTH_LIMIT, a range may wrap around
+    # midnight, e.g. (("08:00", "01:00", 2 * 1024 * 1024),) caps the downloads during the day, unlimited at night
+    BANDWIDTH_PROFILES: Tuple[Tuple[str, str, int], ...] = ()
+    STREAMING_BANDWIDTH: int = 512 * 1024  # bytes/s left to the downloads while a video is streamed through /proxy
+    STREAMING_GRACE: float = 5  # seconds after the last /proxy request the downloads get back to their limit
+
+    PROGRESS_INTERVAL: float = 0.5  # seconds between two progress reports of the running downloads
+    PROGRESS_SMOOTHING: float = 0.3  # weight of the latest interval in the reported speed and eta (ewma)
+
+"----------------------------------------------------------------------------------------------------------------------------------"
+
+"----------------------------------------------------------------------------------------------------------------------------------"
+# Msg System Configuration
+
+
+@dataclass
+class MsgConfig:
+
+    TICK: float = 0.1  # seconds between two frames sent to the clients, msgs received meanwhile are batched in one frame
+    CLIENT_QUEUE_SIZE: int = 64  # frames waiting to be sent to a slow client, the oldest ones are dropped past it
 
 "----------------------------------------------------------------------------------------------------------------------------------"
 
@@ -2,61 +2,173 @@ import asyncio
 from abc import ABC
 import aiohttp
 from utils.headers import get_headers
+from utils.http_client import HttpClient
 import logging
-from random import choice
-from typing import Tuple
-from multidict import CIMultiDictProxy
+import re
+from time import time
+from typing import Tuple, Dict, Any, Callable, Awaitable
+from config import DownloadConfig
+from yarl import URL
+from .cache import HttpCache, CacheEntry
+from .response import ScraperResponse
+from .retry import RetryPolicy
 
 
 class Scraper(ABC):
-    session: aiohttp.ClientSession = None
     api_url: str = None
-    content: bytes = None
-
-    @classmethod
-    async def set_session(cls):
-        if not cls.session:
-            cls.session = aiohttp.ClientSession()
+    retry_policy: RetryPolicy = RetryPolicy()
+    _in_flight: Dict[Tuple, asyncio.Task] = {}  # identical requests currently waiting for upstream
+    # only these headers change what upstream sends back, others (referer, user-agent...) don't split in-flight requests
+    COALESCE_HEADERS: Tuple[str, ...] = ("accept", "accept-language", "authorization", "cookie", "range")
+    # (url regex, seconds) pairs, responses of the first matching pattern are kept in the HttpCache, others aren't cached
+    cache_ttls: Tuple[Tuple[str, float], ...] = ()
 
     async def __aenter__(self):
         return self
 
     async def __aexit__(self, exc_type, exc_value, traceback):
-        if self.session:
-            await self.session.close()
+        ...  # pooled session is shared by the whole process, it is closed by HttpClient.close on shutdown
 
     @classmethod
     async def get_api(cls, data: dict, headers: dict = get_headers()) -> dict:
         return await (await cls.get(cls.api_url, data, headers)).json()
 
     @classmethod
-    async def get(cls, url: str, data=None, headers: dict = get_headers()) -> aiohttp.ClientResponse:
-        if not cls.session:
-            await Scraper.set_session()
+    def _request_key(cls, method: str, url: str, data: Dict[str, Any] | None, headers: Dict[str, str] | None) -> Tuple:
+        params = tuple(sorted((str(k), str(v)) for k, v in (data or {}).items()))
+        _headers = tuple(sorted((k.lower(), v) for k, v in (headers or {}).items() if k.lower() in cls.COALESCE_HEADERS))
+        return asyncio.get_running_loop(), method, url, params, _headers
+
+    @classmethod
+    async def get(cls, url: str, data=None, headers: dict = get_headers(), stream: bool = False) -> ScraperResponse:
+        """
+        GET request, concurrent calls with the same url, params and relevant headers share a single upstream call.
+        Streamed responses are owned by a single caller, so they are never shared nor cached.
+        """
+        if stream:
+            return await cls._get(url, data, headers, stream=True)
+
+        key = cls._request_key("GET", url, data, headers)
+
+        task = Scraper._in_flight.get(key, None)
+        if not task:
+            task = asyncio.ensure_future(cls._cached_get(url, data, headers, key[1:]))
+            Scraper._in_flight[key] = task
+            task.add_done_callback(lambda _: Scraper._in_flight.pop(key, None))
+
+        # shield, so one cancelled waiter (client closed the connection) doesn't cancel the request for others
+        return await asyncio.shield(task)
+
+    @classmethod
+    def _cache_ttl(cls, url: str, data: Dict[str, Any] | None) -> float:
+        full_url = str(URL(url).update_query(data)) if data else url
+        for pattern, ttl in cls.cache_ttls:
+            if re.search(pattern, full_url):
+                return ttl
+        return 0
+
+    @classmethod
+    async def _cached_get(cls, url: str, data, headers: dict, request_key: Tuple) -> ScraperResponse:
+        ttl = cls._cache_ttl(url, data)
+        if not ttl:
+            return await cls._get(url, data, headers)
+
+        key = HttpCache.make_key(*request_key)
+        entry = await asyncio.to_thread(HttpCache.get, key)  # sqlite would block the loop
+        if entry and entry.fresh:
+            return ScraperResponse.from_cache(entry)
+
+        try:
+            # stale entry: let upstream answer 304 instead of sending the whole body again
+            resp = await cls._get(url, data, {**(headers or {}), **entry.revalidation_headers()} if entry else headers)
+        except aiohttp.ClientResponseError as error:
+            if entry and (error.status or 503) >= 500:
+                logging.error(f"{url} unreachable, serving stale cached response")
+                return ScraperResponse.from_cache(entry)
+            raise
 
-        data = {} or data
-        err, tries = None, 0
+        if resp.status == 304 and entry:
+            await asyncio.to_thread(HttpCache.refresh, key, time() + ttl)
+            return ScraperResponse.from_cache(entry)
+
+        entry = CacheEntry(str(resp.url), resp.status, list(resp.headers.items()), await resp.read(), resp.encoding,
+                           resp.headers.get("ETag", None), resp.headers.get("Last-Modified", None), time() + ttl)
+        await asyncio.to_thread(HttpCache.put, key, entry)
+        return resp
+
+    @classmethod
+    async def _get(cls, url: str, data=None, headers: dict = get_headers(), stream: bool = False) -> ScraperResponse:
+        session = HttpClient.get_session()
+        host = URL(url).host
+        breaker = cls.retry_policy.breaker(host)
+        retry = cls.retry_policy.start(host)
+
+        while True:
+            breaker.check()  # fail fast while the host is down
+            retry_after, status = None, 503
 
-        while tries < 10:
             try:
-                async with cls.session.get(url=url, params=data, headers=headers) as resp:
-                    if resp.status != 200:
-                        err = f"request failed with status: {resp.status}\n err msg: {resp.content}"
-                        logging.error(f"{err}\nRetrying...")
-                        raise aiohttp.ClientResponseError(None, None, message=err)
+                resp = await session.get(url=url, params=data, headers=headers, timeout=cls.retry_policy.timeout)
+                if resp.status == 200 or resp.status == 304:  # 304 only answers our revalidation requests
+                    if stream:
+                        breaker.record_success()
+                        return ScraperResponse.streamed(resp)
+
+                    try:
+                        response = await ScraperResponse.buffered(resp)
+                    finally:
+                        resp.release()
+                    breaker.record_success()
+                    return response
+
+                resp.release()
+                status = resp.status
+                err = f"request failed with status: {resp.status}\n err msg: {resp.reason}"
 
-                    cls.content = await resp.read()  # read whole resp, before closing the connection
-                    return resp
-            except (aiohttp.ClientOSError, asyncio.TimeoutError, aiohttp.ServerDisconnectedError, aiohttp.ServerTimeoutError):
-                await asyncio.sleep(choice([5, 4, 3, 2, 1]))  # randomly await
-                tries += 1
-                continue
+                if resp.status not in cls.retry_policy.retry_statuses:
+                    breaker.record_success()  # host is up, retrying the same request won't change the answer
+                    raise aiohttp.ClientResponseError(None, None, status=resp.status, message=err)
 
-        raise aiohttp.ClientResponseError(None, None, message=err)
+                retry_after = resp.headers.get("Retry-After", None)
+
+            except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError) as error:
+                err = f"request failed with error: {error.__class__.__name__} {error}"
+            except BaseException:
+                # the trial was cancelled or failed unexpectedly, it counts as a failure rather than keep it half open
+                if breaker.state == breaker.HALF_OPEN:
+                    breaker.record_failure()
+                raise
+
+            breaker.record_failure()
+            delay = retry.next_delay(retry_after)
+            if delay is None:
+                logging.error(f"{err}\nGiving up after {retry.attempt} attempt(s)")
+                raise aiohttp.ClientResponseError(None, None, status=status, message=err)
+
+            logging.error(f"{err}\nRetrying in {delay:.2f}s...")
+            await asyncio.sleep(delay)
+
+    @staticmethod
+    async def resolve_with_retry(resolve: Callable[[], Awaitable[Any]], item: str) -> Any:
+        """resolve a single item of a batch, retried on its own so one failing item doesn't fail the others.
+        None when it still fails after DownloadConfig.RESOLVE_ATTEMPTS"""
+        delay = DownloadConfig.RESOLVE_RETRY_DELAY
+        for attempt in range(1, DownloadConfig.RESOLVE_ATTEMPTS + 1):
+            try:
+                return await resolve()
+            except Exception as err:
+                logging.error(f"resolving {item} failed ({attempt}/{DownloadConfig.RESOLVE_ATTEMPTS}): {err!r}")
+            if attempt < DownloadConfig.RESOLVE_ATTEMPTS:
+                await asyncio.sleep(delay)
+                delay *= 2
+        return None
 
 
 class Proxy(Scraper):
+    # a segment that isn't back within a couple of seconds is useless for playback, let the player retry it instead
+    retry_policy: RetryPolicy = RetryPolicy(max_attempts=2, base_delay=0.2, max_delay=1, max_retry_time=2)
+
     @classmethod
-    async def get(cls, url: str, data=None, headers=None) -> Tuple[bytes, CIMultiDictProxy[str]]:
-        resp = await super().get(url, data, headers)
-        return cls.content, resp.headers
+    async def get(cls, url: str, data=None, headers=None, stream: bool = True) -> ScraperResponse:
+        """proxied bodies (manifests, keys, video segments) are streamed to the client by default"""
+        return await super().get(url, data, headers, stream)
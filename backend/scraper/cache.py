@@ -0,0 +1,140 @@
+from __future__ import annotations
+import json
+import logging
+import sqlite3
+from dataclasses import dataclass
+from hashlib import sha1
+from threading import Lock
+from time import time
+from typing import Dict, List, Tuple
+from config import DBConfig, HttpConfig
+
+
+@dataclass
+class CacheEntry:
+    url: str
+    status: int
+    headers: List[Tuple[str, str]]
+    body: bytes
+    encoding: str
+    etag: str | None
+    last_modified: str | None
+    expires_on: float
+
+    @property
+    def fresh(self) -> bool:
+        return self.expires_on > time()
+
+    def revalidation_headers(self) -> dict:
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class HttpCache:
+    """
+    Persistent cache of upstream responses, stored in its own sqlite database so it survives restarts.
+    Total body size is bounded by HttpConfig.CACHE_MAX_SIZE, least recently used entries are evicted first.
+    Hits don't write to the database, their access times are kept in memory and written in one batch by the next
+    write, or once they are HttpConfig.CACHE_ACCESS_FLUSH_INTERVAL old.
+    Calls block on sqlite, they are meant to be run in a thread.
+    """
+    connection: sqlite3.Connection = None
+    _lock: Lock = Lock()
+    _size: int = 0
+    _accessed: Dict[str, float] = {}  # key -> last access not written yet
+    _flushed_at: float = 0
+
+    @classmethod
+    def _connect(cls) -> sqlite3.Connection:
+        if not cls.connection:
+            cls.connection = sqlite3.connect(DBConfig.CACHE_DB_PATH, check_same_thread=False)
+            with open(DBConfig.DEFAULT_SQL_DIR.joinpath("http_cache.sql")) as file:
+                cls.connection.executescript(file.read())
+            cls._size = cls.connection.execute("SELECT coalesce(sum(size), 0) FROM http_cache").fetchone()[0]
+        return cls.connection
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        return sha1(json.dumps(parts, default=str).encode()).hexdigest()
+
+    @classmethod
+    def get(cls, key: str) -> CacheEntry | None:
+        try:
+            with cls._lock:
+                con = cls._connect()
+                row = con.execute("SELECT url, status, headers, body, encoding, etag, last_modified, expires_on "
+                                  "FROM http_cache WHERE key=?", (key,)).fetchone()
+                if not row:
+                    return None
+                cls._accessed[key] = time()
+                if time() - cls._flushed_at >= HttpConfig.CACHE_ACCESS_FLUSH_INTERVAL:
+                    cls._flush_access(con)
+                    con.commit()
+        except sqlite3.Error as error:
+            logging.error(f"http cache read failed: {error}")
+            return None
+
+        url, status, headers, body, encoding, etag, last_modified, expires_on = row
+        return CacheEntry(url, status, [tuple(header) for header in json.loads(headers)], body, encoding, etag,
+                          last_modified, expires_on)
+
+    @classmethod
+    def put(cls, key: str, entry: CacheEntry) -> None:
+        size = len(entry.body)
+        if size > HttpConfig.CACHE_MAX_SIZE:
+            return
+
+        try:
+            with cls._lock:
+                con = cls._connect()
+                old = con.execute("SELECT size FROM http_cache WHERE key=?", (key,)).fetchone()
+                con.execute(
+                    "INSERT OR REPLACE INTO http_cache (key, url, status, headers, body, encoding, etag, last_modified,"
+                    " size, expires_on, last_access) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (key, entry.url, entry.status, json.dumps(entry.headers), entry.body, entry.encoding, entry.etag,
+                     entry.last_modified, size, entry.expires_on, time()))
+                cls._size += size - (old[0] if old else 0)
+                cls._flush_access(con)  # eviction goes by last access
+                cls._evict(con)
+                con.commit()
+        except sqlite3.Error as error:
+            logging.error(f"http cache write failed: {error}")
+
+    @classmethod
+    def refresh(cls, key: str, expires_on: float) -> None:
+        """entry was revalidated by upstream (304), keep serving it until `expires_on`"""
+        try:
+            with cls._lock:
+                con = cls._connect()
+                cls._accessed.pop(key, None)
+                con.execute("UPDATE http_cache SET expires_on=?, last_access=? WHERE key=?", (expires_on, time(), key))
+                cls._flush_access(con)
+                con.commit()
+        except sqlite3.Error as error:
+            logging.error(f"http cache write failed: {error}")
+
+    @classmethod
+    def _flush_access(cls, con: sqlite3.Connection) -> None:
+        """write the access times of the hits since the last flush, committed by the caller"""
+        if cls._accessed:
+            con.executemany("UPDATE http_cache SET last_access=? WHERE key=?",
+                            [(accessed, key) for key, accessed in cls._accessed.items()])
+            cls._accessed = {}
+        cls._flushed_at = time()
+
+    @classmethod
+    def _evict(cls, con: sqlite3.Connection) -> None:
+        while cls._size > HttpConfig.CACHE_MAX_SIZE:
+            rows = con.execute("SELECT key, size FROM http_cache ORDER BY last_access LIMIT 32").fetchall()
+            if not rows:
+                cls._size = 0
+                return
+            for key, size in rows:
+                con.execute("DELETE FROM http_cache WHERE key=?", (key,))
+                cls._size -= size
+                if cls._size <= HttpConfig.CACHE_MAX_SIZE:
+                    return
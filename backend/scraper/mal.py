@@ -1,14 +1,22 @@
 from __future__ import annotations
-from bs4 import BeautifulSoup
+import asyncio
+import logging
 from typing import Dict, Any
 from config import ServerConfig
 from utils.headers import get_headers
+from utils.ttl_cache import TTLCache
 from .base import Scraper
+from .parser import make_soup, run_parser
+from .retry import RetryPolicy
 
 
 class MyAL(Scraper):
     site_url: str = "https://myanimelist.net"
-    cache: Dict[str, Dict[str, Any]] = {}
+    # top lists are served from memory, an hour old list is still served but refreshed in the background
+    cache: TTLCache = TTLCache(maxsize=64, ttl=60 * 60, stale_ttl=24 * 60 * 60)
+    PREWARM_CATEGORIES = ("airing", "upcoming", "by_popularity")
+    retry_policy: RetryPolicy = RetryPolicy(max_attempts=3, max_delay=4, max_retry_time=8)
+    cache_ttls = ((r"/top(anime|manga)\.php", 60 * 60),)
 
     anime_types_dict = {
         "all_anime": "",
@@ -64,12 +72,20 @@ class MyAL(Scraper):
         return await cls.get_top(anime_type, limit, "anime")
 
     @classmethod
-    async def get_top(cls, typ: str, limit: int = 0, media: str = "anime") -> Dict[str, Any]:
-        key = f"{media}_{typ}_{limit}"
+    async def prewarm(cls):
+        """load the categories of the explore screen, so its first load is served from memory"""
+        results = await asyncio.gather(*[cls.get_top_anime(category) for category in cls.PREWARM_CATEGORIES],
+                                       return_exceptions=True)
+        for category, result in zip(cls.PREWARM_CATEGORIES, results):
+            if isinstance(result, BaseException):
+                logging.error(f"prewarming top {category} failed: {result!r}")
 
-        if cls.cache.get(key, None):
-            return cls.cache[key]
+    @classmethod
+    async def get_top(cls, typ: str, limit: int = 0, media: str = "anime") -> Dict[str, Any]:
+        return await cls.cache.get_or_load(f"{media}_{typ}_{limit}", lambda: cls._get_top(typ, limit, media))
 
+    @classmethod
+    async def _get_top(cls, typ: str, limit: int = 0, media: str = "anime") -> Dict[str, Any]:
         top_headers = get_headers()
 
         top_anime_params = {
@@ -79,7 +95,11 @@ class MyAL(Scraper):
 
         resp = await cls.get(f'{cls.site_url}/top{media}.php', top_anime_params, top_headers)
 
-        bs_top = BeautifulSoup(await resp.text(), 'html.parser')
+        return await run_parser(cls._parse_top, await resp.text(), typ, media)
+
+    @staticmethod
+    def _parse_top(html: str, typ: str, media: str) -> Dict[str, Any]:
+        bs_top = make_soup(html)
 
         rank = bs_top.find_all("span", {"class": ['rank1', 'rank2', 'rank3', 'rank4']})
         ranks = []
@@ -152,5 +172,4 @@ class MyAL(Scraper):
         except AttributeError:
             response["prev_top"] = None
 
-        cls.cache[key] = response
         return response
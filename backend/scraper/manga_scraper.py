@@ -1,11 +1,14 @@
 from __future__ import annotations
 from abc import abstractmethod
-from bs4 import BeautifulSoup
-from typing import Dict, List, Any
+import aiohttp
+from bs4 import BeautifulSoup, SoupStrainer
+from typing import Dict, List, Any, AsyncIterator
 from config import ServerConfig
 from utils.headers import get_headers
 import re
 from .base import Scraper
+from .parser import make_soup, class_regex, plain, run_parser
+from .retry import RetryPolicy
 
 
 class Manga(Scraper):
@@ -45,19 +48,27 @@ class MangaKatana(Manga):
     _SITE_NAME: str = "mangakatana"
     site_url: str = "https://mangakatana.com"
     api_url: str = "https://mangakatana.com"
+    retry_policy: RetryPolicy = RetryPolicy(max_attempts=3, max_retry_time=10)
+    cache_ttls = (
+        (r"mangakatana\.com/page/", 60 * 60),  # search
+        (r"mangakatana\.com/manga/[^/]+/c\d", 24 * 60 * 60),  # chapter, its pages don't change
+        (r"mangakatana\.com/manga/", 30 * 60),  # chapter list
+    )
 
     async def search_manga(self, manga_name: str, search_by: str = "book_name", page_no: int = 1, total_res: int = 20) -> Dict[str, Any]:
 
         resp_text = await self.get(f"{self.site_url}/page/{page_no}", data={"search": manga_name, "search_by": search_by})
 
-        resp_text = await resp_text.text()
+        return await run_parser(self._parse_search, await resp_text.text(), manga_name, page_no, total_res)
 
+    @classmethod
+    def _parse_search(cls, resp_text: str, manga_name: str, page_no: int, total_res: int) -> Dict[str, Any]:
         resp = {"response": List[Dict[str, str]]}
 
-        search_bs = BeautifulSoup(resp_text, 'html.parser')
+        search_bs = make_soup(resp_text)
 
         if len(search_bs.find("title").text) != len(manga_name):
-            scrape_func = self.__scrape_list
+            scrape_func = cls.__scrape_list
 
             pag_list = search_bs.find("ul", {"class": "uk-pagination"})  # check if multiple pages exists or not
 
@@ -69,15 +80,13 @@ class MangaKatana(Manga):
                 resp["next"] = f"{ServerConfig.API_SERVER_ADDRESS}/search?type=manga&page={int(page_no) + 1}&query={manga_name}" if pag_list.find(
                     "a", {"class": "next"}) else None
         else:
-            scrape_func = self.__scrape_detail
-
-        manga_list = scrape_func(search_bs)
+            scrape_func = cls.__scrape_detail
 
-        resp["response"] = (await manga_list)[:total_res]
+        resp["response"] = scrape_func(search_bs)[:total_res]
         return resp
 
     @staticmethod
-    async def __scrape_list(search_bs: BeautifulSoup) -> List[Dict[str, str]]:
+    def __scrape_list(search_bs: BeautifulSoup) -> List[Dict[str, str]]:
 
         res = []
 
@@ -86,7 +95,7 @@ class MangaKatana(Manga):
         for title_bs in book_list.find_all("div", {"class": "item"}):
             manga = {}
             text_class = title_bs.find("div", {"class": "text"})
-            manga["title"] = text_class.find('a').string
+            manga["title"] = plain(text_class.find('a').string)
             total_chps = text_class.find('span').text.strip(" ").strip("- ").split()
             try:
                 manga["total_chps"] = float(total_chps[0])
@@ -95,7 +104,7 @@ class MangaKatana(Manga):
 
             manga["genres"] = []
             for genre in title_bs.find("div", {"class": "genres"}).find_all("a"):
-                manga["genres"].append(genre.string)
+                manga["genres"].append(plain(genre.string))
 
             media = title_bs.find("div", {"class": "media"})
             media_a = media.find("div", {"class": "wrap_img"}).find("a")
@@ -111,18 +120,18 @@ class MangaKatana(Manga):
         return res
 
     @staticmethod
-    async def __scrape_detail(search_bs: BeautifulSoup) -> List[Dict[str, str]]:
+    def __scrape_detail(search_bs: BeautifulSoup) -> List[Dict[str, str]]:
 
         manga = {}
 
         info = search_bs.find("div", {"class": "info"})
 
-        manga["title"] = info.find("h1", {"class": "heading"}).string
+        manga["title"] = plain(info.find("h1", {"class": "heading"}).string)
         meta_data = info.find("ul", {"class": "meta d-table"})
         manga["total_chps"] = meta_data.find("div", {"class": "new_chap"}).text.strip(" ").split()[-1]
         manga["genres"] = []
         for genre in meta_data.find("div", {"class": "genres"}).find_all("a"):
-            manga["genres"].append(genre.string)
+            manga["genres"].append(plain(genre.string))
 
         manga["cover"] = search_bs.find("div", {"class": "cover"}).find("img")["src"]
         manga["status"] = meta_data.find("div", {"class": "status"}).text.capitalize()
@@ -133,11 +142,13 @@ class MangaKatana(Manga):
         return [manga]
 
     async def get_chp_session(self, manga_session: str) -> dict[str, list[Any] | dict[Any, Any] | str]:
-        res = {"chapters": [], "description": {}}
+        return await run_parser(self._parse_chp_session, await (await self.get(manga_session)).text(), manga_session)
 
-        resp_text = await (await self.get(manga_session)).text()
+    @staticmethod
+    def _parse_chp_session(resp_text: str, manga_session: str) -> dict[str, list[Any] | dict[Any, Any] | str]:
+        res = {"chapters": [], "description": {}}
 
-        detail_bs = BeautifulSoup(resp_text, 'html.parser')
+        detail_bs = make_soup(resp_text, SoupStrainer(["ul", "div"], class_=class_regex("meta", "chapters", "summary")))
 
         for info in detail_bs.find("div", {"class": 'chapters'}).find_all("tr"):
             chp_info = info.find("div", {"class": "chapter"})
@@ -164,9 +175,11 @@ class MangaKatana(Manga):
         return (await self.get_manifest_file(chp_session))[0]
 
     async def get_recommendation(self, manga_session: str) -> List[Dict[str, str]]:
-        resp_text = await (await self.get(manga_session)).text()
+        return await run_parser(self._parse_recommendation, await (await self.get(manga_session)).text())
 
-        rec_bs = BeautifulSoup(resp_text, 'html.parser')
+    @staticmethod
+    def _parse_recommendation(resp_text: str) -> List[Dict[str, str]]:
+        rec_bs = make_soup(resp_text, SoupStrainer("div", id="hot_book"))
 
         recommendations = []
 
@@ -202,7 +215,10 @@ class MangaKatana(Manga):
         It is implemented as get_manifest_file to provide uniform interface
 
         """
-        resp_text = await (await self.get(chp_url)).text()
+        return await run_parser(self._parse_chapter, await (await self.get(chp_url)).text(), chp_url)
+
+    @staticmethod
+    def _parse_chapter(resp_text: str, chp_url: str) -> (List[str], '_', ("series_name", "file_name")):
         p = re.compile("var thzq=(.*);")  # get all image links from variable inside the script tag
         m = p.search(resp_text)
         if m:
@@ -210,13 +226,30 @@ class MangaKatana(Manga):
             if chp_links[-1] == "":
                 chp_links.pop()
             series_name = chp_url.split("/")[4].split(".")[0]
-            file_name = BeautifulSoup(resp_text, 'html.parser').find("select", {"name": "chapter_select"}).find("option", {"selected": "selected"}).text
+            file_name = make_soup(resp_text, SoupStrainer("select", attrs={"name": "chapter_select"})).find(
+                "select", {"name": "chapter_select"}).find("option", {"selected": "selected"}).text
             return chp_links, None, [series_name, file_name]
         return [], None, "", ""
 
+    async def check_batch(self, manga_session: str, page: int = 1) -> None:
+        """raise ValueError when the chapter list of a batch can't be fetched or is empty"""
+        try:
+            links = await self.get_links(manga_session, page)
+        except (aiohttp.ClientResponseError, AttributeError):
+            raise ValueError("Invalid manga session")
+        if not links:
+            raise ValueError("Invalid manga session, no chapter found")
+
+    async def iter_links(self, manga_session: str, page: int = 1, failed: List[str] = None) -> AsyncIterator[str]:
+        for link in await self.get_links(manga_session, page):  # all chapters are listed on one page
+            yield link
+
     async def get_links(self, manga_session: str, page: int = 1) -> List[str]:
-        resp_text = await (await self.get(manga_session)).text()
-        resp_bs = BeautifulSoup(resp_text, 'html.parser')
+        return await run_parser(self._parse_chapter_links, await (await self.get(manga_session)).text())
+
+    @staticmethod
+    def _parse_chapter_links(resp_text: str) -> List[str]:
+        resp_bs = make_soup(resp_text, SoupStrainer("div", class_=class_regex("chapters")))
         res = []
         for tr in resp_bs.find("div", {"class": "chapters"}).find_all("tr"):
             res.append(tr.find("div", {"class": "chapter"}).find("a")["href"])
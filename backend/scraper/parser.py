@@ -0,0 +1,71 @@
+import asyncio
+import re
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Any, Callable, Pattern
+from bs4 import BeautifulSoup, SoupStrainer
+from config import ParserConfig, ServerConfig
+
+try:
+    import lxml  # noqa: F401, the C parser is ~5x faster than the pure python one
+    _AUTO_BACKEND = "lxml"
+except ImportError:
+    _AUTO_BACKEND = "html.parser"
+
+_executor: Executor = None
+
+
+def get_backend() -> str:
+    return _AUTO_BACKEND if ParserConfig.BACKEND == "auto" else ParserConfig.BACKEND
+
+
+def make_soup(markup: str | bytes, parse_only: SoupStrainer = None) -> BeautifulSoup:
+    """
+    Build the tree of a page with the configured backend.
+    When `parse_only` is passed only the matching elements (and their children) are built, the rest of the page is
+    skipped, find/find_all on the result return the same elements as on the full tree.
+    """
+    return BeautifulSoup(markup, get_backend(), parse_only=parse_only)
+
+
+def class_regex(*class_names: str) -> Pattern:
+    """
+    SoupStrainer sees the raw class attribute ("meta d-table") while parsing, not the list find_all matches against,
+    this matches elements having any of `class_names` among their classes.
+    """
+    return re.compile(r"(^|\s)(%s)(\s|$)" % "|".join(re.escape(name) for name in class_names))
+
+
+def plain(string: Any) -> str | None:
+    """NavigableString -> str, parse results must not keep references to the tree"""
+    return None if string is None else str(string)
+
+
+def _init_worker(api_server_address: str) -> None:
+    ServerConfig.API_SERVER_ADDRESS = api_server_address  # set at runtime in the main process only
+
+
+def get_executor() -> Executor:
+    global _executor
+    if not _executor:
+        if ParserConfig.EXECUTOR == "process":
+            _executor = ProcessPoolExecutor(ParserConfig.WORKERS, initializer=_init_worker,
+                                            initargs=(getattr(ServerConfig, "API_SERVER_ADDRESS", None),))
+        else:
+            _executor = ThreadPoolExecutor(ParserConfig.WORKERS, thread_name_prefix="parser")
+    return _executor
+
+
+async def run_parser(parse_func: Callable[..., Any], *args) -> Any:
+    """
+    Run a parse function in the parser pool, the event loop keeps serving other requests meanwhile.
+    With the process pool `parse_func` and its arguments are pickled, so it must be a module level function or a
+    static/class method and return plain python objects.
+    """
+    return await asyncio.get_running_loop().run_in_executor(get_executor(), parse_func, *args)
+
+
+def shutdown_executor() -> None:
+    global _executor
+    if _executor:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
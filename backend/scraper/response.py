@@ -0,0 +1,96 @@
+from __future__ import annotations
+import json
+from typing import Any, AsyncIterator, TYPE_CHECKING
+import aiohttp
+from multidict import CIMultiDictProxy, CIMultiDict
+from yarl import URL
+
+if TYPE_CHECKING:
+    from .cache import CacheEntry
+
+
+class ScraperResponse:
+    """
+    Response of a single upstream request, owned by the caller that made it.
+
+    Buffered responses carry the whole body, streamed responses keep the connection open until the body is consumed
+    with iter_chunked / read or release is called.
+    """
+    CHUNK_SIZE: int = 64 * 1024
+
+    def __init__(
+            self,
+            status: int,
+            headers: CIMultiDictProxy[str],
+            url: URL,
+            body: bytes = None,
+            encoding: str = "utf-8",
+            stream: aiohttp.ClientResponse = None
+    ) -> None:
+        self.status = status
+        self.headers = headers
+        self.url = url
+        self._body = body
+        self._encoding = encoding
+        self._stream = stream
+
+    @classmethod
+    async def buffered(cls, resp: aiohttp.ClientResponse) -> ScraperResponse:
+        body = await resp.read()  # read whole resp, before the connection goes back to the pool
+        return cls(resp.status, resp.headers, resp.url, body, resp.get_encoding())
+
+    @classmethod
+    def from_cache(cls, entry: CacheEntry) -> ScraperResponse:
+        return cls(entry.status, CIMultiDictProxy(CIMultiDict(entry.headers)), URL(entry.url), entry.body, entry.encoding)
+
+    @classmethod
+    def streamed(cls, resp: aiohttp.ClientResponse) -> ScraperResponse:
+        return cls(resp.status, resp.headers, resp.url, stream=resp)
+
+    @property
+    def is_streamed(self) -> bool:
+        return self._stream is not None
+
+    @property
+    def encoding(self) -> str:
+        return self._encoding
+
+    async def iter_chunked(self, chunk_size: int = CHUNK_SIZE) -> AsyncIterator[bytes]:
+        if not self._stream:
+            yield self._body
+            return
+
+        try:
+            async for chunk in self._stream.content.iter_chunked(chunk_size):
+                yield chunk
+        finally:
+            self.release()
+
+    async def read(self) -> bytes:
+        if self._stream:
+            try:
+                self._body = await self._stream.read()
+                self._encoding = self._stream.get_encoding()
+            finally:
+                self.release()
+        return self._body
+
+    async def text(self, encoding: str = None) -> str:
+        return (await self.read()).decode(encoding or self._encoding, errors="strict")
+
+    async def json(self) -> Any:
+        return json.loads(await self.text())
+
+    def proxy_headers(self) -> CIMultiDict[str]:
+        """upstream headers that are still valid once the body is re-sent by us (body is already decoded by aiohttp)"""
+        headers = CIMultiDict(self.headers)
+        for hop_by_hop in ("connection", "keep-alive", "transfer-encoding", "content-encoding"):
+            headers.popall(hop_by_hop, None)
+        if "content-encoding" in self.headers:
+            headers.popall("content-length", None)  # length of the encoded body, doesn't match the decoded one
+        return headers
+
+    def release(self) -> None:
+        if self._stream:
+            self._stream.release()
+            self._stream = None
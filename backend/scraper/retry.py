@@ -0,0 +1,143 @@
+from __future__ import annotations
+from dataclasses import dataclass, field
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from random import uniform
+from time import monotonic
+from typing import Dict, FrozenSet
+import aiohttp
+
+
+class CircuitOpenError(aiohttp.ClientResponseError):
+    """raised without touching the network while the circuit of a host is open"""
+
+
+class CircuitBreaker:
+    """
+    Per-host circuit breaker.
+    After `threshold` consecutive failures the circuit opens and every request to the host fails fast for `cooldown`
+    seconds, then a single trial request is let through (half-open): success closes the circuit, failure re-opens it.
+    A trial that never reports back (lost track of) is replaced by a new one after another cooldown.
+    """
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, host: str, threshold: int, cooldown: float):
+        self.host = host
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+
+    def check(self) -> None:
+        if self.state == self.CLOSED:
+            return
+
+        if monotonic() - self.opened_at >= self.cooldown:
+            # let this request through as the trial, opened_at is the time it started from now on
+            self.state, self.opened_at = self.HALF_OPEN, monotonic()
+            return
+
+        raise CircuitOpenError(None, None, status=503, message=f"{self.host} is unreachable, failing fast")
+
+    def record_success(self) -> None:
+        self.state, self.failures = self.CLOSED, 0
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+            self.state, self.opened_at = self.OPEN, monotonic()
+
+
+class RetryBudget:
+    """
+    Per-host retry budget, every request deposits `ratio` token and every retry withdraws one.
+    During an outage retries are capped to a fraction of the traffic instead of multiplying it.
+    """
+
+    def __init__(self, ratio: float, max_tokens: float):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+
+    def deposit(self) -> None:
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    max_attempts: int = 4
+    base_delay: float = 0.5  # seconds
+    max_delay: float = 8  # cap of a single backoff
+    max_retry_time: float = 15  # total seconds a request may spend waiting between attempts
+    retry_statuses: FrozenSet[int] = frozenset({408, 425, 429, 500, 502, 503, 504})
+    budget_ratio: float = 0.2
+    budget_max_tokens: float = 10
+    breaker_threshold: int = 5
+    breaker_cooldown: float = 30
+    timeout: aiohttp.ClientTimeout = field(default_factory=lambda: aiohttp.ClientTimeout(sock_connect=10, sock_read=30))
+
+    _breakers: Dict[str, CircuitBreaker] = field(default_factory=dict, init=False, repr=False, compare=False)
+    _budgets: Dict[str, RetryBudget] = field(default_factory=dict, init=False, repr=False, compare=False)
+
+    def breaker(self, host: str) -> CircuitBreaker:
+        if host not in self._breakers:
+            self._breakers[host] = CircuitBreaker(host, self.breaker_threshold, self.breaker_cooldown)
+        return self._breakers[host]
+
+    def budget(self, host: str) -> RetryBudget:
+        if host not in self._budgets:
+            self._budgets[host] = RetryBudget(self.budget_ratio, self.budget_max_tokens)
+        return self._budgets[host]
+
+    def start(self, host: str) -> Retry:
+        budget = self.budget(host)
+        budget.deposit()
+        return Retry(self, budget)
+
+
+class Retry:
+    """retry state of a single request"""
+
+    def __init__(self, policy: RetryPolicy, budget: RetryBudget):
+        self.policy = policy
+        self.budget = budget
+        self.attempt = 1
+        self.delay = policy.base_delay
+        self.waited = 0.0
+
+    @staticmethod
+    def parse_retry_after(retry_after: str | None) -> float | None:
+        if not retry_after:
+            return None
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            ...
+        try:
+            return max(0.0, (parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds())
+        except (TypeError, ValueError):
+            return None
+
+    def next_delay(self, retry_after: str = None) -> float | None:
+        """seconds to wait before the next attempt, None if the request shouldn't be retried anymore"""
+        if self.attempt >= self.policy.max_attempts:
+            return None
+
+        delay = self.parse_retry_after(retry_after)
+        if delay is None:
+            # decorrelated jitter: random between base and 3x the previous delay, capped
+            self.delay = delay = min(self.policy.max_delay, uniform(self.policy.base_delay, self.delay * 3))
+
+        if self.waited + delay > self.policy.max_retry_time or not self.budget.withdraw():
+            return None
+
+        self.attempt += 1
+        self.waited += delay
+        return delay
@@ -2,15 +2,20 @@ from __future__ import annotations
 import aiohttp
 import asyncio
 from abc import abstractmethod
-from bs4 import BeautifulSoup
-from typing import Dict, List, Tuple, Any
-from config import ServerConfig
+from bs4 import SoupStrainer
+from typing import Dict, List, Tuple, Any, AsyncIterator
+from config import ServerConfig, DownloadConfig
 from utils.headers import get_headers
 import re
 import string
+from functools import lru_cache
 from json import JSONDecodeError
 from .base import Scraper
+from .parser import make_soup, class_regex, run_parser
+from .retry import RetryPolicy
 from utils import DB
+from video.library import WatchList
+from utils.ttl_cache import TTLCache
 
 
 class Anime(Scraper):
@@ -51,6 +56,17 @@ class Animepahe(Anime):
     site_url: str = "https://animepahe.ru"
     api_url: str = "https://animepahe.ru/api"
     manifest_header = get_headers({"referer": "https://kwik.cx", "origin": "https://kwik.cx"})
+    retry_policy: RetryPolicy = RetryPolicy(max_attempts=4, max_retry_time=20)  # cloudflare 429s come with Retry-After
+    cache_ttls = (
+        (r"/api\?.*\bm=search\b", 6 * 60 * 60),
+        (r"/api\?.*\bm=release\b", 15 * 60),  # new episodes show up here first
+        (r"animepahe\.ru/anime/", 12 * 60 * 60),  # description & recommendations
+        (r"animepahe\.ru/play/", 60 * 60),
+    )
+    # kwik url -> resolved manifest, the uwu urls it points to stay signed for a while after being issued
+    manifest_cache: TTLCache = TTLCache(maxsize=256, ttl=20 * 60)
+    _manifest_roots: Dict[str, str] = {}  # uwu root domain -> kwik url, to drop entries whose segments get refused
+    _anime_sessions: Dict[int, str] = None  # anime id -> session, backed by the anime_session table
 
     @staticmethod
     def __minify_text(text: str) -> str:
@@ -100,12 +116,15 @@ class Animepahe(Anime):
         episodes = {"ep_details": []}
 
         try:
-            episode_data = await self.get_episode_sessions(anime_session=anime_session, page_no=page_no)
-
             if page_no == "1":
-                description = self.get_anime_description(anime_session)
+                # both requests are independent, description is only needed on the first page
+                episode_data, description = await asyncio.gather(
+                    self.get_episode_sessions(anime_session=anime_session, page_no=page_no),
+                    self.get_anime_description(anime_session))
                 episodes[
                     "recommendation"] = f"{ServerConfig.API_SERVER_ADDRESS}/recommendation?anime_session={anime_session}"
+            else:
+                episode_data = await self.get_episode_sessions(anime_session=anime_session, page_no=page_no)
 
             episodes["total_page"] = episode_data.get("last_page", 0)
             next_page_url = episode_data.get("next_page_url", None)
@@ -128,10 +147,9 @@ class Animepahe(Anime):
                         "snapshot": ep["snapshot"], "duration": ep["duration"]}})
 
             if page_no == "1":
-                episodes["description"] = await description
-                cur = DB.connection.cursor()
-                res = cur.execute("SELECT * FROM watchlist WHERE anime_id=?", (episodes["description"]["anime_id"],))
-                episodes["mylist"] = True if res.fetchone() else False
+                episodes["description"] = description
+                episodes["mylist"] = description["anime_id"] in WatchList.data
+                self.save_anime_session(description["anime_id"], anime_session)
 
             return episodes
         except TypeError:
@@ -139,6 +157,47 @@ class Animepahe(Anime):
         except JSONDecodeError:
             raise JSONDecodeError
 
+    @classmethod
+    def _load_anime_sessions(cls) -> Dict[int, str]:
+        if cls._anime_sessions is None:
+            cur = DB.connection.cursor()
+            cls._anime_sessions = {row[0]: row[1] for row in cur.execute("SELECT anime_id, session FROM anime_session")}
+            cur.close()
+        return cls._anime_sessions
+
+    @classmethod
+    async def get_anime_session(cls, anime_id: int, refresh: bool = False) -> str:
+        """session of an anime id, resolved through the /a/<id> redirect only when it isn't known yet or `refresh`"""
+        anime_id = int(anime_id)
+        session = cls._load_anime_sessions().get(anime_id, None)
+        if session and not refresh:
+            return session
+
+        redirected_url = (await cls.get(f"{cls.site_url}/a/{anime_id}")).url
+        session = str(redirected_url).replace(f"{cls.site_url}/anime/", "")
+        cls.save_anime_session(anime_id, session)
+        return session
+
+    @classmethod
+    def save_anime_session(cls, anime_id: int, session: str) -> None:
+        if cls._load_anime_sessions().get(anime_id, None) == session:
+            return
+        cls._anime_sessions[anime_id] = session
+        cur = DB.connection.cursor()
+        cur.execute("INSERT OR REPLACE INTO anime_session (anime_id, session) VALUES (?, ?)", (anime_id, session))
+        DB.connection.commit()
+        cur.close()
+
+    @classmethod
+    def forget_anime_session(cls, anime_id: int) -> None:
+        """drop the saved session of an anime id, upstream doesn't know it anymore"""
+        if cls._load_anime_sessions().pop(anime_id, None) is None:
+            return
+        cur = DB.connection.cursor()
+        cur.execute("DELETE FROM anime_session WHERE anime_id = ?", (anime_id,))
+        DB.connection.commit()
+        cur.close()
+
     async def get_anime_description(self, anime_session: str) -> Dict[str, str]:
         """scraping the anime description
 
@@ -161,15 +220,18 @@ class Animepahe(Anime):
             }
         """
 
+        description_header = get_headers({"referer": "{}/{}".format(self.site_url, anime_session)})
+
+        return await run_parser(self._parse_description, await (
+            await self.get(f"{self.site_url}/anime/{anime_session}", headers=description_header)).text())
+
+    @classmethod
+    def _parse_description(cls, html: str) -> Dict[str, Any]:
         description: Dict[str, Any] = {
             "synopsis": "", "eng_name": "", "studio": "-", "youtube_url": "", "external_links": {}
         }
 
-        description_header = get_headers({"referer": "{}/{}".format(self.site_url, anime_session)})
-
-        description_bs = BeautifulSoup(
-            await (await self.get(f"{self.site_url}/anime/{anime_session}", headers=description_header)).text(),
-            'html.parser')
+        description_bs = make_soup(html)
 
         bookmark_href = description_bs.find("a", {"class": "fa-link"}).get("href", "0")
 
@@ -229,15 +291,18 @@ class Animepahe(Anime):
             }
         """
 
-        resp: Dict[Any, List] = {}
-
         streaming_page = await self.get(f"{self.site_url}/play/{anime_session}/{episode_session}",
                                         headers=get_headers({"referer": "{}/{}".format(self.site_url,
                                                                                        anime_session)}))
-        streaming_page = await streaming_page.text()
 
-        for data in BeautifulSoup(streaming_page, 'html.parser').find("div", {"id": "resolutionMenu"}).find_all(
-                "button"):
+        return await run_parser(self._parse_stream_data, await streaming_page.text())
+
+    @classmethod
+    def _parse_stream_data(cls, streaming_page: str) -> Dict[Any, List[Tuple[str, str]]]:
+        resp: Dict[Any, List] = {}
+
+        for data in make_soup(streaming_page, SoupStrainer("div", id="resolutionMenu")).find(
+                "div", {"id": "resolutionMenu"}).find_all("button"):
             quality, kwik_url, aud = data["data-resolution"], data["data-src"], data["data-audio"]
             """
                 stream_dt (dict): {'quality': stream url (str)}
@@ -248,21 +313,41 @@ class Animepahe(Anime):
         return resp
 
     async def get_manifest_file(self, kwik_url: str) -> ('manifest_file', 'uwu_root_domain', 'file_name'):
+        manifest, uwu_root, file_name = await self.manifest_cache.get_or_load(
+            kwik_url, lambda: self._resolve_manifest(kwik_url))
+        return manifest, uwu_root, list(file_name)
+
+    async def _resolve_manifest(self, kwik_url: str) -> Tuple[str, str, Tuple[str, str]]:
         hls_data = await self.get_hls_playlist(kwik_url)
 
         uwu_url = hls_data["manifest_url"]
 
-        return await (await self.get(uwu_url,
-                                     headers=get_headers(
-                                         extra={"origin": "https://kwik.cx", "referer": "https://kwik.cx/"}))).text(), \
-            uwu_url.split("/uwu.m3u8")[0], \
-            [hls_data["file_name"].split("_-")[0].lstrip("AnimePahe_"), hls_data["file_name"].strip(".mp4")]
+        manifest = await (await self.get(uwu_url, headers=get_headers(
+            extra={"origin": "https://kwik.cx", "referer": "https://kwik.cx/"}))).text()
+        uwu_root = uwu_url.split("/uwu.m3u8")[0]
+
+        if len(self._manifest_roots) >= self.manifest_cache.maxsize:
+            for root, url in list(self._manifest_roots.items()):
+                if url not in self.manifest_cache:
+                    del self._manifest_roots[root]
+        self._manifest_roots[uwu_root] = kwik_url
+
+        return manifest, uwu_root, \
+            (hls_data["file_name"].split("_-")[0].lstrip("AnimePahe_"), hls_data["file_name"].strip(".mp4"))
+
+    @classmethod
+    def invalidate_manifest(cls, url: str) -> None:
+        """upstream refused `url` (segment, key or manifest), resolve the manifest it belongs to again on next use"""
+        for root, kwik_url in list(cls._manifest_roots.items()):
+            if url.startswith(root):
+                del cls._manifest_roots[root]
+                cls.manifest_cache.invalidate(kwik_url)
 
     async def get_recommendation(self, anime_session: str) -> List[Dict[str, str]]:
 
         try:
 
-            resp = await self.get(f"{self.site_url}/anime/{anime_session}", {"anime_session": anime_session},
+            resp = await self.get(f"{self.site_url}/anime/{anime_session}",
                                   headers=get_headers(extra={"referer": self.site_url}))
 
             resp = await resp.text()
@@ -270,7 +355,11 @@ class Animepahe(Anime):
         except aiohttp.ClientResponseError:
             raise ValueError("Invalid anime session")
 
-        rec_bs = BeautifulSoup(resp, 'html.parser')
+        return await run_parser(self._parse_recommendation, resp)
+
+    @classmethod
+    def _parse_recommendation(cls, resp: str) -> List[Dict[str, str]]:
+        rec_bs = make_soup(resp, SoupStrainer("div", class_=class_regex("col-2", "col-9")))
 
         col_2s = rec_bs.find_all("div", {"class": 'col-2'})
         col_9s = rec_bs.find_all("div", {"class": 'col-9'})
@@ -285,16 +374,16 @@ class Animepahe(Anime):
 
             data = col_9.text.strip().split("\n")
             title = data[0]
-            m_data = self._strip_split(data[1], split_chr="-")
+            m_data = cls._strip_split(data[1], split_chr="-")
             typ = m_data[0].strip()
-            m_data = self._strip_split(m_data[1])
+            m_data = cls._strip_split(m_data[1])
             ep = m_data[0]
-            status = self._strip_split(m_data[2], strip_chr="(")[0]
-            season, year = self._strip_split(data[2])
+            status = cls._strip_split(m_data[2], strip_chr="(")[0]
+            season, year = cls._strip_split(data[2])
 
-            session = self._strip_split(col_2.find("a", href=True)["href"], strip_chr="/", split_chr="/")[1]
+            session = cls._strip_split(col_2.find("a", href=True)["href"], strip_chr="/", split_chr="/")[1]
             poster = col_2.find("img").get("data-src",
-                                           f"{ServerConfig.API_SERVER_ADDRESS}/default/{self.default_poster}").replace(
+                                           f"{ServerConfig.API_SERVER_ADDRESS}/default/{cls.default_poster}").replace(
                 ".th.jpg", ".jpg")
 
             rec_list.append({"jp_name": title,
@@ -337,23 +426,79 @@ class Animepahe(Anime):
 
         return search_response
 
-    async def __get_episodes(self, anime_session: str, page: int = 1) -> list:
-        return [x["session"] for x in
-                (await self.get_api({"m": "release", "sort": "episode_desc", "id": anime_session, "page": page}))[
-                    "data"]]
+    async def iter_episodes(self, anime_session: str, page: int | None = 1) -> AsyncIterator[Dict[str, Any]]:
+        """episodes of the release list oldest first, only of `page` or of every page when it is None.
+        Next page is requested once the current one is consumed."""
+        page_no = page or 1
+        while True:
+            release = await self.get_api({"m": "release", "sort": "episode_asc", "id": anime_session, "page": page_no})
+            for episode in release.get("data", None) or []:
+                yield episode
 
-    async def get_links(self, anime_session: str, page: int = 1, aud: str = "jap") -> list:
-        links = []
+            if page or page_no >= release.get("last_page", 1):
+                return
+            page_no += 1
 
-        stream_datas = await asyncio.gather(
-            *[self.get_stream_data(anime_session, episode) for episode in
-              await self.__get_episodes(anime_session, page)])
-        for stream_datas in stream_datas:
-            best_quality: Tuple = (0, "")
-            for _stream_data in stream_datas[aud]:
-                best_quality = _stream_data if best_quality[0] < _stream_data[0] else ...
-            links.append(best_quality[1])
-        return links
+    @staticmethod
+    def pick_stream(stream_data: Dict[str, List[Tuple[str, str]]], aud: str = "jpn", quality: int = None) -> str | None:
+        """kwik url of the best quality not above `quality` (any when None), in `aud` if the episode has it"""
+        streams = stream_data.get(aud, None) or next(iter(stream_data.values()), [])
+        streams = sorted(streams, key=lambda stream: int(stream[0]))
+        if quality:
+            streams = [stream for stream in streams if int(stream[0]) <= int(quality)] or streams[:1]
+        return streams[-1][1] if streams else None
+
+    async def check_batch(self, anime_session: str, page: int | None = 1) -> None:
+        """raise ValueError when the (first) release page of a batch can't be fetched or lists no episode"""
+        try:
+            release = await self.get_api({"m": "release", "sort": "episode_asc", "id": anime_session, "page": page or 1})
+        except aiohttp.ClientResponseError as err:
+            raise ValueError(f"Invalid anime session: {err.message}")
+        if not release.get("data", None):
+            raise ValueError("Invalid anime session or page, no episode found")
+
+    async def iter_links(self, anime_session: str, page: int | None = 1, aud: str = "jpn", quality: int = None,
+                         ep_range: Tuple[float, float] = None, failed: List[str] = None) -> AsyncIterator[str]:
+        """kwik urls of the episodes of `page` (whole series when None) within `ep_range`, yielded as soon as each one is
+        resolved. At most DownloadConfig.RESOLVE_CONCURRENCY episodes are resolved at the same time, the next episode
+        (and release page) is only taken once one of them is done. An episode that can't be resolved is skipped (and
+        added to `failed`)."""
+
+        async def resolve(episode: Dict[str, Any]) -> str | None:
+            stream_data = await self.resolve_with_retry(
+                lambda: self.get_stream_data(anime_session, episode["session"]), f"episode {episode['episode']}")
+            link = self.pick_stream(stream_data, aud, quality) if stream_data else None
+            if not link and failed is not None:
+                failed.append(f"episode {episode['episode']}")
+            return link
+
+        pending = set()
+        try:
+            async for episode in self.iter_episodes(anime_session, page):
+                if ep_range and not ep_range[0] <= float(episode["episode"]) <= ep_range[1]:
+                    continue
+                pending.add(asyncio.ensure_future(resolve(episode)))
+
+                # hand out what is ready, wait for a free slot when every one is taken
+                full = len(pending) >= DownloadConfig.RESOLVE_CONCURRENCY
+                done, pending = await asyncio.wait(pending, timeout=None if full else 0,
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.result():
+                        yield task.result()
+
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.result():
+                        yield task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def get_links(self, anime_session: str, page: int | None = 1, aud: str = "jpn", quality: int = None,
+                        ep_range: Tuple[float, float] = None) -> List[str]:
+        return [link async for link in self.iter_links(anime_session, page, aud, quality, ep_range)]
 
     async def get_hls_playlist(self, kwik_url: str) -> dict:
         try:
@@ -362,17 +507,24 @@ class Animepahe(Anime):
         except aiohttp.ClientResponseError:
             raise ValueError("Invalid Kwik URL")
 
-        data = self.__minify_text(stream_response)
+        return await run_parser(self._parse_hls_playlist, stream_response)
+
+    @classmethod
+    def _parse_hls_playlist(cls, stream_response: str) -> Dict[str, str]:
+        data = cls.__minify_text(stream_response)
         rx = re.compile(r"returnp}\('(.*?)',(\d*),(\d*),'(.*?)'.split")
         title_re = re.compile(r"<title>(.*?)</title>")
         title = title_re.search(data).group(1)
         r = rx.findall(data)
         x = r[-1]
-        unpacked = self.js_unpack(x[0], x[1], x[2], x[3])
+        unpacked = cls.js_unpack(x[0], x[1], x[2], x[3])
         stream_re = re.compile(r"https://(.*?)uwu.m3u8")
         return {"file_name": title, "manifest_url": stream_re.search(unpacked).group(0)}
 
+    _word_re = re.compile(r"\b\w+\b")
+
     @staticmethod
+    @lru_cache(maxsize=4096)
     def int2base(x, base):
         digs = string.digits + string.ascii_letters
         if x < 0:
@@ -391,16 +543,14 @@ class Animepahe(Anime):
         digits.reverse()
         return "".join(digits)
 
-    def js_unpack(self, p, a, c, k):
+    @classmethod
+    def js_unpack(cls, p, a, c, k):
         k = k.split("|")
         a = int(a)
         c = int(c)
         d = {}
         while c > 0:
             c -= 1
-            d[self.int2base(c, a)] = k[c]
-        for x in d:
-            if d[x] == "":
-                d[x] = x
-            p = re.sub(f"\\b{x}\\b", d[x], p)
-        return p
+            d[cls.int2base(c, a)] = k[c]
+        # single pass over the payload, every word is looked up once instead of one re.sub per key
+        return cls._word_re.sub(lambda m: d.get(m.group(0), None) or m.group(0), p)
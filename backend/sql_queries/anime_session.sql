@@ -0,0 +1,5 @@
+CREATE TABLE IF NOT EXISTS anime_session (
+    anime_id integer PRIMARY KEY ,
+    session varchar NOT NULL ,  -- animepahe session of the anime, it changes after some time
+    updated_on datetime NOT NULL DEFAULT (datetime('now', 'localtime'))
+);
@@ -0,0 +1,6 @@
+CREATE TABLE IF NOT EXISTS download_queue (
+    task_id integer PRIMARY KEY ,  -- id of the progress_tracker row
+    priority int NOT NULL DEFAULT 0 ,  -- higher runs first
+    seq int NOT NULL DEFAULT 0 ,  -- order set by the user, lower runs first
+    added int NOT NULL  -- order the task was queued in
+);
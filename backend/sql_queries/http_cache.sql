@@ -0,0 +1,15 @@
+CREATE TABLE IF NOT EXISTS http_cache (
+    key char(40) PRIMARY KEY,  -- sha1 of method, url, params and content affecting headers
+    url varchar NOT NULL,  -- final url after redirects
+    status integer NOT NULL,
+    headers varchar NOT NULL,  -- json list of [name, value] pairs
+    body blob NOT NULL,
+    encoding char(50) NOT NULL,
+    etag varchar DEFAULT NULL,
+    last_modified varchar DEFAULT NULL,
+    size integer NOT NULL,
+    expires_on real NOT NULL,  -- unix timestamp
+    last_access real NOT NULL  -- unix timestamp, used for lru eviction
+);
+
+CREATE INDEX IF NOT EXISTS http_cache_last_access ON http_cache (last_access);
@@ -0,0 +1,7 @@
+"""run the regression tests with `python -m tests` from the backend directory"""
+import sys
+import unittest
+
+if __name__ == "__main__":
+    suite = unittest.defaultTestLoader.discover("tests", top_level_dir=".")
+    sys.exit(not unittest.TextTestRunner(verbosity=2).run(suite).wasSuccessful())
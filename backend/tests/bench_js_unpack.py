@@ -0,0 +1,43 @@
+"""
+kwik payload decoding, single pass js_unpack vs the former one re.sub per key
+
+    python -m tests.bench_js_unpack [--words 20000] [--vocabulary 300] [--rounds 5]
+"""
+import argparse
+import random
+import string
+from time import perf_counter
+
+from scraper.scraper import Animepahe
+from .test_js_unpack import KWIK_PAGES, PACKED_RE, pack, reference_unpack
+
+
+def timed(unpack, args, rounds: int) -> float:
+    """mean ms per unpack, int2base memo is cleared first so both start cold"""
+    Animepahe.int2base.cache_clear()
+    started = perf_counter()
+    for _ in range(rounds):
+        unpack(*args)
+    return (perf_counter() - started) / rounds * 1000
+
+
+def main() -> None:
+    args = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    args.add_argument("--words", type=int, default=20000, help="words of the synthetic payload")
+    args.add_argument("--vocabulary", type=int, default=300, help="distinct words (keys) of the synthetic payload")
+    args.add_argument("--rounds", type=int, default=5)
+    args = args.parse_args()
+
+    rng = random.Random(0)
+    vocabulary = ["w_" + "".join(rng.choices(string.ascii_lowercase, k=6)) for _ in range(args.vocabulary)]
+    inputs = [(page.name, PACKED_RE.findall(page.read_text())[-1]) for page in KWIK_PAGES]
+    inputs.append((f"{args.words} words / {args.vocabulary} keys", pack(" ".join(rng.choices(vocabulary, k=args.words)))))
+
+    print(f"{'payload':<36}{'keys':>6}{'old ms':>10}{'new ms':>10}{'speedup':>9}")
+    for name, packed in inputs:
+        old, new = timed(reference_unpack, packed, args.rounds), timed(Animepahe.js_unpack, packed, args.rounds)
+        print(f"{name:<36}{packed[2]:>6}{old:>10.2f}{new:>10.2f}{old / new:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
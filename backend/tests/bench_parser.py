@@ -0,0 +1,50 @@
+"""
+parse time of the scraper pages per backend, full tree vs SoupStrainer subtree
+
+    python -m tests.bench_parser [--rounds 50] [--padding 200]
+
+pages are the ones of test_parser, padded with unrelated markup outside the parsed regions like real pages are.
+"""
+import argparse
+from time import perf_counter
+from unittest import mock
+
+from config import ParserConfig, ServerConfig
+from .test_parser import BACKENDS, StrainedParseTest, _full_soup
+
+FILLER = ('<div class="card"><a href="/anime/x" title="x"><img src="x.jpg"></a><p>some <b>text</b> and '
+          '<span class="tag">tags</span></p><ul><li>one</li><li>two</li><li>three</li></ul></div>\n')
+
+
+def pad(page: str, padding: int) -> str:
+    return page.replace("</body>", FILLER * padding + "</body>")
+
+
+def timed(parse_func, args, rounds: int) -> float:
+    """mean ms per parse"""
+    started = perf_counter()
+    for _ in range(rounds):
+        parse_func(*args)
+    return (perf_counter() - started) / rounds * 1000
+
+
+def main() -> None:
+    args = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    args.add_argument("--rounds", type=int, default=50)
+    args.add_argument("--padding", type=int, default=200, help="filler blocks added to each page")
+    args = args.parse_args()
+
+    ServerConfig.API_SERVER_ADDRESS = "http://localhost:6969"
+    print(f"{'parse function':<36}{'backend':<13}{'full ms':>9}{'strained ms':>13}{'speedup':>9}")
+    for module, parse_func, (page, *rest) in StrainedParseTest.cases:
+        page_args = (pad(page, args.padding), *rest)
+        for backend in BACKENDS:
+            ParserConfig.BACKEND = backend
+            strained = timed(parse_func, page_args, args.rounds)
+            with mock.patch(f"{module}.make_soup", _full_soup):
+                full = timed(parse_func, page_args, args.rounds)
+            print(f"{parse_func.__qualname__:<36}{backend:<13}{full:>9.2f}{strained:>13.2f}{full / strained:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+event loop lag while heavy pages are parsed, inline vs run_parser in the thread / process pool
+
+    python -m tests.bench_run_parser [--pages 20] [--chapters 2000]
+
+a probe task standing for segment traffic ticks every 5 ms, its lag is how late the loop ran it.
+"""
+import argparse
+import asyncio
+from time import perf_counter
+
+from config import ParserConfig, ServerConfig
+from scraper import parser
+from scraper.manga_scraper import MangaKatana
+from .test_parser import MANGA_PAGE
+
+INTERVAL = 0.005  # seconds between two probe ticks
+SESSION = "https://mangakatana.com/manga/series.1"
+ROW = ('<tr><td><div class="chapter"><a href="https://mangakatana.com/manga/series.1/c{0}">Chapter {0}: Title {0}</a>'
+       '</div></td><td class="update_time">Jan 1</td></tr>\n')
+
+
+async def probe(stop: asyncio.Event, lags: list) -> None:
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        expected = loop.time() + INTERVAL
+        await asyncio.sleep(INTERVAL)
+        lags.append(loop.time() - expected)
+
+
+async def parse_pages(pages: list, mode: str) -> float:
+    """seconds to parse every page, lag of the loop meanwhile is recorded by probe"""
+    started = perf_counter()
+    if mode == "inline":
+        for page in pages:
+            MangaKatana._parse_chp_session(page, SESSION)
+            await asyncio.sleep(0)
+    else:
+        await asyncio.gather(*(parser.run_parser(MangaKatana._parse_chp_session, page, SESSION) for page in pages))
+    return perf_counter() - started
+
+
+async def run(pages: list, mode: str) -> None:
+    if mode != "inline":
+        ParserConfig.EXECUTOR = mode
+        await parser.run_parser(MangaKatana._parse_chp_session, pages[0], SESSION)  # start the pool workers first
+    stop, lags = asyncio.Event(), []
+    prober = asyncio.create_task(probe(stop, lags))
+    await asyncio.sleep(0.05)
+    elapsed = await parse_pages(pages, mode)
+    stop.set()
+    await prober
+    parser.shutdown_executor()
+    lags = sorted(lag * 1000 for lag in lags)
+    print(f"{mode:>8}: {elapsed:6.2f}s  ticks {len(lags):5} of {int(elapsed / INTERVAL):5}  lag p50 {lags[len(lags) // 2]:7.1f} ms  p99 {lags[int(len(lags) * .99)]:7.1f} ms"
+          f"  max {lags[-1]:7.1f} ms")
+
+
+def main() -> None:
+    args = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    args.add_argument("--pages", type=int, default=20)
+    args.add_argument("--chapters", type=int, default=2000, help="chapters listed on each page")
+    args = args.parse_args()
+
+    ServerConfig.API_SERVER_ADDRESS = "http://localhost:6969"
+    page = MANGA_PAGE.replace("<table>\n  <tr>", "<table>\n" + "".join(map(ROW.format, range(args.chapters))) + "  <tr>")
+    pages = [page] * args.pages
+    print(f"{args.pages} pages of {args.chapters} chapters, {ParserConfig.WORKERS} pool workers")
+    for mode in ("inline", "thread", "process"):
+        asyncio.run(run(pages, mode))
+
+
+if __name__ == "__main__":
+    main()
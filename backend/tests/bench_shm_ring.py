@@ -0,0 +1,96 @@
+"""
+segment handoff to another process, SharedRing vs pickling the payload through a pipe
+
+    python -m tests.bench_shm_ring [--segments 400] [--size 2097152] [--slots 8]
+
+both consumers checksum the payload so they do the same work, only the transport differs.
+"""
+import argparse
+import os
+import zlib
+from multiprocessing import Pipe, Process
+from multiprocessing.connection import Connection
+from time import perf_counter
+
+from video.downloader.shm_ring import SharedRing
+
+
+def pipe_consumer(jobs: Connection, acks: Connection) -> None:
+    while (data := jobs.recv()) is not None:
+        acks.send(zlib.crc32(data))
+
+
+def ring_consumer(ring: SharedRing, jobs: Connection, acks: Connection) -> None:
+    while (job := jobs.recv()) is not None:
+        slot, length = job
+        with ring.view(slot, length) as view:
+            crc = zlib.crc32(view)
+        ring.done(slot)
+        acks.send((slot, crc))
+    ring.close()
+
+
+def run_pipe(payloads, in_flight: int) -> float:
+    jobs, jobs_in = Pipe(duplex=False)
+    acks, acks_in = Pipe(duplex=False)
+    consumer = Process(target=pipe_consumer, args=(jobs, acks_in), daemon=True)
+    consumer.start()
+    started, pending, crcs = perf_counter(), 0, []
+    for data in payloads:
+        if pending == in_flight:
+            crcs.append(acks.recv())
+            pending -= 1
+        jobs_in.send(data)
+        pending += 1
+    crcs.extend(acks.recv() for _ in range(pending))
+    elapsed = perf_counter() - started
+    jobs_in.send(None)
+    consumer.join()
+    assert crcs == [zlib.crc32(data) for data in payloads]
+    return elapsed
+
+
+def run_ring(payloads, slots: int) -> float:
+    ring = SharedRing(slots, max(map(len, payloads)))
+    jobs, jobs_in = Pipe(duplex=False)
+    acks, acks_in = Pipe(duplex=False)
+    consumer = Process(target=ring_consumer, args=(ring, jobs, acks_in), daemon=True)
+    consumer.start()
+    started, pending, crcs = perf_counter(), 0, []
+    for data in payloads:
+        while (slot := ring.try_put(data)) is None:  # every slot in flight, wait for the consumer
+            done, crc = acks.recv()
+            ring.release(done)
+            crcs.append(crc)
+            pending -= 1
+        jobs_in.send((slot, len(data)))
+        pending += 1
+    for _ in range(pending):
+        done, crc = acks.recv()
+        ring.release(done)
+        crcs.append(crc)
+    elapsed = perf_counter() - started
+    jobs_in.send(None)
+    consumer.join()
+    ring.close()
+    assert crcs == [zlib.crc32(data) for data in payloads]
+    return elapsed
+
+
+def main() -> None:
+    args = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    args.add_argument("--segments", type=int, default=400)
+    args.add_argument("--size", type=int, default=2 * 1024 * 1024, help="segment size in bytes")
+    args.add_argument("--slots", type=int, default=8, help="segments in flight")
+    args = args.parse_args()
+
+    payloads = [os.urandom(args.size) for _ in range(min(args.segments, 16))]
+    payloads = [payloads[i % len(payloads)] for i in range(args.segments)]
+    total = args.segments * args.size / 1024 ** 2
+
+    for name, elapsed in (("pipe", run_pipe(payloads, args.slots)), ("shm ring", run_ring(payloads, args.slots))):
+        print(f"{name:>8}: {elapsed:.3f}s  {total / elapsed:8.1f} MiB/s  {elapsed / args.segments * 1e6:8.1f} us/segment")
+
+
+if __name__ == "__main__":
+    main()
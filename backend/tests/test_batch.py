@@ -0,0 +1,86 @@
+import asyncio
+import unittest
+from unittest import mock
+
+from config import DownloadConfig
+from scraper.scraper import Animepahe
+from video.downloader import DownloadManager
+
+PAGES, PER_PAGE = 5, 30
+
+
+class SeriesBatchTest(unittest.TestCase):
+    """a whole series batch walks the release pages lazily, never resolving more than RESOLVE_CONCURRENCY at once"""
+
+    def setUp(self):
+        self.pages_fetched = 0
+        self.resolving = self.max_resolving = 0
+        self.manifests = self.max_manifests = 0
+
+        async def get_api(_cls, params, *args, **kwargs):
+            self.pages_fetched += 1
+            page = params["page"]
+            first = (page - 1) * PER_PAGE + 1
+            return {"last_page": PAGES, "data": [{"episode": ep, "session": f"ep-{ep}"}
+                                                 for ep in range(first, first + PER_PAGE)]}
+
+        async def get_stream_data(_self, anime_session, episode_session):
+            self.resolving += 1
+            self.max_resolving = max(self.max_resolving, self.resolving)
+            await asyncio.sleep(0.001)
+            self.resolving -= 1
+            return {"jpn": [("720", f"kwik/{episode_session}")]}
+
+        async def get_manifest_file(_self, link):
+            self.manifests += 1
+            self.max_manifests = max(self.max_manifests, self.manifests)
+            await asyncio.sleep(0.002)
+            self.manifests -= 1
+            return "#EXTM3U", None, ["series", link]
+
+        patches = [mock.patch.object(Animepahe, "get_api", classmethod(get_api)),
+                   mock.patch.object(Animepahe, "get_stream_data", get_stream_data),
+                   mock.patch.object(Animepahe, "get_manifest_file", get_manifest_file)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_iter_links(self):
+        async def collect():
+            links, pages_at_first_link = [], None
+            async for link in Animepahe().iter_links("series", None):
+                if pages_at_first_link is None:
+                    pages_at_first_link = self.pages_fetched
+                links.append(link)
+            return links, pages_at_first_link
+
+        links, pages_at_first_link = asyncio.run(collect())
+        self.assertEqual(sorted(links), sorted(f"kwik/ep-{ep}" for ep in range(1, PAGES * PER_PAGE + 1)))
+        self.assertEqual(pages_at_first_link, 1)
+        self.assertEqual(self.pages_fetched, PAGES)
+        self.assertLessEqual(self.max_resolving, DownloadConfig.RESOLVE_CONCURRENCY)
+
+    def test_ep_range(self):
+        links = asyncio.run(Animepahe().get_links("series", None, ep_range=(29, 32)))
+        self.assertEqual(sorted(links), ["kwik/ep-29", "kwik/ep-30", "kwik/ep-31", "kwik/ep-32"])
+
+    def test_schedule_batch(self):
+        scheduled = []
+
+        async def schedule_download(_cls, typ, file_name, header, manifest=None, priority=None):
+            scheduled.append(file_name[1])
+
+        async def run():
+            tasks = len(asyncio.all_tasks())
+            with mock.patch.object(DownloadManager, "_schedule_download", classmethod(schedule_download)):
+                batch = asyncio.ensure_future(DownloadManager._schedule_batch("video", Animepahe(), "series", None))
+                while not batch.done():
+                    self.max_tasks = max(getattr(self, "max_tasks", 0), len(asyncio.all_tasks()) - tasks)
+                    await asyncio.sleep(0)
+                await batch
+
+        asyncio.run(run())
+        self.assertEqual(len(scheduled), PAGES * PER_PAGE)
+        self.assertLessEqual(self.max_manifests, DownloadConfig.RESOLVE_CONCURRENCY)
+        # the batch, its episode resolutions and its manifest resolutions, not one task per episode
+        self.assertLessEqual(self.max_tasks, 1 + 2 * DownloadConfig.RESOLVE_CONCURRENCY)
@@ -0,0 +1,89 @@
+import asyncio
+import json
+import sqlite3
+import unittest
+from unittest import mock
+
+from aiohttp import ClientResponseError
+from starlette.requests import Request
+
+import api
+from config import DBConfig
+from scraper.scraper import Animepahe
+from utils.init_db import DB
+
+
+def _request(**params) -> Request:
+    query = "&".join(f"{key}={value}" for key, value in params.items())
+    return Request({"type": "http", "method": "GET", "path": "/ep_details", "query_string": query.encode(),
+                    "headers": []})
+
+
+class _Redirect:
+    def __init__(self, url: str):
+        self.url = url
+
+
+class StaleSessionTest(unittest.TestCase):
+    """/ep_details?anime_id= with a saved session upstream has expired"""
+
+    def setUp(self):
+        self._connection, self._sessions = DB.connection, Animepahe._anime_sessions
+        DB.connection = sqlite3.connect(":memory:")
+        DB.connection.executescript(DBConfig.DEFAULT_SQL_DIR.joinpath("anime_session.sql").read_text())
+        Animepahe._anime_sessions = None
+        Animepahe.save_anime_session(42, "stale")
+        self.fetched = []
+        self.upstream_status = 404
+
+        async def get_episode_details(_self, anime_session, page_no):
+            self.fetched.append(anime_session)
+            if anime_session == "stale":
+                raise ClientResponseError(None, (), status=self.upstream_status)
+            return {"session": anime_session}
+
+        async def get(_cls, url, *args, **kwargs):
+            return _Redirect(f"{Animepahe.site_url}/anime/fresh")
+
+        patches = [mock.patch.object(Animepahe, "get_episode_details", get_episode_details),
+                   mock.patch.object(Animepahe, "get", classmethod(get))]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        DB.connection.close()
+        DB.connection, Animepahe._anime_sessions = self._connection, self._sessions
+
+    def _saved(self):
+        return DB.connection.execute("SELECT session FROM anime_session WHERE anime_id = 42").fetchone()
+
+    def test_expired_session_is_resolved_again(self):
+        response = asyncio.run(api.get_ep_details(_request(anime_id=42)))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.body), {"session": "fresh"})
+        self.assertEqual(self.fetched, ["stale", "fresh"])
+        self.assertEqual(Animepahe._anime_sessions[42], "fresh")
+        self.assertEqual(self._saved(), ("fresh",))
+
+    def test_failed_refresh_forgets_session(self):
+        async def unreachable(_cls, url, *args, **kwargs):
+            raise ClientResponseError(None, (), status=503)
+
+        with mock.patch.object(Animepahe, "get", classmethod(unreachable)):
+            with self.assertRaises(ClientResponseError):
+                asyncio.run(api.get_ep_details(_request(anime_id=42)))
+        self.assertNotIn(42, Animepahe._anime_sessions)
+        self.assertIsNone(self._saved())
+
+    def test_upstream_error_is_not_a_stale_session(self):
+        self.upstream_status = 503
+        with self.assertRaises(ClientResponseError):
+            asyncio.run(api.get_ep_details(_request(anime_id=42)))
+        self.assertEqual(self.fetched, ["stale"])
+        self.assertEqual(self._saved(), ("stale",))
+
+    def test_session_param_is_not_refreshed(self):
+        with self.assertRaises(ClientResponseError):
+            asyncio.run(api.get_ep_details(_request(anime_session="stale")))
+        self.assertEqual(self.fetched, ["stale"])
@@ -0,0 +1,95 @@
+import json
+import random
+import re
+import string
+import unittest
+from collections import Counter
+from pathlib import Path
+
+from scraper.scraper import Animepahe
+
+# kwik embed pages (.html) along with the expected manifest, file name and unpacked script (.json)
+KWIK_PAGES = sorted(Path(__file__).parent.joinpath("fixtures", "kwik").glob("*.html"))
+PACKED_RE = re.compile(r"}\('(.*?)',(\d+),(\d+),'(.*?)'\.split")
+
+
+def reference_unpack(p, a, c, k):
+    """js_unpack before the single pass rewrite, one re.sub over the payload per key"""
+    k = k.split("|")
+    a = int(a)
+    c = int(c)
+    d = {}
+    while c > 0:
+        c -= 1
+        d[Animepahe.int2base(c, a)] = k[c]
+    for x in d:
+        if d[x] == "":
+            d[x] = x
+        p = re.sub(f"\\b{x}\\b", d[x], p)
+    return p
+
+
+def pack(source, base=62):
+    """minimal p.a.c.k.e.r., the most used words get the shortest keys, a word equal to its key is left empty"""
+    words = [word for word, _ in Counter(re.findall(r"\b\w+\b", source)).most_common()]
+    keys = {word: Animepahe.int2base(index, base) for index, word in enumerate(words)}
+    payload = re.sub(r"\b\w+\b", lambda m: keys[m.group(0)], source)
+    return payload, str(base), str(len(words)), "|".join("" if keys[word] == word else word for word in words)
+
+
+class JsUnpackTest(unittest.TestCase):
+
+    def test_golden(self):
+        cases = [
+            (("0 1=2", "10", "3", "var|x|42"), "var x=42"),
+            # an empty entry keeps the word as is
+            (("0 1=2", "10", "3", "var||42"), "var 1=42"),
+            # keys past the base are two digits long and must not match their single digit prefix
+            (("a 10 1", "10", "11", "|one|||||||||ten"), "a ten one"),
+            # words only containing a key are not keys themselves
+            (("0 00 0a a0", "36", "11", "x|||||||||||"), "x 00 0a a0"),
+            (("0(\\'1://2.3/4/5/6.m3u8\\')", "62", "7", "source|https|eu|files|stream|ab|uwu"),
+             "source(\\'https://eu.files/stream/ab/uwu.m3u8\\')"),
+        ]
+        for args, expected in cases:
+            with self.subTest(args=args):
+                self.assertEqual(Animepahe.js_unpack(*args), expected)
+
+    def test_round_trip(self):
+        rng = random.Random(0)
+        vocabulary = ["".join(rng.choices(string.ascii_letters + "_", k=rng.randint(1, 8))) for _ in range(400)]
+        source = ";".join("{}.{}({},'{}')".format(*rng.choices(vocabulary, k=4)) for _ in range(2000))
+        self.assertEqual(Animepahe.js_unpack(*pack(source)), source)
+
+    def test_matches_reference(self):
+        rng = random.Random(1)
+        for base in (10, 36, 62):
+            # values are never keys here, the old implementation substituted again inside values that were
+            vocabulary = ["w_" + "".join(rng.choices(string.ascii_lowercase, k=5)) for _ in range(300)]
+            source = " ".join(rng.choices(vocabulary, k=3000))
+            with self.subTest(base=base):
+                args = pack(source, base)
+                self.assertEqual(Animepahe.js_unpack(*args), reference_unpack(*args))
+
+    def test_hls_playlist(self):
+        payload, base, count, keys = pack("const source='https://eu-01.files.nextcdn.org/stream/01/ab12/uwu.m3u8';")
+        page = ("<html><head><title>AnimePahe_Some_Anime_-_01_1080p_Sub.mp4</title></head><body><script>"
+                "eval(function(p,a,c,k,e,d){e=function(c){return c};while(c--){if(k[c]){p=p.replace("
+                "new RegExp('\\\\b'+e(c)+'\\\\b','g'),k[c])}}return p}"
+                f"('{payload}',{base},{count},'{keys}'.split('|'),0,{{}}))</script></body></html>")
+        self.assertEqual(Animepahe._parse_hls_playlist(page), {
+            "file_name": "AnimePahe_Some_Anime_-_01_1080p_Sub.mp4",
+            "manifest_url": "https://eu-01.files.nextcdn.org/stream/01/ab12/uwu.m3u8"})
+
+    def test_kwik_pages(self):
+        self.assertTrue(KWIK_PAGES)
+        for page_path in KWIK_PAGES:
+            expected = json.loads(page_path.with_suffix(".json").read_text())
+            page = page_path.read_text()
+            with self.subTest(page=page_path.name):
+                self.assertEqual(Animepahe._parse_hls_playlist(page),
+                                 {"file_name": expected["file_name"], "manifest_url": expected["manifest_url"]})
+                args = PACKED_RE.findall(page)[-1]
+                # the one re.sub per key implementation got this wrong: numbers of the script are keys too, it
+                # substituted them again
+                self.assertEqual(Animepahe.js_unpack(*args).replace("\\'", "'"), expected["script"])
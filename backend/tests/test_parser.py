@@ -0,0 +1,131 @@
+import unittest
+from unittest import mock
+
+from config import ParserConfig, ServerConfig
+from scraper import parser
+from scraper.manga_scraper import MangaKatana
+from scraper.scraper import Animepahe
+
+try:
+    import lxml  # noqa: F401
+    BACKENDS = ["html.parser", "lxml"]
+except ImportError:
+    BACKENDS = ["html.parser"]
+
+# pages keep decoys around the strained regions: look alike ids / classes, multi class attributes and nested tags
+
+STREAM_PAGE = """<html><body>
+<div id="resolutionMenuAlt"><button data-resolution="360" data-src="https://kwik.cx/e/decoy" data-audio="jpn">x</button></div>
+<div class="dropdown"><div id="resolutionMenu" class="dropdown-menu">
+  <button data-resolution="360" data-src="https://kwik.cx/e/a360" data-audio="jpn">360p</button>
+  <button data-resolution="1080" data-src="https://kwik.cx/e/a1080" data-audio="jpn"><span>1080p</span></button>
+  <button data-resolution="720" data-src="https://kwik.cx/e/e720" data-audio="eng">720p</button>
+</div></div>
+<button data-resolution="480" data-src="https://kwik.cx/e/outside" data-audio="jpn">480p</button>
+</body></html>"""
+
+REC_CARD = """<div class="row mx-n1">
+<div class="col-2 {extra}"><a href="/anime/{session}" title="{title}"><img data-src="https://i.animepahe.ru/posters/{session}.th.jpg"></a></div>
+<div class="col-9 px-1">{title}
+TV - {ep} Episodes (Finished Airing)
+<a href="/anime/season/spring-2020">Spring 2020</a></div>
+</div>"""
+
+ANIME_REC_PAGE = "<html><body><div class=\"col-12 col-2x\"><a href=\"/anime/decoy\"><img></a></div>{}</body></html>".format(
+    "".join(REC_CARD.format(session=f"s{i}", title=f"Title {i}", ep=i + 1, extra="d-none" if i % 2 else "")
+            for i in range(12)))
+
+MANGA_PAGE = """<html><body>
+<div class="chapters-list"><table><tr><td><div class="chapter"><a href="https://mangakatana.com/decoy">Chapter 0</a></div></td></tr></table></div>
+<ul class="meta d-table">
+  <li><div class="alt_name">Alt name</div></li><li><div class="authors"><a href="#">An Author</a></div></li>
+  <li><div class="status">Ongoing</div></li>
+</ul>
+<div class="summary"><h2>Summary</h2><p>The <b>first</b> summary.</p></div>
+<p>outside paragraph</p>
+<div class="uk-width chapters"><table>
+  <tr><td><div class="chapter"><a href="https://mangakatana.com/manga/series.1/c2">Chapter 2: Two</a></div></td><td class="update_time">Jan 2</td></tr>
+  <tr><td><div class="chapter"><a href="https://mangakatana.com/manga/series.1/c1">Chapter 1: One</a></div></td><td class="update_time">Jan 1</td></tr>
+</table></div>
+<div id="hot_book_decoy"><div class="widget"><div class="widget-title"><span>Similar series</span></div></div></div>
+<div id="hot_book">
+  <div class="widget"><div class="widget-title"><span>Hot</span></div>
+    <div class="item"><div class="wrap_img"><a href="https://img/hot.jpg"></a></div><div class="text">
+      <h3><a href="https://mangakatana.com/manga/hot.2">Hot</a></h3><div class="chapter">Chapter 9</div><div class="status">Ongoing</div></div></div>
+  </div>
+  <div class="widget"><div class="widget-title"><span>Similar Series</span></div>
+    <div class="item"><div class="wrap_img"><a href="https://img/a.jpg"></a></div><div class="text">
+      <h3><a href="https://mangakatana.com/manga/a.3">A</a></h3><div class="chapter">Chapter 12 Two</div><div class="status">Completed</div></div></div>
+    <div class="item"><div class="wrap_img"><a href="https://img/b.jpg"></a></div><div class="text">
+      <h3><a href="https://mangakatana.com/manga/b.4">B</a></h3><div class="chapter">Chapter 3</div><div class="status">Ongoing</div></div></div>
+  </div>
+</div>
+</body></html>"""
+
+CHAPTER_PAGE = """<html><head><script>var thzq=['https://i1/1.jpg','https://i1/2.jpg',];var other=1;</script></head><body>
+<select name="chapter_select_decoy"><option value="x" selected="selected">Decoy</option></select>
+<div class="nav"><select name="chapter_select">
+  <option value="c1">Chapter 1</option><option value="c2" selected="selected">Chapter 2: Two</option>
+</select></div>
+</body></html>"""
+
+
+def _full_soup(markup, parse_only=None):
+    return parser.make_soup(markup)
+
+
+class StrainedParseTest(unittest.TestCase):
+    """parse functions building only a subtree (SoupStrainer) must return the same as on the full tree"""
+
+    cases = [
+        ("scraper.scraper", Animepahe._parse_stream_data, (STREAM_PAGE,)),
+        ("scraper.scraper", Animepahe._parse_recommendation, (ANIME_REC_PAGE,)),
+        ("scraper.manga_scraper", MangaKatana._parse_chp_session, (MANGA_PAGE, "https://mangakatana.com/manga/series.1")),
+        ("scraper.manga_scraper", MangaKatana._parse_recommendation, (MANGA_PAGE,)),
+        ("scraper.manga_scraper", MangaKatana._parse_chapter,
+         (CHAPTER_PAGE, "https://mangakatana.com/manga/series.1/c2")),
+        ("scraper.manga_scraper", MangaKatana._parse_chapter_links, (MANGA_PAGE,)),
+    ]
+
+    @classmethod
+    def setUpClass(cls):
+        cls._backend, cls._address = ParserConfig.BACKEND, getattr(ServerConfig, "API_SERVER_ADDRESS", None)
+        ServerConfig.API_SERVER_ADDRESS = "http://localhost:6969"
+
+    @classmethod
+    def tearDownClass(cls):
+        ParserConfig.BACKEND, ServerConfig.API_SERVER_ADDRESS = cls._backend, cls._address
+
+    def test_equivalence(self):
+        for backend in BACKENDS:
+            ParserConfig.BACKEND = backend
+            for module, parse_func, args in self.cases:
+                with self.subTest(backend=backend, parse_func=parse_func.__qualname__):
+                    strained = parse_func(*args)
+                    with mock.patch(f"{module}.make_soup", _full_soup):
+                        full = parse_func(*args)
+                    self.assertTrue(strained)
+                    self.assertEqual(strained, full)
+
+    def test_decoys_skipped(self):
+        for backend in BACKENDS:
+            ParserConfig.BACKEND = backend
+            with self.subTest(backend=backend):
+                self.assertEqual(Animepahe._parse_stream_data(STREAM_PAGE), {
+                    "jpn": [("360", "https://kwik.cx/e/a360"), ("1080", "https://kwik.cx/e/a1080")],
+                    "eng": [("720", "https://kwik.cx/e/e720")]})
+                recommendations = Animepahe._parse_recommendation(ANIME_REC_PAGE)
+                self.assertEqual([rec["session"] for rec in recommendations], [f"s{i}" for i in range(10)])
+                self.assertEqual(recommendations[1]["poster"], "https://i.animepahe.ru/posters/s1.jpg")
+                self.assertEqual(MangaKatana._parse_chapter_links(MANGA_PAGE), [
+                    "https://mangakatana.com/manga/series.1/c2", "https://mangakatana.com/manga/series.1/c1"])
+                self.assertEqual([rec["title"] for rec in MangaKatana._parse_recommendation(MANGA_PAGE)], ["A", "B"])
+                self.assertEqual(MangaKatana._parse_chapter(CHAPTER_PAGE, "https://mangakatana.com/manga/series.1/c2"),
+                                 (["https://i1/1.jpg", "https://i1/2.jpg"], None, ["series", "Chapter 2: Two"]))
+
+    def test_class_regex(self):
+        pattern = parser.class_regex("meta", "col-2")
+        for value in ("meta", "meta d-table", "d-table meta", "a col-2 b"):
+            self.assertTrue(pattern.search(value), value)
+        for value in ("metadata", "col-22", "col-2x", "d-meta", ""):
+            self.assertFalse(pattern.search(value), value)
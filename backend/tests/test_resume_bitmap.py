@@ -0,0 +1,64 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from video.downloader.downloader import Downloader
+from video.downloader.resume_bitmap import ResumeBitmap
+
+
+class ResumeBitmapTest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._dir.cleanup)
+        self.dir = Path(self._dir.name)
+        self.path = self.dir.joinpath("episode.resume.yuk")
+        self.partial = self.dir.joinpath("partial.ts")
+
+    def _appended(self, segments: int, segment_size: int = 188) -> ResumeBitmap:
+        bitmap = ResumeBitmap(self.path, 20, "append")
+        for segment in range(segments):
+            bitmap.append(segment, (segment + 1) * segment_size)
+        self.addCleanup(bitmap.close)
+        return bitmap
+
+    def test_resume(self):
+        self._appended(5).close()
+        bitmap = ResumeBitmap(self.path, 20)
+        self.addCleanup(bitmap.close)
+        self.assertEqual((bitmap.mode, bitmap.done, bitmap.appended), ("append", 5, (4, 5 * 188)))
+        self.assertEqual(list(bitmap.remaining()), list(range(5, 20)))
+
+    def test_output_intact(self):
+        bitmap = self._appended(5)
+        self.assertFalse(bitmap.output_intact(self.partial))  # missing
+        self.partial.write_bytes(bytes(5 * 188 - 1))
+        self.assertFalse(bitmap.output_intact(self.partial))  # cut
+        self.partial.write_bytes(bytes(6 * 188))  # appended after the last recorded segment, truncated on resume
+        self.assertTrue(bitmap.output_intact(self.partial))
+        self.partial.unlink()
+        self.assertTrue(ResumeBitmap(self.dir.joinpath("new.resume.yuk"), 20, "append").output_intact(self.partial))
+
+    def test_reset(self):
+        bitmap = self._appended(5)
+        bitmap.reset()
+        self.assertEqual((bitmap.mode, bitmap.done, bitmap.appended), ("append", 0, (None, 0)))
+        self.assertEqual(list(bitmap.remaining()), list(range(20)))
+        bitmap.close()
+        reopened = ResumeBitmap(self.path, 20)
+        self.addCleanup(reopened.close)
+        self.assertEqual((reopened.done, reopened.appended), (0, (None, 0)))
+        self.assertEqual(ResumeBitmap.done_count(self.path), 0)
+
+    def test_legacy_log(self):
+        """downloads paused before the bitmap only have the text log until they are resumed"""
+        log = self.dir.joinpath(f"episode{Downloader.LEGACY_RESUME_EXTENSION}")
+        log.write_text("".join(f"SEGMENT {segment} {(segment + 1) * 188}\n" for segment in (0, 1, 2, 2, 5)))
+        self.assertEqual(Downloader.done_count(self.dir, "episode"), 4)
+        self.assertEqual(ResumeBitmap.done_count(self.path), 0)
+
+        bitmap = ResumeBitmap.from_log(self.path, log, 20)
+        self.addCleanup(bitmap.close)
+        self.assertFalse(log.exists())
+        self.assertEqual((bitmap.mode, bitmap.done, bitmap.appended), ("append", 4, (5, 6 * 188)))
+        self.assertEqual(Downloader.done_count(self.dir, "episode"), 4)
@@ -0,0 +1,62 @@
+import asyncio
+import ssl
+import logging
+from weakref import WeakKeyDictionary
+import aiohttp
+from config import HttpConfig
+from .rate_limiter import RateLimiter
+
+
+class HttpClient:
+    """
+    Managed aiohttp sessions shared by every scraper and downloader of a process.
+
+    aiohttp sessions are bound to the event loop they were created on, so one pooled session is kept per running loop
+    (the api server thread, the socket server loop and each download process have their own).
+    All of them use the same tuned connector settings and ssl context, so tcp/tls connections, dns lookups are reused
+    across requests instead of being made again for every call.
+    Every request made through these sessions waits for its host's RateLimiter token before being sent.
+    """
+    _sessions: "WeakKeyDictionary[asyncio.AbstractEventLoop, aiohttp.ClientSession]" = WeakKeyDictionary()
+    _ssl_context: ssl.SSLContext = None
+
+    @classmethod
+    def _get_ssl_context(cls) -> ssl.SSLContext:
+        if not cls._ssl_context:
+            cls._ssl_context = ssl.create_default_context()
+        return cls._ssl_context
+
+    @classmethod
+    def _create_session(cls) -> aiohttp.ClientSession:
+        connector = aiohttp.TCPConnector(
+            limit=HttpConfig.CONNECTION_LIMIT,
+            limit_per_host=HttpConfig.CONNECTION_LIMIT_PER_HOST,
+            keepalive_timeout=HttpConfig.KEEPALIVE_TIMEOUT,
+            ttl_dns_cache=HttpConfig.DNS_CACHE_TTL,
+            ssl=cls._get_ssl_context(),
+            enable_cleanup_closed=True,
+        )
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(cls._on_request_start)
+        return aiohttp.ClientSession(connector=connector, trace_configs=[trace_config])
+
+    @staticmethod
+    async def _on_request_start(_session, _ctx, params: aiohttp.TraceRequestStartParams) -> None:
+        await RateLimiter.acquire(params.url.host)
+
+    @classmethod
+    def get_session(cls) -> aiohttp.ClientSession:
+        """return the pooled session of the running event loop, creating it on first use"""
+        loop = asyncio.get_running_loop()
+        session = cls._sessions.get(loop, None)
+        if not session or session.closed:
+            session = cls._sessions[loop] = cls._create_session()
+        return session
+
+    @classmethod
+    async def close(cls) -> None:
+        """close the pooled session of the running event loop, must be called before the loop stops"""
+        session = cls._sessions.pop(asyncio.get_running_loop(), None)
+        if session and not session.closed:
+            await session.close()
+            logging.info("http session closed")
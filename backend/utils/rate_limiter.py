@@ -0,0 +1,179 @@
+from __future__ import annotations
+import asyncio
+from contextlib import contextmanager
+from contextvars import ContextVar
+from heapq import heappush, heappop
+from itertools import count
+from multiprocessing import Array
+from time import monotonic
+from typing import Dict, List, Tuple
+from weakref import WeakKeyDictionary
+from zlib import crc32
+from config import RateLimitConfig
+
+
+class HostBuckets:
+    """
+    Tokens of each host in shared memory, so the buckets of every loop and download process draw from the same
+    tokens (the table is passed to download processes when they are spawned) and a host gets its configured rate once.
+    A host is given a slot on first use, hosts coming after the table is full get a bucket of their own per loop.
+    """
+    _FIELDS = 3
+    _KEY, _TOKENS, _LAST = range(_FIELDS)
+    _FREE = 0
+
+    def __init__(self, slots: int):
+        self.slots = slots
+        self._state = Array("d", [self._FREE, 0, 0] * slots)  # host key, tokens, last refill
+
+    @staticmethod
+    def _key(host: str) -> int:
+        return crc32(host.encode()) + 1  # same in every process unlike hash(), 0 marks a free slot
+
+    def slot(self, host: str, burst: int) -> int | None:
+        key = self._key(host)
+        with self._state.get_lock():
+            state = self._state.get_obj()
+            free = None
+            for index in range(self.slots):
+                at = index * self._FIELDS
+                if state[at + self._KEY] == key:
+                    return index
+                if free is None and state[at + self._KEY] == self._FREE:
+                    free = index
+            if free is not None:
+                at = free * self._FIELDS
+                state[at:at + self._FIELDS] = [key, burst, monotonic()]
+            return free
+
+    def take(self, index: int, rate: float, burst: int) -> float:
+        """take a token of the host in slot index, 0 when taken, seconds until one is refilled otherwise"""
+        at = index * self._FIELDS
+        with self._state.get_lock():
+            state = self._state.get_obj()
+            now = monotonic()
+            tokens = min(burst, state[at + self._TOKENS] + (now - state[at + self._LAST]) * rate)
+            state[at + self._LAST] = now
+            if tokens >= 1:
+                state[at + self._TOKENS] = tokens - 1
+                return 0
+            state[at + self._TOKENS] = tokens
+            return (1 - tokens) / rate
+
+
+class TokenBucket:
+    """
+    Token bucket of a single host, tokens refill at `rate` per second up to `burst`.
+    Requests waiting for a token are served by priority first and arrival order second.
+    The tokens are kept in `shared` when the host has a slot there, in the bucket otherwise.
+    """
+
+    def __init__(self, rate: float, burst: int, shared: HostBuckets = None, slot: int = None):
+        self.rate = rate
+        self.burst = burst
+        self.tokens: float = burst
+        self.updated = monotonic()
+        self._shared = shared if slot is not None else None
+        self._slot = slot
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = count()
+        self._dispatcher: asyncio.Task | None = None
+
+    def _take(self) -> float:
+        """take a token, 0 when taken, seconds until one is refilled otherwise"""
+        if self._shared:
+            return self._shared.take(self._slot, self.rate, self.burst)
+
+        now = monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    async def acquire(self, priority: int) -> None:
+        if not self._waiters and not self._take():
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        heappush(self._waiters, (priority, next(self._seq), waiter))
+        if not self._dispatcher:
+            self._dispatcher = asyncio.ensure_future(self._dispatch())
+        await waiter
+
+    async def _dispatch(self) -> None:
+        try:
+            while self._waiters:
+                if self._waiters[0][2].done():  # waiter was cancelled meanwhile, it doesn't get a token
+                    heappop(self._waiters)
+                    continue
+
+                wait = self._take()
+                if wait:
+                    await asyncio.sleep(wait)
+                    continue
+
+                *_, waiter = heappop(self._waiters)
+                waiter.set_result(None)
+        finally:
+            self._dispatcher = None
+
+
+class RateLimiter:
+    """
+    Per-host request rate limiter used by every request made through the pooled HttpClient sessions.
+
+    Buckets are kept per event loop (futures can't be shared between loops) but their tokens live in the shared
+    HostBuckets table, so the api loop, the download manager loop and the download processes share one rate per host.
+    Requests made under `RateLimiter.batch()` (or in download processes) wait behind interactive api requests of the
+    same loop for the same host.
+    """
+    INTERACTIVE: int = 0
+    BATCH: int = 1
+
+    priority: ContextVar[int] = ContextVar("request_priority", default=INTERACTIVE)
+    _buckets: "WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, TokenBucket]]" = WeakKeyDictionary()
+    _shared: HostBuckets = None
+
+    @classmethod
+    def shared(cls) -> HostBuckets:
+        """tokens table of this process, must be created before the processes sharing it are spawned"""
+        if not cls._shared:
+            cls._shared = HostBuckets(RateLimitConfig.SHARED_HOSTS)
+        return cls._shared
+
+    @classmethod
+    def attach(cls, shared: HostBuckets) -> None:
+        """use the tokens table of the process that spawned this one"""
+        cls._shared = shared
+
+    @staticmethod
+    def _limit(host: str) -> Tuple[str, Tuple[float, int]]:
+        for domain, limit in RateLimitConfig.HOST_LIMITS.items():
+            if host == domain or host.endswith(f".{domain}"):
+                return domain, limit
+        return host, RateLimitConfig.DEFAULT_LIMIT
+
+    @classmethod
+    def get_bucket(cls, host: str) -> TokenBucket:
+        buckets = cls._buckets.setdefault(asyncio.get_running_loop(), {})
+        key, (rate, burst) = cls._limit(host)
+        if key not in buckets:
+            shared = cls.shared()
+            buckets[key] = TokenBucket(rate, burst, shared, shared.slot(key, burst))
+        return buckets[key]
+
+    @classmethod
+    async def acquire(cls, host: str) -> None:
+        await cls.get_bucket(host).acquire(cls.priority.get())
+
+    @classmethod
+    @contextmanager
+    def batch(cls):
+        """every request made inside this context (and tasks created from it) yields to interactive requests"""
+        token = cls.priority.set(cls.BATCH)
+        try:
+            yield
+        finally:
+            cls.priority.reset(token)
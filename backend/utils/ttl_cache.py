@@ -0,0 +1,78 @@
+from __future__ import annotations
+import asyncio
+import logging
+from collections import OrderedDict
+from time import monotonic
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+
+class TTLCache:
+    """
+    Bounded in-memory cache with expiry and stale-while-revalidate.
+
+    Entries younger than `ttl` are served as is, entries younger than `ttl + stale_ttl` are served right away while a
+    background task reloads them, older ones are reloaded before answering.
+    Once `maxsize` entries are stored, the least recently used one is dropped.
+    """
+
+    def __init__(self, maxsize: int = 128, ttl: float = 60, stale_ttl: float = 0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._data: OrderedDict[Hashable, Tuple[float, Any]] = OrderedDict()
+        self._loading: Dict[Hashable, asyncio.Future] = {}  # loads in progress, they keep a reference to their task
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key) is not None
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """fresh value of key, default if it is missing or expired"""
+        entry = self._data.get(key, None)
+        if not entry or monotonic() - entry[0] >= self.ttl:
+            return default
+        self._data.move_to_end(key)
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        self._data[key] = (monotonic(), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key: Hashable) -> None:
+        self._data.pop(key, None)
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        entry = self._data.get(key, None)
+        if entry:
+            age = monotonic() - entry[0]
+            if age < self.ttl + self.stale_ttl:
+                self._data.move_to_end(key)
+                if age >= self.ttl and key not in self._loading:
+                    self._load(key, loader)  # serve the stale value, refresh it in the background
+                return entry[1]
+
+        loading = self._loading.get(key, None)
+        if loading and loading.get_loop() is not asyncio.get_running_loop():
+            loading = None  # started by another thread's loop, its future can't be awaited from here
+        # shield, so a cancelled caller doesn't cancel the load for others waiting on the same key
+        return await asyncio.shield(loading or self._load(key, loader))
+
+    def _load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> asyncio.Future:
+        self._loading[key] = future = asyncio.ensure_future(loader())
+        future.add_done_callback(lambda _: self._loaded(key, future))
+        return future
+
+    def _loaded(self, key: Hashable, future: asyncio.Future) -> None:
+        if self._loading.get(key, None) is future:
+            del self._loading[key]
+
+        if future.cancelled():
+            return
+        if future.exception():
+            logging.error(f"loading {key} failed: {future.exception()!r}")
+            return
+        self.set(key, future.result())
@@ -0,0 +1,75 @@
+from __future__ import annotations
+import asyncio
+from datetime import datetime
+from multiprocessing import Array
+from time import monotonic
+from typing import Dict, Sequence, Tuple
+
+
+class BandwidthLimiter:
+    """
+    Token bucket of download bytes per second, shared by every download whether it runs in this process or in a
+    download process (the bucket lives in shared memory, it is passed to them when they are spawned).
+
+    The rate is, in order: the limit set at runtime (set_limit), the time of day profile covering the current time,
+    the default limit, 0 being unlimited. While a video is streamed (streaming() called less than `streaming_grace`
+    seconds ago) downloads are capped to `streaming_rate` on top of it, so playback gets the link.
+    Bytes are taken once received, a download owing tokens sleeps until they are refilled. The bucket holds one second
+    of tokens at most.
+    """
+    _OVERRIDE, _TOKENS, _LAST, _STREAMING_UNTIL = range(4)
+
+    def __init__(
+            self,
+            default_rate: int = 0,
+            profiles: Sequence[Tuple[str, str, int]] = (),
+            streaming_rate: int = 0,
+            streaming_grace: float = 5
+    ) -> None:
+        self.default_rate = default_rate
+        self.profiles = tuple(profiles)  # (start "HH:MM", end "HH:MM", rate), a range may wrap around midnight
+        self.streaming_rate = streaming_rate
+        self.streaming_grace = streaming_grace
+        self._state = Array("d", [-1, 0, 0, 0])  # override (-1 for none), tokens, last refill, streaming until
+        self._profile_cache: Dict[str, int] = {}  # "HH:MM" -> rate, profiles are only looked up once a minute
+
+    def _profile_rate(self) -> int:
+        now = datetime.now().strftime("%H:%M")
+        rate = self._profile_cache.get(now, None)
+        if rate is None:
+            rate = self.default_rate
+            for start, end, profile_rate in self.profiles:
+                if (start <= now < end) if start <= end else (now >= start or now < end):
+                    rate = profile_rate
+                    break
+            self._profile_cache = {now: rate}
+        return rate
+
+    def rate(self) -> int:
+        """bytes per second the downloads may use right now, 0 for unlimited"""
+        override = self._state[self._OVERRIDE]
+        rate = int(override) if override >= 0 else self._profile_rate()
+        if self.streaming_rate and monotonic() < self._state[self._STREAMING_UNTIL]:
+            rate = min(rate, self.streaming_rate) if rate else self.streaming_rate
+        return rate
+
+    def set_limit(self, rate: int | None) -> None:
+        """limit every download to rate bytes per second (0 for unlimited), None goes back to the profiles"""
+        self._state[self._OVERRIDE] = -1 if rate is None else max(0, rate)
+
+    def streaming(self) -> None:
+        """a video is being streamed, downloads give way to it for a while"""
+        self._state[self._STREAMING_UNTIL] = monotonic() + self.streaming_grace
+
+    async def acquire(self, size: int) -> None:
+        rate = self.rate()
+        if not rate:
+            return
+
+        with self._state.get_lock():
+            now = monotonic()
+            tokens = min(rate, self._state[self._TOKENS] + (now - self._state[self._LAST]) * rate)
+            self._state[self._TOKENS] = tokens - size
+            self._state[self._LAST] = now
+        if tokens < size:
+            await asyncio.sleep((size - tokens) / rate)
@@ -0,0 +1,107 @@
+from __future__ import annotations
+import asyncio
+from multiprocessing import Value
+from time import monotonic
+from typing import Callable, List
+import aiohttp
+
+
+def is_throttled(err: BaseException) -> bool:
+    """upstream is overloaded or throttling us, fewer requests in flight would help"""
+    if isinstance(err, aiohttp.ClientResponseError):
+        return err.status in (429, 503)
+    return isinstance(err, (asyncio.TimeoutError, aiohttp.ServerDisconnectedError))
+
+
+class ConnectionBudget:
+    """
+    Segment requests in flight shared by the running downloads, whether they run in this process or in download
+    processes (the counter lives in shared memory, it is passed to them when they are spawned).
+    """
+
+    def __init__(self, total: int):
+        self.total = total
+        self._active = Value("i", 0)
+
+    def join(self) -> None:
+        with self._active.get_lock():
+            self._active.value += 1
+
+    def leave(self) -> None:
+        with self._active.get_lock():
+            self._active.value = max(0, self._active.value - 1)
+
+    def share(self) -> int:
+        """requests in flight each running download is entitled to"""
+        return max(1, self.total // max(1, self._active.value))
+
+
+class AIMDController:
+    """
+    Requests a download keeps in flight, adapted to what the link and upstream can take.
+
+    Every `interval` seconds the throughput is compared with the previous interval, the limit grows by one while it
+    keeps improving (and the limit was actually reached). A timeout or throttling response halves it, at most once per
+    interval so a burst of errors counts once. The limit never goes past `ceiling()`, the download's share of the
+    connection budget, which changes as downloads start and finish.
+    """
+
+    def __init__(self, initial: int, ceiling: Callable[[], int], interval: float = 2, min_gain: float = 0.05):
+        self.limit = initial
+        self._ceiling = ceiling
+        self._interval = interval
+        self._min_gain = min_gain
+        self._in_flight = 0
+        self._waiters: List[asyncio.Future] = []
+        self._saturated = False  # limit was reached during the current interval
+        self._bytes = 0
+        self._since = monotonic()
+        self._last_rate = 0.0
+        self._last_decrease = 0.0
+
+    @property
+    def effective_limit(self) -> int:
+        return max(1, min(self.limit, self._ceiling()))
+
+    async def __aenter__(self) -> None:
+        while self._in_flight >= self.effective_limit:
+            self._saturated = True
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                # ceiling() may grow while waiting (a download finished), recheck it from time to time
+                await asyncio.wait((waiter,), timeout=self._interval)
+            finally:
+                self._waiters.remove(waiter)
+        self._in_flight += 1
+        if self._in_flight >= self.effective_limit:
+            self._saturated = True
+
+    async def __aexit__(self, *_) -> None:
+        self._in_flight -= 1
+        for waiter in self._waiters[:self.effective_limit - self._in_flight]:  # the limit may have grown meanwhile
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def record(self, size: int) -> None:
+        """a request completed with `size` bytes"""
+        self._bytes += size
+        elapsed = monotonic() - self._since
+        if elapsed < self._interval:
+            return
+
+        rate = self._bytes / elapsed
+        if self._saturated and rate > self._last_rate * (1 + self._min_gain) and self.limit < self._ceiling():
+            self.limit += 1
+        self._last_rate = rate
+        self._bytes, self._since, self._saturated = 0, monotonic(), False
+
+    def throttled(self) -> None:
+        """a request timed out or upstream asked to slow down"""
+        now = monotonic()
+        if now - self._last_decrease < self._interval:
+            return
+        self.limit = max(1, min(self.limit, self._ceiling()) // 2)
+        self._last_decrease = now
+        self._last_rate = 0.0  # throughput of the bigger limit isn't a reference anymore
+        self._bytes, self._since, self._saturated = 0, now, False
@@ -0,0 +1,218 @@
+from __future__ import annotations
+import logging
+import os
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from functools import partial
+from multiprocessing import Pipe, Process, Queue
+from multiprocessing.connection import Connection
+from queue import Empty
+from threading import Lock
+from time import perf_counter
+from typing import Callable, Dict, List, Set, Tuple
+from Crypto.Cipher import AES
+from config import DownloadConfig
+from .msg_system import MsgSystem
+from .shm_ring import SharedRing
+
+
+def decrypt_segment(segment: bytes | memoryview, key: bytes, file_name: str = None) -> bytes | memoryview:
+    """decrypted segment, also written to `file_name` when passed"""
+    if key != b"":
+        segment = AES.new(key, AES.MODE_CBC).decrypt(segment)
+
+    if file_name:
+        with open(file_name, "wb+") as file:
+            file.write(segment)
+    return segment
+
+
+class StageStats:
+    """bytes handled and time spent by each stage since the last report, summed over every worker thread"""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._stages: Dict[str, list] = {}
+        self._since = perf_counter()
+
+    def add(self, stage: str, size: int, elapsed: float) -> None:
+        with self._lock:
+            stats = self._stages.setdefault(stage, [0, 0.0])
+            stats[0] += size
+            stats[1] += elapsed
+
+    def report(self, msg_pipe: Connection = None) -> None:
+        """throughput of each stage (bytes/s) sent to the clients through the msg system"""
+        with self._lock:
+            stages, self._stages = self._stages, {}
+            interval, self._since = perf_counter() - self._since, perf_counter()
+
+        if not stages:
+            return
+        stats = {stage: {"speed": int(size / interval), "worker_speed": int(size / max(busy, 1e-9))}
+                 for stage, (size, busy) in stages.items()}
+        if msg_pipe:
+            msg_pipe.send({"stats": {"decrypt_service": stats}})
+        else:
+            logging.warning(f"decrypt service: {stats}")
+
+
+class DecryptService:
+    """
+    Long-lived process decrypting and writing the segments of every active video download.
+
+    Segments stay in the SharedRing of their download, only (ring, slot, key, file) descriptors go through the jobs
+    queue. A pool of threads sized to the cpu count handles them (AES and file writes release the GIL), once a segment
+    is on disk its slot is marked DONE (or FAILED) and the slot is sent on the ack channel of its download.
+    Jobs without a file name are decrypted in place, their download writes them itself from the slot.
+
+    A download claims an ack channel (in the process starting it) for as long as it runs, the service holds the only
+    sending ends: if it dies the downloads read eof and fail instead of waiting for slots that never drain, the next
+    start() runs a new one. A ring is only detached once its segments in flight are handled, which is acked as well.
+    """
+    jobs: Queue = None
+    _process: Process = None
+    _channels: List[Connection] = []  # receiving ends of the ack channels of the running service
+    _free: List[int] = []  # channels not claimed by a download
+    _lock: Lock = Lock()
+
+    @classmethod
+    def start(cls) -> Queue:
+        """start the service if it isn't running (or died), returns the queue accepting its jobs"""
+        with cls._lock:
+            if not cls._process or not cls._process.is_alive():
+                if cls._process:
+                    logging.error(f"decrypt service exited with code {cls._process.exitcode}, restarting it")
+                cls.jobs = Queue()
+                pipes = [Pipe(duplex=False) for _ in range(DownloadConfig.DECRYPT_DOWNLOADS)]
+                cls._channels, cls._free = [receiver for receiver, _ in pipes], list(range(len(pipes)))
+                cls._process = Process(target=cls._serve, args=(cls.jobs, DownloadConfig.DECRYPT_WORKERS or os.cpu_count(),
+                                                                [sender for _, sender in pipes], MsgSystem.in_pipe),
+                                       daemon=True)
+                cls._process.start()
+                for _, sender in pipes:
+                    sender.close()  # only the service may hold them, downloads read eof once it is gone
+                logging.info("decrypt service started")
+            return cls.jobs
+
+    @classmethod
+    def stop(cls) -> None:
+        if cls._process and cls._process.is_alive():
+            cls.jobs.put(None)
+            cls._process.join()
+        cls._process = cls.jobs = None
+
+    @classmethod
+    def claim(cls) -> Tuple[int, Connection] | None:
+        """ack channel of a download, None when the service already serves as many downloads as it can"""
+        cls.start()
+        with cls._lock:
+            if not cls._free:
+                return None
+            channel = cls._free.pop()
+            return channel, cls._channels[channel]
+
+    @classmethod
+    def close(cls, ring: SharedRing, channel: int, acks: Connection, timeout: float = 10) -> None:
+        """
+        the download of ring stopped, once the service acked it is done with the ring it is removed and the channel
+        freed. Called by the process that created the ring, even if the download process was killed.
+        """
+        if cls.jobs and cls._channels and cls._channels[channel] is acks:  # not a channel of a previous service
+            cls.jobs.put(cls.close_job(ring, channel))
+            try:
+                while acks.poll(timeout):
+                    if acks.recv() == (ring.name, None):
+                        break
+                else:
+                    logging.error(f"decrypt service didn't release ring {ring.name}")
+            except (EOFError, OSError):  # the service died, its mappings went with it
+                ...
+            with cls._lock:
+                if cls._channels[channel] is acks:
+                    cls._free.append(channel)
+        ring.close()
+
+    @staticmethod
+    def segment_job(ring: SharedRing, channel: int, slot: int, length: int, key: bytes, file_name: str) -> Tuple:
+        return "segment", ring.name, ring.slots, ring.slot_size, ring.tracker, channel, slot, length, key, file_name
+
+    @staticmethod
+    def close_job(ring: SharedRing, channel: int) -> Tuple:
+        """the download of `ring` stopped, the service detaches from it once its segments in flight are handled"""
+        return "close", ring.name, channel
+
+    @classmethod
+    def _serve(cls, jobs: Queue, workers: int, acks: List[Connection], msg_pipe: Connection = None) -> None:
+        rings: Dict[str, SharedRing] = {}
+        in_flight: Dict[str, Set[Future]] = {}  # ring name -> segments being handled, they hold views of the ring
+        ack_lock = Lock()  # acks are sent by the pool threads
+        stats = StageStats()
+        last_report = perf_counter()
+
+        def ack(channel: int, msg: tuple) -> None:
+            with ack_lock:
+                acks[channel].send(msg)
+
+        with ThreadPoolExecutor(workers, thread_name_prefix="decrypt") as pool:
+            while True:
+                try:
+                    job = jobs.get(timeout=DownloadConfig.STATS_INTERVAL)
+                except Empty:
+                    job = ()
+                if job is None:
+                    break
+
+                if perf_counter() - last_report >= DownloadConfig.STATS_INTERVAL:
+                    stats.report(msg_pipe)
+                    last_report = perf_counter()
+
+                # a job failing (ring already removed by its download...) must not take the service down
+                try:
+                    match job:
+                        case ("segment", ring_name, slots, slot_size, tracker, channel, slot, length, key, file_name):
+                            if ring_name not in rings:
+                                rings[ring_name] = SharedRing(slots, slot_size, ring_name, tracker)
+                            future = pool.submit(cls._handle_segment, rings[ring_name], slot, length, key, file_name,
+                                                 stats, partial(ack, channel, (ring_name, slot)))
+                            segments = in_flight.setdefault(ring_name, set())
+                            segments.add(future)
+                            future.add_done_callback(segments.discard)
+                        case ("close", ring_name, channel):
+                            wait(in_flight.pop(ring_name, ()))  # their views must be released before the ring
+                            if ring_name in rings:
+                                rings.pop(ring_name).close()
+                            ack(channel, (ring_name, None))
+                except Exception as err:
+                    logging.error(f"decrypt service: {job[:2]} failed: {err!r}")
+
+        for ring in rings.values():
+            ring.close()
+
+    @staticmethod
+    def _handle_segment(ring: SharedRing, slot: int, length: int, key: bytes, file_name: str, stats: StageStats,
+                        ack: Callable[[], None]):
+        segment = ring.view(slot, length)
+        try:
+            start = perf_counter()
+            if key != b"":
+                # cbc decryption keeps each cipher block before overwriting it, so it can be done in place
+                decrypted = AES.new(key, AES.MODE_CBC).decrypt(segment, output=None if file_name else segment)
+                stats.add("decrypt", length, perf_counter() - start)
+            else:
+                decrypted = segment
+
+            if file_name:
+                start = perf_counter()
+                with open(file_name, "wb+") as file:
+                    file.write(decrypted)
+                stats.add("write", length, perf_counter() - start)
+        except Exception as err:
+            logging.error(f"decrypting {file_name} failed: {err!r}")
+            segment.release()
+            ring.fail(slot)
+            ack()
+            return
+
+        segment.release()
+        ring.done(slot)
+        ack()
@@ -4,77 +4,65 @@ import aiohttp
 import asyncio
 import m3u8
 import os
-from Crypto.Cipher import AES
-from multiprocessing import connection, Process, Pipe
+from multiprocessing import connection, Process, Pipe, Queue
 import subprocess
 from scraper import Animepahe, Anime, Manga
 from pathlib import Path
-from config import FileConfig
-from .msg_system import MsgSystem
+from config import FileConfig, DownloadConfig
+from .msg_system import MsgSystem, LocalPipe
+from .shm_ring import SharedRing
+from .decrypt_service import DecryptService, decrypt_segment
+from .segment_writer import SegmentWriter
+from .resume_bitmap import ResumeBitmap
+from .scheduler import TaskScheduler
+from .concurrency import AIMDController, ConnectionBudget, is_throttled
+from .bandwidth import BandwidthLimiter
+from .progress_board import ProgressBoard, ProgressSlot
 from video.library import DBLibrary, Library
 from time import perf_counter
 from utils import DB, remove_folder
 import logging
-from typing import List, Dict, Any, Tuple, Callable
+from typing import List, Dict, Any, Tuple, Callable, Set
 from utils.headers import get_headers
+from utils.http_client import HttpClient
+from utils.rate_limiter import RateLimiter
 from utils import validate_path
-from sys import modules, exc_info
+from sys import modules, exc_info, maxsize
 from abc import ABC, abstractmethod
 import traceback
 from yarl import URL
 
 
-def _parse_resume_info(raw_file_data):
-    lines = raw_file_data.split("\n")
-    lines = filter(lambda line: line.startswith("SEGMENT"), lines)
-    return tuple(int(line.split(" ")[1]) for line in lines)
-
-
-def _write_resume_info(file_name, segment_number):
-    with open(file_name, "a") as file:
-        file.write(f"SEGMENT {segment_number}\n")
-
-
-def _decrypt_worker(pipe_output, resume_file_path: str, progress_tracker):
-    while True:
-        pipe_message = pipe_output.recv()
-
-        # Break if a None object is encountered as this means that
-        # no more segments will be added to the pipe,
-        if pipe_message is None:
-            break
-
-        segment, key, file_name, segment_number, speed = pipe_message
-        if key != b"":
-            decrypted_segment = AES.new(key, AES.MODE_CBC).decrypt(segment)
-        else:
-            decrypted_segment = segment
-
-        with open(file_name, "wb+") as file:
-            file.write(decrypted_segment)
-
-        # Update the resume info.
-        _write_resume_info(resume_file_path, segment_number)
-
-        # Increment the progress.
-        progress_tracker.increment_done(speed)
-
-
 class ProgressTracker:
-    def __init__(self, file_data: dict, done: int = 0, msg_pipe_input: connection.Connection = None):
+    """
+    With a progress slot the counters in shared memory are only bumped, the download manager reports them with the
+    other running downloads. Without one (download run on its own) the progress is sent at most once every
+    DownloadConfig.PROGRESS_INTERVAL.
+    """
+
+    def __init__(self, file_data: dict, done: int = 0, msg_pipe_input: connection.Connection = None,
+                 slot: ProgressSlot = None, total: int = 0):
         self.msg_pipe_input = msg_pipe_input
         self.done = done
         self.file_data = file_data
+        self.slot = slot
+        self._last_update = 0.0
+        if slot:
+            slot.set(done, total)
         self.send_update()
 
-    def increment_done(self, speed: int = 0) -> None:
+    def increment_done(self, speed: int = 0, size: int = 0) -> None:
         self.done += 1
         self.file_data["downloaded"] = self.done
         self.file_data["speed"] = speed
-        if self.done != self.file_data["total_size"]:
+        if self.slot:
+            self.slot.add(size)
+        elif self.done != self.file_data["total_size"] and \
+                perf_counter() - self._last_update >= DownloadConfig.PROGRESS_INTERVAL:
             self.send_update()
 
     def send_update(self) -> None:
+        self._last_update = perf_counter()
         if self.msg_pipe_input:  # if pipe exists, pass the msg
             self.msg_pipe_input.send({"data": self.file_data})
 
@@ -87,7 +75,10 @@ class Downloader(ABC):
     MANIFEST_FILE_EXTENSION: str
     SEGMENT_DIR: Path = Path(__file__).resolve().parent.parent.joinpath("segments")
     OUTPUT_LOC: Path = FileConfig.DEFAULT_DOWNLOAD_LOCATION
-    RESUME_EXTENSION: str = ".resumeinfo.yuk"
+    RESUME_EXTENSION: str = ".resume.yuk"
+    LEGACY_RESUME_EXTENSION: str = ".resumeinfo.yuk"  # text log used before the resume bitmap
+    TIMEOUT: aiohttp.ClientTimeout = aiohttp.ClientTimeout(25)
+    READ_CHUNK_SIZE: int = 64 * 1024  # bytes taken from the bandwidth limiter at once
 
     def __init__(
             self,
@@ -97,11 +88,20 @@ class Downloader(ABC):
             resume_code=None,
             max_workers: int = 8,
             hooks: dict = None,
-            headers: dict = get_headers()
+            headers: dict = get_headers(),
+            budget: ConnectionBudget = None,
+            bandwidth: BandwidthLimiter = None,
+            progress: ProgressSlot = None
     ) -> None:
 
         self.resume_file_path: str = None
-        self._max_workers = max_workers
+        self.resume_info: ResumeBitmap = None
+        self._max_workers = max_workers  # requests in flight to start with, adapted by _concurrency afterwards
+        self._budget = budget
+        self._concurrency: AIMDController = None
+        self._bandwidth = bandwidth
+        self._progress = progress
+        self._rate_buckets = RateLimiter.shared()  # created by the manager, before the download process is spawned
         self.file_data = file_data  # {id: int, file_name: str, total_size: None, downloaded: None}
         self.library, self.lib_data = library_data
         self.OUTPUT_LOC: Path = Path(file_data["output_dir"])
@@ -124,8 +124,41 @@ class Downloader(ABC):
 
     def run(self):
         self.library.data = self.lib_data
+        RateLimiter.attach(self._rate_buckets)
         logging.info("starting download")
-        asyncio.run(self._run())
+        asyncio.run(self._main())
+
+    async def _main(self, own_loop: bool = True):
+        """own_loop is False when the download runs as a task of the download manager's loop (async engine)"""
+        RateLimiter.priority.set(RateLimiter.BATCH)  # downloads never get ahead of interactive requests
+        try:
+            await self._run()
+        finally:
+            if own_loop:
+                await HttpClient.close()  # release the pooled connections of this process
+
+    def _start_concurrency(self, remaining: int) -> int:
+        """number of workers to start, requests they have in flight are limited by _concurrency"""
+        self._concurrency = AIMDController(self._max_workers, self._concurrency_ceiling, DownloadConfig.ADAPT_INTERVAL)
+        return min(DownloadConfig.MAX_SEGMENT_WORKERS, remaining)  # create max workers according to remaining segments
+
+    def _concurrency_ceiling(self) -> int:
+        share = self._budget.share() if self._budget else DownloadConfig.MAX_SEGMENT_WORKERS
+        return min(share, DownloadConfig.MAX_SEGMENT_WORKERS)
+
+    async def _read(self, resp: aiohttp.ClientResponse) -> bytes:
+        """body of resp, read no faster than the bandwidth limit allows"""
+        if not self._bandwidth:
+            return await resp.read()
+
+        chunks = []
+        async for chunk in resp.content.iter_chunked(self.READ_CHUNK_SIZE):
+            await self._bandwidth.acquire(len(chunk))
+            chunks.append(chunk)
+        return b"".join(chunks)
+
+    def _request(self, client: aiohttp.ClientSession, url: str | URL):
+        return client.get(url, headers=self.headers, timeout=self.TIMEOUT, raise_for_status=True)
 
     @abstractmethod
     async def _download_worker(self, download_queue: asyncio.Queue, client: aiohttp.ClientSession,
@@ -136,25 +169,36 @@ class Downloader(ABC):
     async def _run(self):
         ...
 
-    def parse_resume_info(self) -> List[str]:
-
+    def load_resume_info(self, mode: str = "concat") -> ResumeBitmap:
+        """resume bitmap of this download, a new one is started with the given output mode"""
         self.resume_file_path = os.path.join(
             self.SEGMENT_DIR, f"{self._resume_code}{self.RESUME_EXTENSION}"
         )
+        legacy_file_path = os.path.join(self.SEGMENT_DIR, f"{self._resume_code}{self.LEGACY_RESUME_EXTENSION}")
 
-        if os.path.isfile(self.resume_file_path):
-            with open(self.resume_file_path) as file:
-                resume_info = _parse_resume_info(file.read())
+        if os.path.isfile(legacy_file_path):
+            self.resume_info = ResumeBitmap.from_log(self.resume_file_path, legacy_file_path, self.num_of_segments, mode)
+        else:
+            self.resume_info = ResumeBitmap(self.resume_file_path, self.num_of_segments, mode)
+
+        if self.resume_info.done:
             logging.info(f"Resume data found for {self._resume_code}.")
         else:
-            with open(self.resume_file_path, "w+"):
-                ...
-            resume_info = []
+            self.resume_info.mode = mode  # nothing to resume, whatever mode it was started with
             logging.info(f"No resume data found for {self._resume_code}")
 
             self.update_db_record("started", 0, self.num_of_segments)
 
-        return resume_info
+        return self.resume_info
+
+    @classmethod
+    def done_count(cls, segment_dir: Path, resume_code: str) -> int:
+        """segments the download of resume_code already has, from its resume bitmap or its legacy resume log"""
+        return ResumeBitmap.done_count(segment_dir.joinpath(f"{resume_code}{cls.RESUME_EXTENSION}"),
+                                       segment_dir.joinpath(f"{resume_code}{cls.LEGACY_RESUME_EXTENSION}"))
+
+    def close(self) -> None:
+        """release what the download kept once it stopped, called by the process that created the downloader"""
 
     def update_db_record(self, status: str, downloaded: int, total_size: int):
         self.file_data["total_size"] = total_size
@@ -190,11 +234,15 @@ class MangaDownloader(Downloader):
             resume_code=None,
             max_workers: int = 8,
             hooks: dict = None,
-            headers: dict = get_headers()
+            headers: dict = get_headers(),
+            budget: ConnectionBudget = None,
+            bandwidth: BandwidthLimiter = None,
+            progress: ProgressSlot = None
     ) -> None:
 
         self.img_urls = img_urls
-        super().__init__(file_data, library_data, msg_system_in_pipe, resume_code, max_workers, hooks, headers)
+        super().__init__(file_data, library_data, msg_system_in_pipe, resume_code, max_workers, hooks, headers, budget,
+                         bandwidth, progress)
         self.progress_tracker: ProgressTracker = None
         self.num_of_segments: int = len(img_urls)
         self.total_size = 0
@@ -206,54 +254,49 @@ class MangaDownloader(Downloader):
             file_name, img_url, img_num = segment_data
             start_time = perf_counter()
             try:
-                async with client.get(URL(img_url, encoded=True)) as resp:
+                async with self._concurrency, self._request(client, URL(img_url, encoded=True)) as resp:
+                    resp_data: bytes = await self._read(resp)
+                self._concurrency.record(len(resp_data))
 
-                    resp_data: bytes = await resp.read()
+                await asyncio.to_thread(file_name.write_bytes, resp_data)  # don't stall the other downloads
 
-                    with open(file_name, "wb+") as file:
-                        file.write(resp_data)
+                # Increment the progress.
+                self.progress_tracker.increment_done(len(resp_data) // (perf_counter() - start_time), len(resp_data))
 
-                    # Increment the progress.
-                    self.progress_tracker.increment_done(len(resp_data) // (perf_counter() - start_time))
+                # Update the resume info.
+                self.resume_info.add(img_num)
 
-                    # Update the resume info.
-                    _write_resume_info(self.resume_file_path, img_num)
-
-                    self.total_size += len(resp_data)
+                self.total_size += len(resp_data)
 
             except asyncio.TimeoutError:
+                self._concurrency.throttled()
                 await download_queue.put(segment_data)
                 logging.info(f"Retrying segment-{img_num}")
             except Exception as e:
                 logging.error(e)
                 traceback.format_exception(*exc_info())
+                if is_throttled(e):
+                    self._concurrency.throttled()
                 await download_queue.put(segment_data)
                 logging.info(f"Retrying segment-{img_num}")
 
             download_queue.task_done()
 
-    def run(self):
-        self.library.data = self.lib_data
-        asyncio.run(self._run())
-
     async def _run(self):
         # The download queue that will be used by download workers
         download_queue: asyncio.Queue = asyncio.Queue()
 
-        timeout = aiohttp.ClientTimeout(25)
-        client = aiohttp.ClientSession(headers=self.headers, timeout=timeout, raise_for_status=True)
-
-        resume_info = self.parse_resume_info()
+        client = HttpClient.get_session()
 
         assert self.num_of_segments != 0
 
-        img_list = tuple(
-            filter(lambda seg: seg[0] not in resume_info, enumerate(self.img_urls))
-        )
-        self._max_workers = min(self._max_workers,
-                                self.num_of_segments)  # create max workers according to remaining segments
+        resume_info = self.load_resume_info()
 
-        self.progress_tracker = ProgressTracker(self.file_data, len(resume_info), self.msg_system_in_pipe)
+        img_list = tuple((img_number, self.img_urls[img_number]) for img_number in resume_info.remaining())
+        self._max_workers = self._start_concurrency(len(img_list))
+
+        self.progress_tracker = ProgressTracker(self.file_data, resume_info.done, self.msg_system_in_pipe,
+                                                self._progress, self.num_of_segments)
 
         # Populate the download queue.
         for img_number, img in img_list:
@@ -273,17 +316,17 @@ class MangaDownloader(Downloader):
             )
             for _ in range(self._max_workers)
         ]
-        # Wait for the download workers to finish.
-        await download_queue.join()
+        try:
+            # Wait for the download workers to finish.
+            await download_queue.join()
+        finally:
+            # Cancel all download workers, also reached when the download is paused / cancelled in the async engine.
+            for worker in workers:
+                worker.cancel()
+            resume_info.close()
 
         logging.info("Downloading finished")
 
-        # Cancel all download workers.
-        for worker in workers:
-            worker.cancel()
-
-        await client.close()  # CLose the http session.
-
         self.update_db_record("downloaded", self.num_of_segments, self.total_size)
 
         remove_folder(self.SEGMENT_DIR)  # remove segments
@@ -306,6 +349,7 @@ class VideoDownloader(Downloader):
     OUTPUT_EXTENSION: str = ".mp4"
     MANIFEST_FILE_EXTENSION: str = ".m3u8"
     CONCAT_FILE_NAME: str = "concat_info.txt"
+    PARTIAL_FILE_NAME: str = "partial.ts"
     OUTPUT_LOC: Path = FileConfig.DEFAULT_DOWNLOAD_LOCATION.joinpath("anime")
 
     def __init__(
@@ -317,11 +361,27 @@ class VideoDownloader(Downloader):
             resume_code=None,
             max_workers: int = 8,
             hooks: dict = None,
-            headers: dict = get_headers()
+            headers: dict = get_headers(),
+            budget: ConnectionBudget = None,
+            bandwidth: BandwidthLimiter = None,
+            progress: ProgressSlot = None
     ) -> None:
         self._m3u8: m3u8.M3U8 = m3u8.M3U8(m3u8_str)
-        super().__init__(file_data, library_data, msg_system_in_pipe, resume_code, max_workers, hooks, headers)
+        super().__init__(file_data, library_data, msg_system_in_pipe, resume_code, max_workers, hooks, headers, budget,
+                         bandwidth, progress)
         self._output_file = self.OUTPUT_LOC.joinpath(f"{self.file_data['file_name']}{self.OUTPUT_EXTENSION}")
+        self._decrypt_jobs: Queue = DecryptService.start()
+        # segments are handed to the decrypt service through shared memory. The ring is created by the process starting
+        # the download so it can be released by close() even if the download process is killed.
+        self._channel: Tuple[int, connection.Connection] = DecryptService.claim()  # (channel, acks) of the service
+        self._ring: SharedRing = None  # no channel left: segments are decrypted by the download itself
+        if self._channel:
+            self._ring = SharedRing(DownloadConfig.RING_SLOTS, DownloadConfig.RING_SLOT_SIZE)
+        self._acked: asyncio.Event = None  # set when the service acks a slot
+        self._service_lost = False
+        self._pending: Dict[int, Tuple[tuple, float, int]] = {}  # ring slot -> (segment_data, speed, size) in service
+        self._writer: SegmentWriter = None  # segments are written in order by this process, unless kept as files
+        self.progress_tracker: ProgressTracker = None
 
     async def _download_worker(self, download_queue: asyncio.Queue, client: aiohttp.ClientSession,
                                decrypt_pipe_input=None, downloader: Downloader = None):
@@ -331,41 +391,157 @@ class VideoDownloader(Downloader):
             _key = downloader.get_key(client, segment)  # get key to decrypt segment
             start_time = perf_counter()
             try:
-                async with client.get(segment.uri) as resp:
-                    resp_data: bytes = await resp.read()
-                    key = await _key
-
-                    decrypt_pipe_input.send(
-                        (resp_data, key, file_name, segment_number,
-                         resp.content_length // (perf_counter() - start_time)))
+                async with downloader._concurrency, downloader._request(client, segment.uri) as resp:
+                    resp_data: bytes = await downloader._read(resp)
+                downloader._concurrency.record(len(resp_data))
+                key = await _key
+                speed = len(resp_data) // (perf_counter() - start_time)
+
+                if downloader._writer:
+                    file_name = None  # decrypted in place, then appended to the output by _segment_done
+
+                # only the slot goes to the decrypt service, segments bigger than a slot are handled here
+                slot = await downloader._ring.put(resp_data) if downloader._ring else None
+                if slot is None:
+                    decrypted = await asyncio.to_thread(decrypt_segment, resp_data, key, file_name)
+                    await downloader._segment_done(segment_number, speed, len(resp_data), decrypted)
+                else:
+                    downloader._pending[slot] = (segment_data, speed, len(resp_data))
+                    downloader._decrypt_jobs.put(
+                        DecryptService.segment_job(downloader._ring, downloader._channel[0], slot, len(resp_data), key,
+                                                   file_name))
 
             except asyncio.TimeoutError:
+                downloader._concurrency.throttled()
                 await download_queue.put(segment_data)
                 logging.info(f"Retrying segment-{segment_number}")
             except Exception as e:
                 logging.error(e)
+                if is_throttled(e):
+                    downloader._concurrency.throttled()
                 await download_queue.put(segment_data)
                 logging.info(f"Retrying segment-{segment_number}")
             download_queue.task_done()
 
-    def _merge_segments(self, input_file: str | Path, output_file: str | Path = None) -> int:  # will return length of output_file
-        # Run the command to merge the downloaded files.
+    async def _segment_done(self, segment_number: int, speed: float, size: int,
+                            decrypted: bytes | memoryview = None) -> None:
+        if self._writer:
+            await self._writer.add(segment_number, decrypted)  # records the resume info once appended
+        else:
+            self.resume_info.add(segment_number)
+        self.progress_tracker.increment_done(speed, size)
+
+    def _read_acks(self) -> None:
+        """slots acked by the decrypt service, their state is in the ring, the collector only needs to be woken"""
+        acks = self._channel[1]
+        try:
+            while acks.poll():
+                acks.recv()
+        except (EOFError, OSError):  # the service died, slots sent to it will never be handled
+            self._service_lost = True
+            try:
+                asyncio.get_running_loop().remove_reader(acks.fileno())
+            except (NotImplementedError, OSError):
+                ...
+        self._acked.set()
 
-        if not output_file:
-            output_file = self._output_file
+    async def _collect_written(self, download_queue: asyncio.Queue, watched: bool) -> None:
+        """segments marked DONE by the decrypt service are decrypted (and on disk if kept as files),
+        FAILED ones are downloaded again. watched: acks wake it up, otherwise they are polled"""
+        while True:
+            self._acked.clear()
+            for slot, (segment_data, speed, size) in list(self._pending.items()):
+                state = self._ring.state(slot)
+                if state == SharedRing.FILLED:
+                    continue
+                if state == SharedRing.FAILED:
+                    download_queue.put_nowait(segment_data)
+                    logging.info(f"Retrying segment-{segment_data[2]}")
+                else:
+                    decrypted = self._ring.view(slot, size) if self._writer else None
+                    try:
+                        await self._segment_done(segment_data[2], speed, size, decrypted)
+                    finally:
+                        if decrypted:
+                            decrypted.release()
+                del self._pending[slot]
+                self._ring.release(slot)
+
+            if self._service_lost:
+                raise RuntimeError("decrypt service exited, the segments sent to it are lost")
+            if watched:
+                await self._acked.wait()
+            elif self._ring:
+                await asyncio.sleep(0.05)
+                self._read_acks()
+            else:
+                await asyncio.Event().wait()  # nothing is sent to the service
+
+    def _watch_acks(self) -> bool:
+        """acks of the service wake the collector as they arrive, False when the loop can't watch the channel"""
+        self._acked = asyncio.Event()
+        if not self._ring:
+            return False
+        try:
+            asyncio.get_running_loop().add_reader(self._channel[1].fileno(), self._read_acks)
+        except NotImplementedError:  # proactor loop (windows) doesn't watch pipes, the collector polls them
+            return False
+        return True
+
+    def close(self) -> None:
+        """the download stopped, the decrypt service lets go of its ring (called by the process that created it)"""
+        if self._ring and self._ring.owned:
+            DecryptService.close(self._ring, *self._channel)
+            self._ring = self._channel = None
+
+    def _open_writer(self, remaining: List[int], mode: str, offset: int) -> subprocess.Popen | None:
+        """
+        append mode: segments go to a single partial .ts, resumable from the offset of the last recorded segment.
+        pipe mode: segments are remuxed by ffmpeg as they arrive, nothing is kept to resume from.
+        """
+        ffmpeg = None
+        if mode == "pipe":
+            ffmpeg = subprocess.Popen(self._ffmpeg_cmd("-f", "mpegts", "-i", "pipe:0"), stdin=subprocess.PIPE)
+            sink, on_written = ffmpeg.stdin, None
+        else:
+            partial_file = self.SEGMENT_DIR.joinpath(self.PARTIAL_FILE_NAME)
+            sink = open(partial_file, "r+b" if partial_file.exists() else "wb")
+            sink.seek(offset)
+            sink.truncate()  # drop what was appended after the last recorded segment
+            on_written = self.resume_info.append
 
+        self._writer = SegmentWriter(sink, remaining, self.SEGMENT_DIR, DownloadConfig.REORDER_BUFFER_SIZE, offset,
+                                     on_written)
+        return ffmpeg
+
+    def _ffmpeg_cmd(self, *input_args: str, output_file: str | Path = None) -> List[str]:
         # check if exe present in backend folder else fallback to default option
         ffmpeg_loc = os.environ.get("ffmpeg", "ffmpeg")
+        return [ffmpeg_loc, *input_args, "-c", "copy", str(output_file or self._output_file), "-hide_banner",
+                "-loglevel", "warning", "-y"]
 
-        cmd = f'"{ffmpeg_loc}" -f concat -safe 0 -i "{input_file}" -c copy "{output_file}" -hide_banner -loglevel warning'
+    def _merge_segments(self, input_file: str | Path, output_file: str | Path = None) -> int:  # will return length of output_file
+        # Run the command to merge the downloaded files.
+
+        if not output_file:
+            output_file = self._output_file
 
         subprocess.run(
-            cmd, check=True, shell=False
+            self._ffmpeg_cmd("-f", "concat", "-safe", "0", "-i", str(input_file), output_file=output_file), check=True,
+            shell=False
         )
         remove_folder(self.SEGMENT_DIR)  # remove segments
         logging.info("Merging completed")
         return os.path.getsize(output_file)
 
+    def _remux_partial(self) -> int:
+        logging.info("remuxing started")
+        subprocess.run(self._ffmpeg_cmd("-i", str(self.SEGMENT_DIR.joinpath(self.PARTIAL_FILE_NAME))), check=True,
+                       shell=False)
+        remove_folder(self.SEGMENT_DIR)
+        logging.info("Remuxing completed")
+        return os.path.getsize(self._output_file)
+
     def _write_concat_info(self, segment_count: int) -> int:
         logging.info("merging started")
         # Write the concat info needed by ffmpeg to a file.
@@ -376,20 +552,11 @@ class VideoDownloader(Downloader):
                 file.write(f)
         return self._merge_segments(concat_file)
 
-    def run(self):
-        self.library.data = self.lib_data
-        asyncio.run(self._run())
-
     async def _run(self):
         # The download queue that will be used by download workers
         download_queue: asyncio.Queue = asyncio.Queue()
 
-        # Pipe that will be used to the download workers to send the downloaded
-        # data to the decrypt process for decryption and for writing to the
-        # disk.
-        decrypt_pipe_output, decrypt_pipe_input = Pipe()
-        timeout = aiohttp.ClientTimeout(25)
-        client = aiohttp.ClientSession(headers=self.headers, timeout=timeout, raise_for_status=True)
+        client = HttpClient.get_session()
 
         # Check if the m3u8 file passed in has multiple streams, if this is the
         # case then select the stream with the highest "bandwidth" specified.
@@ -400,78 +567,111 @@ class VideoDownloader(Downloader):
                 stream_uri = max(
                     *self._m3u8.playlists, key=lambda p: p.stream_info.bandwidth
                 ).uri
-            resp = await client.get(stream_uri)
+            resp = await self._request(client, stream_uri)
             stream = m3u8.M3U8(await resp.text())
         else:
             stream = self._m3u8
 
         self.num_of_segments = len(stream.segments)
 
-        resume_info = self.parse_resume_info()
-
         assert self.num_of_segments != 0  # no of streams is not equal to 0
 
-        segment_list = tuple(
-            filter(lambda seg: seg[0] not in resume_info, enumerate(stream.segments))
-        )
-        self._max_workers = min(self._max_workers,
-                                self.num_of_segments)  # create max workers according to remaining segments
-
-        progress_tracker = ProgressTracker(self.file_data, len(resume_info), self.msg_system_in_pipe)
-
-        # Start the process that will decrypt and write the files to disk.
-        decrypt_process = Process(
-            target=_decrypt_worker,
-            args=(decrypt_pipe_output, self.resume_file_path, progress_tracker),
-            daemon=True,
-        )
-        decrypt_process.start()
-
-        logging.info("Decrypt process started")
+        # a download is finished in the mode it was started with
+        resume_info = self.load_resume_info(DownloadConfig.OUTPUT_MODE)
+        mode = resume_info.mode
+        if mode == "append" and not resume_info.output_intact(self.SEGMENT_DIR.joinpath(self.PARTIAL_FILE_NAME)):
+            # resuming would append after zero filled bytes, the remux would give a corrupt video without any error
+            logging.error(f"partial output of {self._resume_code} is missing or cut, downloading it again")
+            resume_info.reset()
+            self.update_db_record("started", 0, self.num_of_segments)
 
-        # Populate the download queue.
-        for segment_number, segment in segment_list:
-            await download_queue.put(
-                (
-                    os.path.join(
-                        self.SEGMENT_DIR,
-                        f"segment-{segment_number}{self.SEGMENT_EXTENSION}",
-                    ),
-                    segment,
-                    segment_number,
+        segment_list = tuple((segment_number, stream.segments[segment_number])
+                             for segment_number in resume_info.remaining())
+        self._max_workers = self._start_concurrency(len(segment_list))
+
+        self.progress_tracker = ProgressTracker(self.file_data, resume_info.done, self.msg_system_in_pipe,
+                                                self._progress, self.num_of_segments)
+
+        ffmpeg = None
+        if mode != "concat":
+            ffmpeg = self._open_writer([segment_number for segment_number, _ in segment_list], mode, resume_info.offset)
+
+        watched = self._watch_acks()
+        collector = asyncio.create_task(self._collect_written(download_queue, watched))
+        workers = []
+        finished = False
+
+        try:
+            # Populate the download queue.
+            for segment_number, segment in segment_list:
+                await download_queue.put(
+                    (
+                        os.path.join(
+                            self.SEGMENT_DIR,
+                            f"segment-{segment_number}{self.SEGMENT_EXTENSION}",
+                        ),
+                        segment,
+                        segment_number,
+                    )
                 )
-            )
-
-        # Start the workers but wrapping the coroutines into tasks.
-        logging.info(f"Starting {self._max_workers} download workers.")
-        workers = [
-            asyncio.create_task(
-                self._download_worker(download_queue, client, decrypt_pipe_input, self)
-            )
-            for _ in range(self._max_workers)
-        ]
-
-        # Wait for the download workers to finish.
-        await download_queue.join()
-
-        logging.info("Downloading finished")
-
-        # After all the tasks in the download queue are finished,
-        # put a None into the decrypt pip to stop the decrypt process.
-        decrypt_pipe_input.send(None)
-        decrypt_pipe_input.close()
 
-        # Cancel all download workers.
-        for worker in workers:
-            worker.cancel()
-
-        await client.close()  # CLose the http session.
-
-        # Wait for the process to finish.
-        decrypt_process.join()
-
-        # Write the concat info and invoke ffmpeg to concatenate the files.
-        file_size = self._write_concat_info(self.num_of_segments)
+            # Start the workers but wrapping the coroutines into tasks.
+            logging.info(f"Starting {self._max_workers} download workers.")
+            workers = [
+                asyncio.create_task(
+                    self._download_worker(download_queue, client, downloader=self)
+                )
+                for _ in range(self._max_workers)
+            ]
+
+            # Wait for the download workers to finish and the decrypt service to handle every segment,
+            # segments it failed to handle are put back in the download queue.
+            while True:
+                joined = asyncio.ensure_future(download_queue.join())
+                await asyncio.wait((joined, collector), return_when=asyncio.FIRST_COMPLETED)
+                if collector.done():
+                    joined.cancel()
+                    collector.result()  # writing the output failed (disk full, ffmpeg exited...), raise its error
+                if not self._pending:
+                    break
+                await asyncio.sleep(0.05)
+
+            logging.info("Downloading finished")
+            finished = True
+        finally:
+            # Cancel all download workers, also reached when the download is paused / cancelled in the async engine.
+            for worker in workers:
+                worker.cancel()
+            collector.cancel()
+            await asyncio.wait((*workers, collector))  # until they let go of the ring and the writer
+
+            if watched and not self._service_lost:
+                asyncio.get_running_loop().remove_reader(self._channel[1].fileno())
+            # the service detaches once it handled the slots it still holds, a download process only unmaps the
+            # ring, the download manager releases it once the process exited
+            if self._ring and self._ring.owned:
+                await asyncio.to_thread(self.close)
+            elif self._ring:
+                self._ring.close()
+
+            resume_info.close()
+            if not finished and self._writer:
+                if ffmpeg:
+                    ffmpeg.kill()  # a partial mp4 isn't resumable anyway
+                self._writer.close()
+
+        if mode == "pipe":
+            self._writer.close()
+            if await asyncio.to_thread(ffmpeg.wait) != 0:
+                raise subprocess.CalledProcessError(ffmpeg.returncode, ffmpeg.args)
+            remove_folder(self.SEGMENT_DIR)
+            file_size = os.path.getsize(self._output_file)
+        elif mode == "append":
+            self._writer.close()
+            file_size = await asyncio.to_thread(self._remux_partial)
+        else:
+            # Write the concat info and invoke ffmpeg to concatenate the files.
+            file_size = await asyncio.to_thread(self._write_concat_info, self.num_of_segments)
 
         self.update_db_record("downloaded", self.num_of_segments, file_size)
 
@@ -480,7 +680,7 @@ class VideoDownloader(Downloader):
             return self.key
 
         if segment.key is not None and segment.key != "":
-            key_resp = await client.get(segment.key.uri)
+            key_resp = await self._request(client, segment.key.uri)
             self.key = await key_resp.read()
         else:
             self.key = b""
@@ -496,10 +696,8 @@ class VideoDownloader(Downloader):
             hooks: dict = None,
             headers: dict = None
     ):
-        client = aiohttp.ClientSession(headers=headers)
-        resp = await client.get(url)
-        resp_text = await resp.text()
-        await client.close()
+        async with HttpClient.get_session().get(url, headers=headers) as resp:
+            resp_text = await resp.text()
         return cls(resp_text, output_file_name, resume_code, max_workers, hooks)
 
     @classmethod
@@ -530,7 +728,11 @@ class DownloadManager(metaclass=DownloadManagerMeta):
     _DOWNLOADER = {"video": VideoDownloader, "image": MangaDownloader}
     _DEF_SITE = {"video": "animepahe", "image": "mangakatana"}
     _TaskData: Dict[int, Dict[str, Any]] = {}
-    DownloadTaskQueue: asyncio.Queue = asyncio.Queue()  # all download tasks will be put into this queue
+    DownloadTaskQueue: TaskScheduler = TaskScheduler()  # all download tasks will be put into this queue
+    _batches: Set[asyncio.Task] = set()  # batches being resolved, keeps a reference to their task
+    _budget: ConnectionBudget = None  # segment requests in flight, shared by the running downloads
+    _bandwidth: BandwidthLimiter = None  # bytes per second, shared by the running downloads
+    _progress: ProgressBoard = None  # progress of the running downloads, reported together at a fixed rate
 
     """
     _TaskData : {id: {"process": Process Object, "status": str, task_data: List[str], "file_name": str}}
@@ -541,9 +743,16 @@ class DownloadManager(metaclass=DownloadManagerMeta):
         __init__ function will populate the active tasks from database
         """
         # start n task_workers to process items from DownloadTaskQueue
+        if DownloadConfig.ENGINE == "async":
+            no_of_workers = DownloadConfig.ASYNC_DOWNLOADS  # a download is a task, not a process
+        DownloadManager._budget = ConnectionBudget(DownloadConfig.CONNECTION_BUDGET)
+        DownloadManager._bandwidth = BandwidthLimiter(DownloadConfig.BANDWIDTH_LIMIT, DownloadConfig.BANDWIDTH_PROFILES,
+                                                      DownloadConfig.STREAMING_BANDWIDTH, DownloadConfig.STREAMING_GRACE)
+        DownloadManager._progress = ProgressBoard(no_of_workers, DownloadConfig.PROGRESS_SMOOTHING)
         loop = asyncio.get_event_loop()
         self.task_workers = [loop.create_task(self.workers()) for _ in range(no_of_workers)]
         loop.create_task(self._schedule_pending_downloads())
+        loop.create_task(self._report_progress())
 
     @staticmethod
     def _check_ids(ids: List[int]):
@@ -551,47 +760,165 @@ class DownloadManager(metaclass=DownloadManagerMeta):
             if _id not in DownloadManager._TaskData:
                 raise KeyError("Invalid id")
 
-    @staticmethod
-    async def __get_manifest__(scraper: Anime | Manga, session: str, manifest_url: str, page: int = 1) -> str:
-        if session:
-            manifest_data = await asyncio.gather(*[scraper.get_manifest_file(link) for link in await scraper.get_links(session, page)])
-        else:
-            manifest_data = [(await scraper.get_manifest_file(manifest_url))]
-
-        return manifest_data
+    @classmethod
+    async def _schedule_batch(cls, typ: str, scraper: Anime | Manga, session: str, page: int | None, priority: int = None,
+                              **filters) -> None:
+        """
+        resolve the files of a batch and queue each of them for download as soon as its own manifest is resolved.
+        A file that can't be resolved is skipped, the rest of the batch goes on. Skipped files are sent to the clients
+        through the msg system ({"batch": {"session", "failed", "error"}}) once the batch is scheduled.
+        """
+        RateLimiter.priority.set(RateLimiter.BATCH)  # resolving a batch must not starve the requests of the ui
+        failed: List[str] = []
+
+        async def resolve(link: str) -> None:
+            manifest_data = await scraper.resolve_with_retry(lambda: scraper.get_manifest_file(link), link)
+            if not manifest_data:
+                failed.append(link)
+                return
+            await cls._schedule_download(typ, manifest_data[2], scraper.manifest_header, manifest=manifest_data[0],
+                                         priority=priority)
+
+        resolving = set()
+        error = None
+        try:
+            async for link in scraper.iter_links(session, page, failed=failed, **filters):
+                if len(resolving) >= DownloadConfig.RESOLVE_CONCURRENCY:  # the next link waits for a free slot
+                    done, resolving = await asyncio.wait(resolving, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        task.result()
+                resolving.add(asyncio.ensure_future(resolve(link)))
+            await asyncio.gather(*resolving)
+        except Exception as err:
+            error = repr(err)
+            logging.error(f"scheduling batch {session} failed: {error}")
+        finally:
+            for task in resolving:
+                task.cancel()
+
+        if failed:
+            logging.error(f"{len(failed)} file(s) of batch {session} couldn't be resolved: {failed}")
+        if (failed or error) and MsgSystem.in_pipe:
+            MsgSystem.in_pipe.send({"batch": {"session": session, "failed": failed, "error": error}})
 
     @classmethod
     async def workers(cls) -> bool:
         while True:
             task_id = await DownloadManager.DownloadTaskQueue.get()
+            if task_id not in cls._TaskData:  # cancelled while waiting in the queue
+                continue
             manifest, file_data, headers = cls._TaskData[task_id]["task_data"]
 
             task_status = cls._TaskData[task_id]["status"]
             if task_status != Status.scheduled:  # if task is in paused state
-                if task_status == status.cancelled:  # if task is in cancelled state, remove from the _Task Dict
+                if task_status == Status.cancelled:  # if task is in cancelled state, remove from the _Task Dict
                     del cls._TaskData[file_data["id"]]
 
             else:
                 # start download as a new process
                 logging.info(f"Task received with id {task_id} of type {file_data['type']}")
 
+                progress = cls._progress.claim(task_id)
                 try:
-
-                    target = cls._DOWNLOADER[file_data["type"]](manifest, file_data=file_data, msg_system_in_pipe=MsgSystem.in_pipe,
-                                                                headers=headers, library_data=(DBLibrary, Library.data))
-
-                    p = Process(target=target.run)
-                    p.start()
-                    cls._TaskData[task_id]["process"] = p
-                    cls._TaskData[task_id]["status"] = Status.started
-                    while p.is_alive():
-                        await asyncio.sleep(10)
-
-                    if p.exitcode == 0:  # if task ended successfully
-                        del cls._TaskData[file_data["id"]]  # remove task_data
+                    in_process = DownloadConfig.ENGINE == "async"
+                    target = cls._DOWNLOADER[file_data["type"]](manifest, file_data=file_data,
+                                                                msg_system_in_pipe=LocalPipe if in_process else MsgSystem.in_pipe,
+                                                                headers=headers, library_data=(DBLibrary, Library.data),
+                                                                budget=cls._budget, bandwidth=cls._bandwidth,
+                                                                progress=progress)
+
+                    cls._budget.join()  # left here rather than by the download, a killed process can't leave
+                    try:
+                        if in_process:
+                            p = asyncio.create_task(target._main(own_loop=False))
+                        else:
+                            p = Process(target=target.run)
+                            p.start()
+                        cls._TaskData[task_id]["process"] = p
+                        cls._TaskData[task_id]["status"] = Status.started
+
+                        exitcode = await (cls._wait_task(p) if in_process else cls._wait_exit(p))
+                    finally:
+                        cls._budget.leave()
+                        await asyncio.to_thread(target.close)  # a killed download process couldn't do it
+                    cls._process_exited(task_id, exitcode, target)
                 except Exception as e:
                     logging.info(f"Download process failed with error {e}")
                     logging.error(traceback.format_exception(*exc_info()))
+                finally:
+                    cls._progress.release(progress)
+
+    @classmethod
+    async def _report_progress(cls) -> None:
+        """progress of every running download, sent every DownloadConfig.PROGRESS_INTERVAL whatever their pace"""
+        while True:
+            await asyncio.sleep(DownloadConfig.PROGRESS_INTERVAL)
+            for task_id, done, total, speed, eta in cls._progress.snapshot():
+                task = cls._TaskData.get(task_id, None)
+                # a finished download reports it itself, with the size of the output
+                if not task or task["status"] != Status.started or done >= total:
+                    continue
+                file_data = task["task_data"][1]
+                LocalPipe.send({"data": {"id": task_id, "type": file_data["type"], "status": "started",
+                                         "file_name": file_data["file_name"], "total_size": total, "downloaded": done,
+                                         "speed": speed, "eta": eta}})
+
+    @staticmethod
+    async def _wait_exit(p: Process) -> int:
+        """exit code of p, its sentinel becomes readable the moment it exits"""
+        loop = asyncio.get_running_loop()
+        exited = loop.create_future()
+        try:
+            loop.add_reader(p.sentinel, lambda: exited.done() or exited.set_result(None))
+        except NotImplementedError:  # proactor loop (windows) doesn't watch handles, a thread waits instead
+            await asyncio.to_thread(p.join)
+            return p.exitcode
+
+        try:
+            await exited
+        finally:
+            loop.remove_reader(p.sentinel)
+        p.join()  # reap it, exitcode is only set once joined
+        return p.exitcode
+
+    @staticmethod
+    async def _wait_task(task: asyncio.Task) -> int:
+        """exit code the download would have had as a process, negative when it was stopped by pause / cancel"""
+        await asyncio.wait((task,))
+        if task.cancelled():
+            return -9
+        if task.exception():
+            logging.error(traceback.format_exception(task.exception()))
+            return 1
+        return 0
+
+    @staticmethod
+    def _stop(process: Process | asyncio.Task) -> None:
+        if isinstance(process, asyncio.Task):
+            process.get_loop().call_soon_threadsafe(process.cancel)  # pause / cancel come from the api's thread
+        else:
+            process.kill()  # kill the process
+
+    @classmethod
+    def _process_exited(cls, task_id: int, exitcode: int, downloader: Downloader) -> None:
+        task = cls._TaskData.get(task_id, None)
+        if exitcode == 0:  # if task ended successfully
+            cls.DownloadTaskQueue.forget(task_id)
+            if task:
+                del cls._TaskData[task_id]  # remove task_data
+            return
+
+        if not task or task["status"] != Status.started:  # killed by pause / cancel
+            return
+
+        # crashed, it is paused so it can be resumed from where it stopped
+        logging.error(f"Download process of task {task_id} exited with code {exitcode}")
+        task["status"] = Status.paused
+        DBLibrary.update(task_id, {"status": "paused"})
+        file_data = task["task_data"][1]
+        file_data["status"] = "paused"
+        file_data["downloaded"] = Downloader.done_count(downloader.SEGMENT_DIR, file_data["file_name"])
+        MsgSystem.in_pipe.send({"data": file_data})
 
     @classmethod
     async def _schedule_pending_downloads(cls):
@@ -604,7 +931,7 @@ class DownloadManager(metaclass=DownloadManagerMeta):
         for row in _tasks:
             file_data = {"id": row["id"], "type": row["type"], "status": row["status"], "file_name": row["file_name"],
                          "total_size": row["total_size"],
-                         "downloaded": len(_parse_resume_info(f"{row['file_name']}{Downloader.RESUME_EXTENSION}"))}
+                         "downloaded": Downloader.done_count(Path(row["manifest_file_path"]).parent, row["file_name"])}
 
             scraper_typ = cls._Scrapers[row["type"]]
 
@@ -623,19 +950,35 @@ class DownloadManager(metaclass=DownloadManagerMeta):
         await asyncio.gather(*tasks)  # schedule all remaining tasks
 
     @classmethod
-    async def schedule(cls, typ: str, session: str = None, manifest_url: str = None, site: str = "animepahe", page: int = 1):
+    async def schedule(cls, typ: str, session: str = None, manifest_url: str = None, site: str = "animepahe", page: int | None = 1,
+                       priority: int = None, **filters):
+        """
+        schedule a single file (manifest_url) or a batch (session) for download, page None schedules every page of the batch.
+        filters are passed to the scraper's get_links (for anime: aud, quality, ep_range)
+        priority of the files defaults to 0, higher priorities are downloaded first
+        """
 
         scraper = cls._Scrapers[typ].get_scraper(site)()
         if not scraper:
             raise AttributeError("Site not supported")
 
-        manifest_datas = await cls.__get_manifest__(scraper, session, manifest_url, page)
-
-        await asyncio.gather(
-            *[cls._schedule_download(typ, data[2], scraper.manifest_header, manifest=data[0]) for data in manifest_datas])
+        if session:
+            with RateLimiter.batch():
+                await scraper.check_batch(session, page)  # an invalid session is the client's error, not a failed file
+            # batches are resolved in the background, their first files start downloading while the rest resolve
+            batch = asyncio.ensure_future(cls._schedule_batch(typ, scraper, session, page, priority, **filters))
+            cls._batches.add(batch)
+            batch.add_done_callback(cls._batches.discard)
+            return
+
+        with RateLimiter.batch():
+            manifest_data = await scraper.get_manifest_file(manifest_url)
+        await cls._schedule_download(typ, manifest_data[2], scraper.manifest_header, manifest=manifest_data[0],
+                                     priority=priority)
 
     @classmethod
-    async def _schedule_download(cls, typ: str, _file_name: List[str], header: str, file_data: dict = None, manifest: str = None) -> None:
+    async def _schedule_download(cls, typ: str, _file_name: List[str], header: str, file_data: dict = None, manifest: str = None,
+                                 priority: int = None) -> None:
 
         downloader = cls._DOWNLOADER[typ]
         series_name, seg_name = validate_path(_file_name)
@@ -664,9 +1007,17 @@ class DownloadManager(metaclass=DownloadManagerMeta):
         file_data["segment_dir"] = seg_dir.__str__()
 
         # add task_data and metadata for tracking and scheduling
-        cls._TaskData[file_data["id"]] = {"status": Status.scheduled,
+        cls._TaskData[file_data["id"]] = {"status": Status.scheduled, "series_name": series_name,
                                           "file_name": seg_name, "task_data": (manifest, file_data, header)}
-        await cls.DownloadTaskQueue.put(file_data["id"])  # put task in download queue
+        cls._enqueue(file_data["id"], priority)  # put task in download queue
+
+    @classmethod
+    def _enqueue(cls, task_id: int, priority: int = None) -> None:
+        task = cls._TaskData[task_id]
+        manifest = task["task_data"][0]
+        # images for manga, segments for video (a master playlist's size isn't known before it is resolved, it goes last)
+        size = len(manifest) if isinstance(manifest, list) else manifest.count("#EXTINF") or maxsize
+        cls.DownloadTaskQueue.put(task_id, task["series_name"], size, priority)
 
     @classmethod
     def create_data(cls, _file_name: List[str], typ: str, manifest_file_path: str, output_file: str) -> Dict[str, str | int]:
@@ -697,7 +1048,7 @@ class DownloadManager(metaclass=DownloadManagerMeta):
         task = cls._TaskData[task_id]
         status = task["status"]
         if status == Status.started:
-            cls._TaskData[task_id]["process"].kill()  # kill the process
+            cls._stop(cls._TaskData[task_id]["process"])
         cls._TaskData[task_id]["status"] = Status.paused
         DBLibrary.update(task_id, {"status": "paused"})
 
@@ -713,9 +1064,37 @@ class DownloadManager(metaclass=DownloadManagerMeta):
     @classmethod
     async def _resume(cls, task_id: int):
         cls._TaskData[task_id]["status"] = Status.scheduled
-        await DownloadManager.DownloadTaskQueue.put(task_id)
+        cls._enqueue(task_id)
         DBLibrary.update(task_id, {"status": "scheduled"})
 
+    @classmethod
+    def set_bandwidth(cls, limit: int | None, profiles: bool = False) -> int:
+        """limit the running and future downloads to limit bytes/s, None or 0 (or less) for no cap. profiles goes back
+        to the configured limit and day profiles instead. Returns the limit now in effect (0 for none)"""
+        if not cls._bandwidth:
+            raise AttributeError("Downloads aren't running")
+        if profiles:
+            cls._bandwidth.set_limit(None)
+        else:
+            cls._bandwidth.set_limit(limit if limit and limit > 0 else 0)
+        return cls._bandwidth.rate()
+
+    @classmethod
+    def streaming(cls) -> None:
+        """a video is being streamed, the downloads give way to it"""
+        if cls._bandwidth:
+            cls._bandwidth.streaming()
+
+    @classmethod
+    def set_priority(cls, task_ids: List[int], priority: int):
+        cls._check_ids(task_ids)
+        cls.DownloadTaskQueue.set_priority(task_ids, priority)
+
+    @classmethod
+    def move_to_front(cls, task_ids: List[int]):
+        cls._check_ids(task_ids)
+        cls.DownloadTaskQueue.move_to_front(task_ids)
+
     @classmethod
     async def cancel(cls, task_ids: List[int]):
         cls._check_ids(task_ids)
@@ -725,10 +1104,11 @@ class DownloadManager(metaclass=DownloadManagerMeta):
     async def _cancel(cls, task_id: int):
         task = cls._TaskData[task_id]
 
-        _process: Process = task.get("process", None)
+        _process: Process | asyncio.Task = task.get("process", None)
 
         if _process:
-            _process.kill()  # kill the process
+            cls._stop(_process)
+        cls.DownloadTaskQueue.forget(task_id)
 
         # remove record from DB
         DBLibrary.delete(task_id)
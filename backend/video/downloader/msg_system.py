@@ -1,12 +1,14 @@
 import asyncio
+from collections import deque
 import websockets
 import json
+import logging
 from websockets.legacy.server import WebSocketServerProtocol
 from websockets.exceptions import ConnectionClosed
 from json import JSONDecodeError
-from config import ServerConfig
+from config import ServerConfig, MsgConfig
 from multiprocessing.connection import Connection
-from typing import Any, Dict
+from typing import Any, Deque, Dict, Set
 from video.library import DBLibrary
 
 
@@ -19,11 +21,43 @@ class MsgSystemMeta(type):
         return cls._instance
 
 
+class Subscriber:
+    """
+    A connected client. Frames wait in a bounded queue and are sent by a task of its own, a slow client loses its
+    oldest frames instead of holding back the other clients (or the pipe).
+    """
+
+    def __init__(self, websocket: WebSocketServerProtocol, size: int):
+        self.websocket = websocket
+        self.frames: Deque[str] = deque(maxlen=size)
+        self.dropped = 0
+        self._ready = asyncio.Event()
+
+    def push(self, frame: str) -> None:
+        if len(self.frames) == self.frames.maxlen:
+            self.dropped += 1  # the oldest frame is dropped by the deque
+        self.frames.append(frame)
+        self._ready.set()
+
+    async def send_frames(self) -> None:
+        try:
+            while True:
+                await self._ready.wait()
+                self._ready.clear()
+                while self.frames:
+                    await self.websocket.send(self.frames.popleft())
+        except ConnectionClosed:
+            ...
+
+
 class MsgSystem(metaclass=MsgSystemMeta):
-    connected_client: WebSocketServerProtocol = None
+    subscribers: Set[Subscriber] = set()
     _instance = None
     out_pipe: Connection = None
     in_pipe: Connection = None
+    # msgs waiting for the next frame, read from out_pipe or sent by LocalPipe (downloads running in this process)
+    pending: Deque[Dict[str, Any]] = deque()
+    _closed: bool = False
 
     def __init__(self, port: int = 9000):
         ServerConfig.SOCKET_SERVER_ADDRESS = f"ws://localhost:{port}"
@@ -38,26 +72,82 @@ class MsgSystem(metaclass=MsgSystemMeta):
 
     @classmethod
     async def _server_handler(cls, websocket: websockets):
+        subscriber, sender = None, None
         try:
             async for msg in websocket:
                 event = json.loads(msg)
-                if event.get("type", "") == "connect" and not cls.connected_client:
-                    cls.connected_client = websocket
+                if event.get("type", "") == "connect" and not subscriber:
+                    subscriber = Subscriber(websocket, MsgConfig.CLIENT_QUEUE_SIZE)
+                    sender = asyncio.ensure_future(subscriber.send_frames())
+                    cls.subscribers.add(subscriber)
                     print(f"connected with {websocket}")
-            cls.connected_client = None
         except ConnectionClosed:
-            cls.connected_client = None
+            ...
         except JSONDecodeError:
             await websocket.send("Invalid connection request, pass valid JSON")
             await websocket.close(code=1000, reason="Invalid JSON")
+        finally:
+            if subscriber:
+                cls.subscribers.discard(subscriber)
+                sender.cancel()
+                if subscriber.dropped:
+                    logging.info(f"{subscriber.dropped} frame(s) dropped for slow client {websocket.remote_address}")
 
     @classmethod
-    async def send_updates(cls):
-        while True:
-            await asyncio.sleep(0.25)
-            if cls.out_pipe.poll():  # poll for msg
+    def _read_pipe(cls) -> None:
+        """every msg available in out_pipe is moved to pending, called by the loop as soon as the pipe is readable"""
+        try:
+            while cls.out_pipe.poll():
                 msg: Dict[str, Any] = cls.out_pipe.recv()
                 if not msg:
-                    break
-                if cls.connected_client:  # send msg if any client is connected
-                    await cls.connected_client.send(json.dumps(msg))
+                    cls._closed = True
+                    return
+                cls.pending.append(msg)
+        except (EOFError, OSError):  # every end of the pipe was closed
+            cls._closed = True
+
+    @classmethod
+    def _flush(cls) -> None:
+        """msgs received since the last tick are sent to every subscriber as one frame, only the latest msg of a task
+        is kept (each msg holds the whole state of its task)"""
+        batch: Dict[Any, Dict[str, Any]] = {}
+        while cls.pending:
+            msg = cls.pending.popleft()
+            key = (msg.get("data", None) or {}).get("id", id(msg))
+            batch.pop(key, None)  # the latest msg of a task takes the place of the earlier ones
+            batch[key] = msg
+
+        if batch and cls.subscribers:
+            frame = json.dumps(list(batch.values()))
+            for subscriber in cls.subscribers:
+                subscriber.push(frame)
+
+    @classmethod
+    async def send_updates(cls):
+        loop = asyncio.get_running_loop()
+        fd = cls.out_pipe.fileno()
+        try:
+            loop.add_reader(fd, cls._read_pipe)
+            watched = True
+        except NotImplementedError:  # proactor loop (windows) doesn't watch pipes, it is drained every tick instead
+            watched = False
+
+        try:
+            while not cls._closed:
+                await asyncio.sleep(MsgConfig.TICK)
+                if not watched:
+                    cls._read_pipe()
+                cls._flush()
+        finally:
+            if watched:
+                loop.remove_reader(fd)
+
+
+class LocalPipe:
+    """
+    in_pipe of the downloads running in this process, a pipe would block them (and the loop reading it) once full
+    """
+
+    @staticmethod
+    def send(msg: Dict[str, Any]) -> None:
+        MsgSystem.pending.append(msg)
@@ -0,0 +1,96 @@
+from __future__ import annotations
+from multiprocessing import Array
+from time import monotonic
+from typing import Dict, Iterator, List, Tuple
+
+
+class ProgressSlot:
+    """counters of one running download, picklable so it can be passed to a download process"""
+
+    def __init__(self, board: ProgressBoard, index: int):
+        self.board = board
+        self.index = index
+
+    def set(self, done: int, total: int) -> None:
+        self.board.set(self.index, done, total)
+
+    def add(self, size: int) -> None:
+        """a segment / page of size bytes is done"""
+        self.board.add(self.index, size)
+
+
+class ProgressBoard:
+    """
+    Progress of the running downloads, whether they run in this process or in download processes (the counters live
+    in shared memory, a slot is passed to each download when it is spawned).
+
+    Downloads only bump the counters of their slot, snapshot() is read by the download manager at a fixed rate and
+    reports every running download at once, along with their speed and eta. Both are smoothed (ewma) so a slow segment
+    doesn't make them jump around.
+    """
+    _FIELDS = 4
+    _TASK_ID, _DONE, _TOTAL, _BYTES = range(_FIELDS)
+    _FREE = -1
+
+    def __init__(self, slots: int, smoothing: float = 0.3):
+        self.slots = slots
+        self.smoothing = smoothing  # weight of the latest interval in the speed / rate averages
+        self._counters = Array("q", [self._FREE, 0, 0, 0] * slots)  # task id, done, total, bytes
+        self._rates: Dict[int, List[float]] = {}  # task id -> done, bytes, time, segments/s, bytes/s of the last snapshot
+
+    def claim(self, task_id: int) -> ProgressSlot:
+        with self._counters.get_lock():
+            counters = self._counters.get_obj()
+            for index in range(self.slots):
+                at = index * self._FIELDS
+                if counters[at + self._TASK_ID] == self._FREE:
+                    counters[at:at + self._FIELDS] = [task_id, 0, 0, 0]
+                    return ProgressSlot(self, index)
+        raise RuntimeError("no free progress slot, more downloads are running than the board was made for")
+
+    def release(self, slot: ProgressSlot) -> None:
+        with self._counters.get_lock():
+            counters = self._counters.get_obj()
+            self._rates.pop(counters[slot.index * self._FIELDS + self._TASK_ID], None)
+            counters[slot.index * self._FIELDS + self._TASK_ID] = self._FREE
+
+    def set(self, index: int, done: int, total: int) -> None:
+        at = index * self._FIELDS
+        with self._counters.get_lock():
+            counters = self._counters.get_obj()
+            counters[at + self._DONE] = done
+            counters[at + self._TOTAL] = total
+
+    def add(self, index: int, size: int) -> None:
+        at = index * self._FIELDS
+        with self._counters.get_lock():
+            counters = self._counters.get_obj()
+            counters[at + self._DONE] += 1
+            counters[at + self._BYTES] += size
+
+    def _read(self) -> Iterator[Tuple[int, int, int, int]]:
+        with self._counters.get_lock():
+            counters = self._counters.get_obj()[:]
+        for at in range(0, len(counters), self._FIELDS):
+            if counters[at + self._TASK_ID] != self._FREE:
+                yield tuple(counters[at:at + self._FIELDS])
+
+    def snapshot(self) -> Iterator[Tuple[int, int, int, int, int | None]]:
+        """(task id, done, total, speed in bytes/s, eta in seconds or None) of every running download"""
+        now = monotonic()
+        for task_id, done, total, size in self._read():
+            if not total:  # the download hasn't loaded its resume info yet
+                continue
+            last_done, last_size, last_at, done_rate, speed = self._rates.get(task_id, (done, size, now, None, None))
+            elapsed = now - last_at
+            if elapsed > 0:
+                interval_rate, interval_speed = (done - last_done) / elapsed, (size - last_size) / elapsed
+                if done_rate is None:  # first interval of the download, nothing to average with yet
+                    done_rate, speed = interval_rate, interval_speed
+                else:
+                    done_rate += self.smoothing * (interval_rate - done_rate)
+                    speed += self.smoothing * (interval_speed - speed)
+            self._rates[task_id] = [done, size, now, done_rate, speed]
+            done_rate, speed = done_rate or 0, speed or 0
+            eta = round((total - done) / done_rate) if done_rate > 0 and total > done else None
+            yield task_id, done, total, int(speed), eta
@@ -0,0 +1,171 @@
+from __future__ import annotations
+import mmap
+import os
+import struct
+from pathlib import Path
+from time import monotonic
+from typing import Iterator
+
+
+class ResumeBitmap:
+    """
+    Segments already downloaded, one bit per segment in a memory mapped file updated in place.
+
+    Header holds the output mode the download was started with and, in append mode, the last appended segment along
+    with the output size after it. Both are packed in one aligned 8 byte word so they can't be torn by a crash.
+    Bits are in the page cache as soon as they are set (a killed process loses nothing), they are flushed to disk every
+    `flush_interval` seconds and on close, in case the os goes down with it.
+    """
+    MAGIC: bytes = b"YUKB"
+    MODES = ("concat", "append", "pipe")
+    _HEADER = struct.Struct("<4sBxxxI4x")  # magic, mode, segment count
+    _APPENDED = struct.Struct("<Q")  # last appended segment (high 24 bits), output size after it (low 40 bits)
+    _APPENDED_AT: int = _HEADER.size
+    _BITS_AT: int = _HEADER.size + _APPENDED.size
+    _OFFSET_BITS: int = 40
+    _NONE: int = (1 << 24) - 1  # no segment appended yet
+
+    def __init__(self, path: str | Path, count: int, mode: str = "concat", flush_interval: float = 1):
+        self.path = path
+        self.count = count
+        self._flush_interval = flush_interval
+        self._last_flush = monotonic()
+        size = self._BITS_AT + (count + 7) // 8
+
+        fresh = not self._matches(path, count)
+        with open(path, "wb+" if fresh else "r+b") as file:
+            if fresh:
+                file.write(self._HEADER.pack(self.MAGIC, self.MODES.index(mode), count))
+                file.write(self._APPENDED.pack(self._NONE << self._OFFSET_BITS))
+                file.truncate(size)
+            self._map = mmap.mmap(file.fileno(), size)
+        self._bits = memoryview(self._map)[self._BITS_AT:]
+
+        # a crash between packing the appended word and setting the bit of its segment leaves the bit to set
+        segment, _ = self.appended
+        if segment is not None and segment not in self:
+            self._set(segment)
+        self.done = int.from_bytes(self._bits, "little").bit_count()
+
+    @classmethod
+    def _matches(cls, path: str | Path, count: int) -> bool:
+        """whether path already holds the bitmap of a download of `count` segments"""
+        try:
+            with open(path, "rb") as file:
+                magic, _, file_count = cls._HEADER.unpack(file.read(cls._HEADER.size))
+        except (FileNotFoundError, struct.error):
+            return False
+        return magic == cls.MAGIC and file_count == count
+
+    @classmethod
+    def done_count(cls, path: str | Path, log_path: str | Path = None) -> int:
+        """number of downloaded segments recorded in path without mapping it, or in the text log (log_path) of a
+        download paused before the bitmap, which is only converted once the download is resumed"""
+        try:
+            with open(path, "rb") as file:
+                header = file.read(cls._BITS_AT)
+                if header[:len(cls.MAGIC)] != cls.MAGIC:
+                    return 0
+                return int.from_bytes(file.read(), "little").bit_count()
+        except FileNotFoundError:
+            pass
+
+        if log_path:
+            try:
+                with open(log_path) as file:
+                    return len({line.split()[1] for line in file if line.startswith("SEGMENT")})
+            except FileNotFoundError:
+                pass
+        return 0
+
+    @classmethod
+    def from_log(cls, path: str | Path, log_path: str | Path, count: int, mode: str = "concat") -> ResumeBitmap:
+        """bitmap of a download started with the `SEGMENT n [offset]` text log, which is removed once converted"""
+        lines = []
+        with open(log_path) as file:
+            for line in file:
+                if line.startswith("SEGMENT"):
+                    lines.append(line.split())
+
+        if lines:
+            mode = "append" if len(lines[-1]) > 2 else "concat"
+        bitmap = cls(path, count, mode)
+        for line in lines:
+            bitmap.add(int(line[1]))
+        if mode == "append" and lines:
+            bitmap.append(int(lines[-1][1]), int(lines[-1][2]))
+        bitmap.flush()
+        os.remove(log_path)
+        return bitmap
+
+    @property
+    def mode(self) -> str:
+        return self.MODES[self._map[len(self.MAGIC)]]
+
+    @mode.setter
+    def mode(self, mode: str) -> None:
+        self._map[len(self.MAGIC)] = self.MODES.index(mode)
+
+    @property
+    def appended(self) -> tuple[int | None, int]:
+        """last segment appended to the output (None before the first one) and the output size after it"""
+        word, = self._APPENDED.unpack_from(self._map, self._APPENDED_AT)
+        segment = word >> self._OFFSET_BITS
+        return None if segment == self._NONE else segment, word & ((1 << self._OFFSET_BITS) - 1)
+
+    @property
+    def offset(self) -> int:
+        return self.appended[1]
+
+    def __contains__(self, segment: int) -> bool:
+        return bool(self._bits[segment >> 3] & (1 << (segment & 7)))
+
+    def remaining(self) -> Iterator[int]:
+        """segments not downloaded yet, in order"""
+        for i, byte in enumerate(bytes(self._bits)):
+            if byte == 0xFF:
+                continue
+            for segment in range(i * 8, min(i * 8 + 8, self.count)):
+                if not byte & (1 << (segment & 7)):
+                    yield segment
+
+    def add(self, segment: int) -> None:
+        if segment not in self:
+            self._set(segment)
+            self.done += 1
+        if monotonic() - self._last_flush >= self._flush_interval:
+            self.flush()
+
+    def append(self, segment: int, offset: int) -> None:
+        """segment was appended to the output, which is now offset bytes long"""
+        self._APPENDED.pack_into(self._map, self._APPENDED_AT, segment << self._OFFSET_BITS | offset)
+        self.add(segment)
+
+    def output_intact(self, output: str | Path) -> bool:
+        """whether the output (append mode) holds everything recorded as appended, a missing or cut one can't be
+        resumed from the offset"""
+        try:
+            return os.path.getsize(output) >= self.offset
+        except FileNotFoundError:
+            return not self.offset
+
+    def reset(self) -> None:
+        """forget every downloaded segment, the download starts over"""
+        self._bits[:] = bytes(len(self._bits))
+        self._APPENDED.pack_into(self._map, self._APPENDED_AT, self._NONE << self._OFFSET_BITS)
+        self.done = 0
+        self.flush()
+
+    def _set(self, segment: int) -> None:
+        self._bits[segment >> 3] |= 1 << (segment & 7)
+
+    def flush(self) -> None:
+        self._map.flush()
+        self._last_flush = monotonic()
+
+    def close(self) -> None:
+        if self._map.closed:
+            return
+        self.flush()
+        self._bits.release()
+        self._map.close()
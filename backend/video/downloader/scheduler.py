@@ -0,0 +1,117 @@
+from __future__ import annotations
+import asyncio
+from collections import deque
+from threading import Lock
+from typing import Deque, Dict, Iterable, List
+from utils import DB
+
+
+class TaskScheduler:
+    """
+    Queue of download task ids handing out the task that should run next, rather than the oldest one.
+
+    Tasks are ordered by priority (higher first), then by the order set by the user (seq, lower first), then round
+    robin across series (the series served least recently first), then smallest first and finally in queue order.
+    Priority and order of queued tasks can be changed without taking them out, both are kept in the download_queue
+    table so they survive restarts.
+    put / set_priority / move_to_front may be called from another thread than the loop awaiting get.
+    """
+
+    def __init__(self) -> None:
+        self._queued: Dict[int, tuple] = {}  # task id -> (series, size)
+        self._rows: Dict[int, List[int]] = None  # task id -> [priority, seq, added], backed by the download_queue table
+        self._last_added = 0
+        self._served: Dict[str, int] = {}  # series -> turn it was last served at
+        self._turn = 0
+        self._lock = Lock()
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    def __len__(self) -> int:
+        return len(self._queued)
+
+    def __contains__(self, task_id: int) -> bool:
+        return task_id in self._queued
+
+    def _load_rows(self) -> Dict[int, List[int]]:
+        if self._rows is None:
+            cur = DB.connection.cursor()
+            self._rows = {row[0]: list(row[1:]) for row in
+                          cur.execute("SELECT task_id, priority, seq, added FROM download_queue")}
+            cur.close()
+            self._last_added = max((row[2] for row in self._rows.values()), default=0)
+        return self._rows
+
+    def _save_rows(self, task_ids: Iterable[int]) -> None:
+        cur = DB.connection.cursor()
+        cur.executemany("INSERT OR REPLACE INTO download_queue (task_id, priority, seq, added) VALUES (?, ?, ?, ?)",
+                        [(task_id, *self._rows[task_id]) for task_id in task_ids])
+        DB.connection.commit()
+        cur.close()
+
+    def _order(self, task_id: int) -> tuple:
+        series, size = self._queued[task_id]
+        priority, seq, added = self._rows[task_id]
+        return -priority, seq, self._served.get(series, -1), size, added
+
+    def put(self, task_id: int, series: str, size: int, priority: int = None) -> None:
+        """queue a task, a task queued before (restart, resume) keeps its priority and order unless priority is passed"""
+        with self._lock:
+            rows = self._load_rows()
+            if task_id not in rows:
+                self._last_added += 1
+                rows[task_id] = [priority or 0, 0, self._last_added]
+                self._save_rows((task_id,))
+            elif priority is not None and rows[task_id][0] != priority:
+                rows[task_id][0] = priority
+                self._save_rows((task_id,))
+
+            self._queued[task_id] = (series, size)
+            self._wake()
+
+    async def get(self) -> int:
+        while True:
+            with self._lock:
+                if self._queued:
+                    task_id = min(self._queued, key=self._order)
+                    series, _ = self._queued.pop(task_id)
+                    self._served[series] = self._turn
+                    self._turn += 1
+                    return task_id
+
+                waiter = asyncio.get_running_loop().create_future()
+                self._waiters.append(waiter)
+            await waiter
+
+    def _wake(self) -> None:
+        # every waiter checks the queue again, waiters of another thread's loop are woken through that loop
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            waiter.get_loop().call_soon_threadsafe(lambda w=waiter: w.done() or w.set_result(None))
+
+    def set_priority(self, task_ids: Iterable[int], priority: int) -> None:
+        with self._lock:
+            rows = self._load_rows()
+            task_ids = [task_id for task_id in task_ids if task_id in rows]
+            for task_id in task_ids:
+                rows[task_id][0] = priority
+            self._save_rows(task_ids)
+
+    def move_to_front(self, task_ids: List[int]) -> None:
+        """run task_ids before the other tasks of their priority, in the given order"""
+        with self._lock:
+            rows = self._load_rows()
+            task_ids = [task_id for task_id in task_ids if task_id in rows]
+            first = min((row[1] for row in rows.values()), default=0)
+            for i, task_id in enumerate(task_ids):
+                rows[task_id][1] = first - len(task_ids) + i
+            self._save_rows(task_ids)
+
+    def forget(self, task_id: int) -> None:
+        """task finished or was cancelled, it is dropped from the queue and the download_queue table"""
+        with self._lock:
+            self._queued.pop(task_id, None)
+            if self._load_rows().pop(task_id, None) is not None:
+                cur = DB.connection.cursor()
+                cur.execute("DELETE FROM download_queue WHERE task_id=?", (task_id,))
+                DB.connection.commit()
+                cur.close()
@@ -0,0 +1,97 @@
+from __future__ import annotations
+import asyncio
+import os
+from pathlib import Path
+from typing import BinaryIO, Callable, Dict, Iterable
+
+
+class SegmentWriter:
+    """
+    Writes the segments of a download to a single sink (output file or ffmpeg's stdin) in playlist order, whatever
+    order they are downloaded in.
+    Segments arriving before their turn wait in memory, past `max_buffered` bytes they wait in files of `spill_dir`.
+    `on_written(segment_number, offset)` is called once a segment is in the sink, offset being the sink size after it.
+    """
+
+    def __init__(
+            self,
+            sink: BinaryIO,
+            order: Iterable[int],
+            spill_dir: Path,
+            max_buffered: int,
+            offset: int = 0,
+            on_written: Callable[[int, int], None] = None
+    ) -> None:
+        self._sink = sink
+        self._order = iter(order)
+        self._next = next(self._order, None)
+        self._spill_dir = spill_dir
+        self._max_buffered = max_buffered
+        self._buffered = 0
+        self._early: Dict[int, bytes | Path] = {}
+        self._on_written = on_written
+        self.offset = offset
+
+    @property
+    def done(self) -> bool:
+        return self._next is None
+
+    async def add(self, segment_number: int, data: bytes | memoryview) -> None:
+        """data is only used until this returns"""
+        if segment_number != self._next:
+            await self._in_thread(self._keep, segment_number, data)
+            return
+
+        await self._in_thread(self._write, segment_number, data)
+        while self._next in self._early:
+            await self._in_thread(self._write_early, self._next)
+
+    @staticmethod
+    async def _in_thread(func: Callable, *args) -> None:
+        """a cancelled caller still waits for the thread, it may be using memory the caller releases afterwards"""
+        future = asyncio.ensure_future(asyncio.to_thread(func, *args))
+        try:
+            await asyncio.shield(future)
+        except asyncio.CancelledError:
+            await asyncio.wait((future,))
+            raise
+
+    def _keep(self, segment_number: int, data: bytes | memoryview) -> None:
+        if self._buffered + len(data) <= self._max_buffered:
+            self._early[segment_number] = bytes(data)
+            self._buffered += len(data)
+            return
+
+        spill_file = self._spill_dir.joinpath(f"segment-{segment_number}.spill")
+        with open(spill_file, "wb") as file:
+            file.write(data)
+        self._early[segment_number] = spill_file
+
+    def _take(self, segment_number: int) -> bytes:
+        data = self._early.pop(segment_number)
+        if isinstance(data, Path):
+            with open(data, "rb") as file:
+                spilled = file.read()
+            os.remove(data)
+            return spilled
+
+        self._buffered -= len(data)
+        return data
+
+    def close(self) -> None:
+        self._sink.close()
+        for data in self._early.values():  # only left when the download stopped before its end
+            if isinstance(data, Path):
+                os.remove(data)
+        self._early.clear()
+
+    def _write_early(self, segment_number: int) -> None:
+        self._write(segment_number, self._take(segment_number))
+
+    def _write(self, segment_number: int, data: bytes | memoryview) -> None:
+        self._sink.write(data)
+        self._sink.flush()  # segment must be in the sink before it is recorded as resumable
+        self.offset += len(data)
+        self._next = next(self._order, None)
+        if self._on_written:
+            self._on_written(segment_number, self.offset)
@@ -0,0 +1,111 @@
+from __future__ import annotations
+import asyncio
+import os
+import sys
+from multiprocessing import shared_memory, resource_tracker
+
+
+class SharedRing:
+    """
+    Fixed size slots in shared memory, used to hand downloaded segments to another process without pickling them.
+
+    The producer copies a payload into a free slot and sends only (slot, length) to the consumer, the consumer reads
+    the payload straight from shared memory and marks the slot DONE (or FAILED) once handled.
+    First `slots` bytes of the block hold the state of each slot, a slot is only written by the producer while FREE
+    and only read by the consumer while FILLED. DONE / FAILED slots are reused once the producer has seen the outcome
+    and released them.
+    """
+    FREE: int = 0
+    FILLED: int = 1
+    DONE: int = 2
+    FAILED: int = 3
+
+    def __init__(self, slots: int, slot_size: int, name: str = None, tracker: int = None):
+        self.slots = slots
+        self.slot_size = slot_size
+        self._owner_pid = os.getpid() if name is None else None  # forked children get a copy of the owner's object
+        if name is None:
+            self._shm = shared_memory.SharedMemory(create=True, size=slots + slots * slot_size)
+            self._shm.buf[:slots] = bytes(slots)
+            self.tracker = self._tracker_pid()
+        elif sys.version_info >= (3, 13):
+            self._shm = shared_memory.SharedMemory(name=name, track=False)
+            self.tracker = tracker
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+            self.tracker = tracker
+            if os.name == "posix" and self._tracker_pid() != tracker:
+                # attaching registered the block with a tracker of its own, which would unlink it when this process
+                # exits. A tracker shared with the owner must keep it, the owner unregisters it when unlinking.
+                resource_tracker.unregister(self._shm._name, "shared_memory")  # noqa
+        self._next = 0
+        self._freed: asyncio.Event = None  # set by release(), for the producer waiting in put()
+
+    def __reduce__(self):
+        # child processes attach to the same block
+        return self.__class__, (self.slots, self.slot_size, self._shm.name, self.tracker)
+
+    @staticmethod
+    def _tracker_pid() -> int | None:
+        """pid of the resource tracker this process registers shared memory with"""
+        return getattr(resource_tracker._resource_tracker, "_pid", None)  # noqa
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    def _offset(self, slot: int) -> int:
+        return self.slots + slot * self.slot_size
+
+    def try_put(self, data: bytes) -> int | None:
+        """copy data into a free slot, None when every slot is in use"""
+        states = self._shm.buf
+        for i in range(self.slots):
+            slot = (self._next + i) % self.slots
+            if states[slot] == self.FREE:
+                states[slot] = self.FILLED
+                offset = self._offset(slot)
+                self._shm.buf[offset:offset + len(data)] = data
+                self._next = (slot + 1) % self.slots
+                return slot
+        return None
+
+    async def put(self, data: bytes) -> int | None:
+        """wait for a free slot and copy data into it, None when data doesn't fit in a slot"""
+        if len(data) > self.slot_size:
+            return None
+        while (slot := self.try_put(data)) is None:
+            if self._freed is None:
+                self._freed = asyncio.Event()
+            self._freed.clear()
+            await self._freed.wait()
+        return slot
+
+    def view(self, slot: int, length: int) -> memoryview:
+        """payload of a filled slot, the view must be released before the slot"""
+        offset = self._offset(slot)
+        return self._shm.buf[offset:offset + length]
+
+    def state(self, slot: int) -> int:
+        return self._shm.buf[slot]
+
+    def release(self, slot: int) -> None:
+        self._shm.buf[slot] = self.FREE
+        if self._freed:
+            self._freed.set()
+
+    def done(self, slot: int) -> None:
+        self._shm.buf[slot] = self.DONE
+
+    def fail(self, slot: int) -> None:
+        self._shm.buf[slot] = self.FAILED
+
+    @property
+    def owned(self) -> bool:
+        """whether this process created the block, and removes it on close"""
+        return self._owner_pid == os.getpid()
+
+    def close(self) -> None:
+        self._shm.close()
+        if self.owned:
+            self._shm.unlink()
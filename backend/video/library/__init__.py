@@ -1 +1 @@
-from .library import DBLibrary, Library
+from .library import DBLibrary, Library, WatchList
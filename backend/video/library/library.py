@@ -91,7 +91,7 @@ class Library(ABC):
         except IntegrityError:
             raise ValueError("Record already exist")
 
-        cls.data[data["id"]] = data
+        cls.data[data[cls.oid]] = data
 
     @classmethod
     def delete(cls, _id: int) -> None:
@@ -122,6 +122,7 @@ class DBLibrary(Library):
 
 
 class WatchList(Library):
+    data: Dict[int, Dict[str, Any]] = {}  # own index, ids of both tables overlap
     table_name: str = "watchlist"
     fields: str = "anime_id, jp_name, no_of_episodes, type, status, season, year, score, poster, ep_details, created_on"
     oid: str = "anime_id"
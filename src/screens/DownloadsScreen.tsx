@@ -44,45 +44,35 @@ export function DownloadScreen() {
     const onMessageListner = () => {
         // @ts-ignore
         client.onmessage = (message) => {
-            let packet = JSON.parse(message.data);
-            let { data } = packet;
+            // a frame holds the msgs of a tick, only the latest one of each download
+            let packets = JSON.parse(message.data);
+            if (!Array.isArray(packets)) packets = [packets];
+            packets = packets.filter(({ data }) => data); // other msgs (decrypt service stats) aren't downloads
 
-            let tempData = data;
+            const isFinished = (data) => data.downloaded === data.total_size && data.total_size > 0;
 
             setFilesStatus((prev) => {
-                let temp = filesStatus;
-
-                if (tempData.downloaded === tempData.total_size && tempData.total_size > 0) {
-                    if (!filesStatus) return {};
-                    // @ts-ignore
-                    const { [tempData.id]: removedProperty, ...restObject } = filesStatus;
-
-                    // sleep(5000);
-                    // @ts-ignore
-                    dispatch(getDownloadHistory());
-
-                    return restObject;
-                } else {
-                    temp[tempData.id] = tempData;
-                    let sec = {};
-                    if (historyDetails?.details) {
-                        historyDetails?.details?.forEach((history_item) => {
-                            if (history_item.status !== "downloaded")
-                                sec[history_item.id] = history_item;
-                        });
-                        return { ...sec, ...temp };
-                    } else {
-                        return filesStatus;
+                let sec = {};
+                historyDetails?.details?.forEach((history_item) => {
+                    if (history_item.status !== "downloaded")
+                        sec[history_item.id] = history_item;
+                });
+
+                // packets of a frame are applied in order, each on top of the previous ones
+                return packets.reduce((status, { data }) => {
+                    if (isFinished(data)) {
+                        // @ts-ignore
+                        const { [data.id]: removedProperty, ...restObject } = status;
+                        return restObject;
                     }
-                }
-
-                // console.log(temp);
+                    return { ...status, [data.id]: data };
+                }, historyDetails?.details ? { ...sec, ...(prev || {}) } : { ...(prev || {}) });
             });
 
-            // if (tempData.downloaded === tempData.total_size) {
-            //   console.time()
-            //   console.time()
-            // }
+            if (packets.some(({ data }) => isFinished(data))) {
+                // @ts-ignore
+                dispatch(getDownloadHistory());
+            }
         };
     };
 
@@ -101,7 +91,7 @@ export function DownloadScreen() {
     useEffect(() => {
         if (!client) return;
         onMessageListner();
-    }, [filesStatus]);
+    }, [client, historyDetails]);
 
     const cancelDownloadHandler = (id) => {
         cancelLiveDownload(id);